@@ -0,0 +1,283 @@
+"""Audio features for /mood, computed from the shared MP3 folder.
+
+ffmpeg decodes to mono 16-bit PCM on a pipe; the samples are consumed in
+fixed-size blocks, so memory stays flat however long the track is. Per
+frame we keep only RMS, zero-crossing rate, spectral centroid and spectral
+flux (the onset envelope for the tempo estimate).
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+SAMPLE_RATE = 22050
+FRAME = 1024
+HOP = 512
+BLOCK_FRAMES = 256  # frames analysed per numpy batch (~6 s of audio); bounds peak memory
+# Analysing the first few minutes is plenty for mood, and bounds the work per track
+MAX_SECONDS = float(os.getenv('MOOD_MAX_SECONDS', '240'))
+
+MOOD_CACHE_PATH = os.getenv('MOOD_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mood_features.sqlite3'))
+MOOD_WORKERS = int(os.getenv('MOOD_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+
+MOODS = ['happy', 'sad', 'energetic', 'calm', 'angry', 'romantic']
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Decode + features of one track, including the wait for a free pool worker
+ANALYSIS_SECONDS = metrics.histogram('mood_analysis_duration_seconds', 'Mood feature extraction per track')
+ANALYSIS_ERRORS = metrics.counter('mood_analysis_errors_total', 'Mood feature extractions that failed')
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def _pcm_blocks(path, block_samples):
+    cmd = [FFMPEG_BINARY, '-v', 'error', '-nostdin', '-i', path, '-t', str(MAX_SECONDS),
+           '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-']
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError as e:
+        raise AudioDecodeError(f'{FFMPEG_BINARY} not found; install ffmpeg or set FFMPEG_BINARY') from e
+    try:
+        while True:
+            data = proc.stdout.read(block_samples * 2)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2').astype(np.float32) / 32768.0
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read().decode(errors='replace').strip()
+        proc.stderr.close()
+        if proc.wait() != 0:
+            raise AudioDecodeError(stderr or f'ffmpeg exited with {proc.returncode}')
+
+
+def extract_features(path):
+    """Feature dict for one audio file."""
+    window = np.hanning(FRAME).astype(np.float32)
+    freqs = np.fft.rfftfreq(FRAME, 1.0 / SAMPLE_RATE).astype(np.float32)
+    rms, zcr, centroid, flux = [], [], [], []
+    prev_mag = None
+    carry = np.zeros(0, dtype=np.float32)
+    for block in _pcm_blocks(path, BLOCK_FRAMES * HOP):
+        samples = np.concatenate([carry, block])
+        if len(samples) < FRAME:
+            carry = samples
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP]
+        # The samples the next block's first frame still needs
+        carry = samples[len(frames) * HOP:]
+        rms.append(np.sqrt(np.mean(frames ** 2, axis=1)))
+        zcr.append(np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1))
+        mag = np.abs(np.fft.rfft(frames * window, axis=1))
+        total = mag.sum(axis=1)
+        centroid.append(np.where(total > 1e-6, (mag @ freqs) / np.maximum(total, 1e-6), 0.0))
+        # Half-wave rectified spectral flux of log magnitudes: peaks on note/beat onsets
+        log_mag = np.log1p(mag)
+        if prev_mag is None:
+            prev_mag = log_mag[:1]
+        diff = np.diff(np.concatenate([prev_mag, log_mag]), axis=0)
+        flux.append(np.maximum(diff, 0).sum(axis=1))
+        prev_mag = log_mag[-1:]
+    if not rms:
+        raise AudioDecodeError(f'No audio decoded from {path}')
+    rms, zcr, centroid, flux = (np.concatenate(x) for x in (rms, zcr, centroid, flux))
+    loud = rms > max(rms.max() * 0.05, 1e-4)  # ignore silence in averages
+    if not loud.any():
+        loud = np.ones_like(rms, dtype=bool)
+    return {
+        'duration': round(len(rms) * HOP / SAMPLE_RATE, 2),
+        'rms_db': round(float(20 * np.log10(np.mean(rms[loud]) + 1e-9)), 2),
+        'dynamics_db': round(float(20 * np.log10((np.percentile(rms[loud], 95) + 1e-9) /
+                                                  (np.percentile(rms[loud], 10) + 1e-9))), 2),
+        'centroid_hz': round(float(np.mean(centroid[loud])), 1),
+        'zcr': round(float(np.mean(zcr[loud])), 4),
+        'tempo_bpm': round(estimate_tempo(flux), 1),
+    }
+
+
+def estimate_tempo(onset, low=60, high=180):
+    """Autocorrelation peak of the onset envelope within [low, high] BPM."""
+    frame_rate = SAMPLE_RATE / HOP
+    onset = onset - onset.mean()
+    if len(onset) < 2 or not onset.any():
+        return 0.0
+    n = 1 << (2 * len(onset) - 1).bit_length()
+    spectrum = np.fft.rfft(onset, n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum), n)[:len(onset)]
+    min_lag = int(frame_rate * 60 / high)
+    max_lag = min(int(frame_rate * 60 / low) + 1, len(ac) - 1)
+    if max_lag <= min_lag:
+        return 0.0
+    lags = np.arange(min_lag, max_lag)
+    # Mild preference for ~120 BPM, the usual fix for picking half/double tempo
+    weight = np.exp(-0.5 * np.log2((frame_rate * 60 / lags) / 120.0) ** 2)
+    lag = lags[np.argmax(ac[min_lag:max_lag] * weight)]
+    return float(frame_rate * 60 / lag)
+
+
+def classify_mood(f):
+    """Map features onto MOODS with simple, explainable scores."""
+    def ramp(x, lo, hi):
+        return float(np.clip((x - lo) / (hi - lo), 0.0, 1.0))
+
+    tempo = f['tempo_bpm']
+    loud = ramp(f['rms_db'], -30, -12)  # 0 = quiet, 1 = loud
+    bright = ramp(f['centroid_hz'], 1200, 3500)  # 0 = dark/warm, 1 = bright
+    fast = ramp(tempo, 80, 140)
+    noisy = ramp(f['zcr'], 0.05, 0.15)
+    scores = {
+        'energetic': 0.45 * fast + 0.4 * loud + 0.15 * bright,
+        'angry': 0.4 * loud + 0.3 * noisy + 0.3 * bright - 0.1 * (1 - fast),
+        'happy': 0.4 * bright + 0.35 * fast + 0.25 * (1 - abs(loud - 0.6)),
+        'calm': 0.4 * (1 - loud) + 0.35 * (1 - fast) + 0.25 * (1 - bright),
+        'sad': 0.4 * (1 - bright) + 0.4 * (1 - fast) + 0.2 * (1 - loud) - 0.1,
+        'romantic': 0.4 * (1 - abs(fast - 0.35)) + 0.35 * (1 - bright) + 0.25 * (1 - abs(loud - 0.4)) - 0.1,
+    }
+    return max(MOODS, key=lambda m: scores[m])
+
+
+def analyze(path):
+    """Worker entry point (runs in the process pool): features + mood for one file."""
+    features = extract_features(path)
+    features['mood'] = classify_mood(features)
+    return features
+
+
+class FeatureCache:
+    """video_id -> feature dict, in SQLite, so each track is decoded once."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS features (
+                video_id TEXT PRIMARY KEY,
+                features TEXT NOT NULL,
+                computed_at REAL NOT NULL
+            )''')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, video_id):
+        db = self._connect()
+        try:
+            row = db.execute('SELECT features FROM features WHERE video_id=?', (video_id,)).fetchone()
+        finally:
+            db.close()
+        return json.loads(row[0]) if row else None
+
+    def known(self):
+        db = self._connect()
+        try:
+            return {row[0] for row in db.execute('SELECT video_id FROM features')}
+        finally:
+            db.close()
+
+    def put(self, video_id, features):
+        db = self._connect()
+        try:
+            with metrics.sqlite_write('mood_features'), db:
+                db.execute('INSERT OR REPLACE INTO features (video_id, features, computed_at) VALUES (?, ?, ?)',
+                           (video_id, json.dumps(features), time.time()))
+        finally:
+            db.close()
+
+
+class MoodService:
+    """Features for tracks in the MP3 folder: cache first, else one pool job per video_id.
+
+    Analysis runs in a process pool (decoding and FFTs are CPU-bound), and
+    concurrent requests for the same track share one job. analyze_new()
+    queues every downloaded track without cached features, so /mood for a
+    fresh download is usually a cache hit.
+    """
+
+    def __init__(self, mp3_folder, cache=None, workers=MOOD_WORKERS):
+        self.mp3_folder = mp3_folder
+        self.cache = cache or FeatureCache(MOOD_CACHE_PATH)
+        self.workers = workers
+        self._pool = None
+        self._inflight = {}
+        self._known = set()  # video_ids with cached features (or that failed to decode)
+
+    async def start(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._known = await asyncio.to_thread(self.cache.known)
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def inflight(self):
+        """Analyses running or waiting for a pool worker."""
+        return len(self._inflight)
+
+    def path_for(self, video_id):
+        """The downloaded file for `video_id`, or None (ids are validated, never joined raw)."""
+        if not VIDEO_ID_RE.match(video_id or ''):
+            return None
+        path = os.path.join(self.mp3_folder, f'{video_id}.mp3')
+        return path if os.path.isfile(path) else None
+
+    async def features(self, video_id):
+        """Feature dict (with 'mood'), or None if the track isn't downloaded. Raises AudioDecodeError."""
+        if video_id in self._known:
+            cached = await asyncio.to_thread(self.cache.get, video_id)
+            if cached is not None:
+                return cached
+        task = self._inflight.get(video_id)
+        if task is None:
+            path = self.path_for(video_id)
+            if path is None:
+                return None
+            task = self._inflight[video_id] = asyncio.ensure_future(self._analyze(video_id, path))
+            task.add_done_callback(lambda _: self._inflight.pop(video_id, None))
+        return await asyncio.shield(task)
+
+    async def _analyze(self, video_id, path):
+        loop = asyncio.get_running_loop()
+        with ANALYSIS_SECONDS.time(errors=ANALYSIS_ERRORS):
+            features = await loop.run_in_executor(self._pool, analyze, path)
+        await asyncio.to_thread(self.cache.put, video_id, features)
+        self._known.add(video_id)
+        return features
+
+    async def analyze_new(self):
+        """Analyse every downloaded track that has no cached features yet, at most `workers` at a time."""
+        if self._pool is None or not os.path.isdir(self.mp3_folder):
+            return 0
+        pending = [name[:-4] for name in os.listdir(self.mp3_folder)
+                   if name.endswith('.mp3') and not name.startswith('.') and name[:-4] not in self._known]
+        done = 0
+        for i in range(0, len(pending), self.workers):
+            results = await asyncio.gather(*(self.features(v) for v in pending[i:i + self.workers]),
+                                           return_exceptions=True)
+            for video_id, result in zip(pending[i:i + self.workers], results):
+                if isinstance(result, AudioDecodeError):
+                    # Don't retry a broken file on every pass
+                    logger.warning(f"Mood analysis failed for {video_id}: {result}")
+                    self._known.add(video_id)
+                elif isinstance(result, dict):
+                    done += 1
+        if done:
+            logger.info(f"Mood: analysed {done} new tracks")
+        return done
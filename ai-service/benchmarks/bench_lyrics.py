@@ -0,0 +1,139 @@
+"""/lyrics: the old blocking requests.get per call vs LyricsService, against a local stub upstream.
+
+The stub speaks the lyrics.ovh API (404 for "not found") with a fixed delay.
+Requests are drawn from --songs distinct artist/title pairs (skewed, like real
+traffic, and with casing/suffix variants of the same song), --concurrency at a
+time. The old path runs on a 40-thread pool, like FastAPI's default for sync
+endpoints.
+
+    python benchmarks/bench_lyrics.py --requests 2000 --songs 200 --delay 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# metrics.py, shared with the bot backend
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'zira-music-bot', 'backend')))
+
+from lyrics import LyricsCache, LyricsOvhProvider, LyricsService
+
+
+def start_stub(delay):
+    calls = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            calls[0] += 1
+            time.sleep(delay)
+            title = unquote(self.path.rsplit('/', 1)[-1])
+            if 'missing' in title.lower():
+                status, body = 404, {'error': 'No lyrics found'}
+            else:
+                status, body = 200, {'lyrics': f'la la la {title}\n' * 20}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/v1', calls
+
+
+def make_workload(count, songs, seed=7):
+    rng = random.Random(seed)
+    variants = ['{t}', '{t} (Official Video)', '{T}', '  {t} [Lyrics]']
+    workload = []
+    for _ in range(count):
+        n = min(int(rng.paretovariate(1.2)) - 1, songs - 1)
+        title = f'Song {n}' if n % 10 else f'Missing {n}'
+        workload.append((f'Artist {n % 37}', rng.choice(variants).format(t=title, T=title.upper())))
+    return workload
+
+
+def old_lyrics(base_url, artist, title):
+    # The endpoint before: a fresh connection and no cache per call
+    try:
+        resp = requests.get(f'{base_url}/{artist}/{title}', timeout=10)
+        return resp.json().get('lyrics', 'Not found')
+    except requests.exceptions.RequestException as e:
+        return f'Error: {e}'
+
+
+async def run(workload, concurrency, call):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(artist, title):
+        async with sem:
+            started = time.perf_counter()
+            await call(artist, title)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(a, t) for a, t in workload))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def report(name, workload, elapsed, latencies, upstream):
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{name:>14}  {len(workload) / elapsed:>8.0f} req/s  p50 {pct(0.5):7.1f} ms  p99 {pct(0.99):7.1f} ms  "
+          f"upstream calls {upstream}")
+
+
+async def main_async(args):
+    server, base_url, calls = start_stub(args.delay)
+    workload = make_workload(args.requests, args.songs)
+
+    pool = ThreadPoolExecutor(max_workers=40)
+    loop = asyncio.get_running_loop()
+    elapsed, latencies = await run(workload, args.concurrency,
+                                   lambda a, t: loop.run_in_executor(pool, old_lyrics, base_url, a, t))
+    report('old', workload, elapsed, latencies, calls[0])
+    pool.shutdown()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, 'lyrics.sqlite3')
+        for label in ('LyricsService', 'warm restart'):
+            calls[0] = 0
+            service = LyricsService(provider=LyricsOvhProvider(base_url), cache=LyricsCache(cache_path))
+            await service.start()
+            elapsed, latencies = await run(workload, args.concurrency, service.get)
+            report(label, workload, elapsed, latencies, calls[0])
+            print(f"{'':>14}  {service.stats}")
+            await service.close()
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--songs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--delay', type=float, default=0.05, help='stub upstream latency (s)')
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Recommender: ingest and query cost at catalog scale, plus a sanity check on quality.
+
+Synthetic play log: --tracks tracks in 500 taste clusters, users who
+listen to 1-3 clusters in sessions, Zipf popularity inside each cluster.
+Compares against the old /personal_recommend (genre/mood nested loop over
+history x catalog) for query time, and against "most played" for how often
+a recommendation lands in the user's own clusters.
+
+    python benchmarks/bench_recommender.py --tracks 50000 --events 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from recommender import Recommender
+
+CLUSTERS = 500
+
+
+def make_log(tracks, events, users, rng):
+    cluster_of = rng.integers(0, CLUSTERS, tracks)
+    members = [np.nonzero(cluster_of == c)[0] for c in range(CLUSTERS)]
+    tastes = [rng.choice(CLUSTERS, rng.integers(1, 4), replace=False) for _ in range(users)]
+    user_col, track_col, time_col = [], [], []
+    now, made = 1.7e9, 0
+    while made < events:
+        size = int(rng.integers(5, 25))
+        user = int(rng.integers(users))
+        pool = members[rng.choice(tastes[user])]
+        ranks = np.minimum(rng.zipf(1.3, size) - 1, len(pool) - 1)
+        user_col.append(np.full(size, user))
+        track_col.append(pool[ranks])
+        time_col.append(now + np.arange(size) * 200.0)
+        now += 30.0
+        made += size
+    return (np.concatenate(user_col)[:events], np.concatenate(track_col)[:events],
+            np.concatenate(time_col)[:events], cluster_of, tastes)
+
+
+def old_personal_recommend(history, songs):
+    user_genres, user_moods = set(), set()
+    for title in history:
+        for song in songs:
+            if song['title'] == title:
+                user_genres.add(song['genre'])
+                user_moods.add(song['mood'])
+    return [s for s in songs if (s['genre'] in user_genres or s['mood'] in user_moods)
+            and s['title'] not in history][:5]
+
+
+def percentile(samples, p):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=50000)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--batch', type=int, default=50000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(7)
+
+    users, tracks, times, cluster_of, tastes = make_log(args.tracks, args.events, args.users, rng)
+    video_ids = [f'vid{t:08d}' for t in range(args.tracks)]
+    print(f"{args.events} plays of {len(np.unique(tracks))} distinct tracks by {args.users} users")
+
+    rec = Recommender()
+    start = time.perf_counter()
+    for i in range(0, args.events, args.batch):
+        rec.add_plays(users[i:i + args.batch], [video_ids[t] for t in tracks[i:i + args.batch]],
+                      times[i:i + args.batch])
+    print(f"ingest: {time.perf_counter() - start:.1f} s "
+          f"({args.events / (time.perf_counter() - start):,.0f} plays/s, batches of {args.batch})")
+
+    # Incremental updates of the size the play log poller sees
+    samples = []
+    for _ in range(50):
+        i = int(rng.integers(args.events - 100))
+        start = time.perf_counter()
+        rec.add_plays(users[i:i + 100], [video_ids[t] for t in tracks[i:i + 100]], times[i:i + 100] + 1e6)
+        samples.append(time.perf_counter() - start)
+    print(f"add 100 plays: p50 {percentile(samples, 50):.2f} ms, p99 {percentile(samples, 99):.2f} ms")
+
+    samples, in_taste, popular_in_taste = [], 0, 0
+    popular = rec.recommend([], k=5)
+    for _ in range(args.queries):
+        user = int(rng.integers(args.users))
+        pool = np.nonzero(np.isin(cluster_of, tastes[user]))[0]
+        history = [video_ids[t] for t in rng.choice(pool, min(20, len(pool)), replace=False)]
+        queue = [video_ids[t] for t in rng.choice(pool, min(10, len(pool)), replace=False)]
+        start = time.perf_counter()
+        result = rec.recommend(history + queue, k=5)
+        samples.append(time.perf_counter() - start)
+        ids = {r['video_id'] for r in result}
+        assert not ids & set(history + queue), 'recommended a track from the history or queue'
+        in_taste += sum(cluster_of[int(r['video_id'][3:])] in tastes[user] for r in result)
+        popular_in_taste += sum(cluster_of[int(r['video_id'][3:])] in tastes[user] for r in popular)
+    print(f"recommend (history 20 + queue 10, k=5): p50 {percentile(samples, 50):.2f} ms, "
+          f"p99 {percentile(samples, 99):.2f} ms")
+    print(f"  in the user's clusters: {in_taste / (5 * args.queries):.0%} "
+          f"(most-played baseline {popular_in_taste / (5 * args.queries):.0%})")
+
+    songs = [{'title': f'Song {t}', 'genre': f'g{cluster_of[t] % 6}', 'mood': f'm{cluster_of[t] % 6}'}
+             for t in range(args.tracks)]
+    samples = []
+    for _ in range(5):
+        history = [f'Song {t}' for t in rng.integers(0, args.tracks, 20)]
+        start = time.perf_counter()
+        old_personal_recommend(history, songs)
+        samples.append(time.perf_counter() - start)
+    print(f"old nested loop (history 20): p50 {percentile(samples, 50):.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""/ai_play search: difflib over every title (the old fuzzy step) vs TrackIndex.
+
+Synthetic catalog of --tracks titles built from a word list; queries are
+exact titles, titles with typos, and partial titles.
+
+    python benchmarks/bench_search_index.py --tracks 100000 --queries 300
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from search_index import TrackIndex
+
+SYLLABLES = ['la', 'ma', 'ri', 'ko', 'sun', 'dan', 'tel', 'vi', 'mor', 'zen', 'pa', 'lo', 'ne', 'shi', 'ra', 'tu']
+
+
+def make_words(count, rng):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_tracks(count, rng):
+    words = make_words(5000, rng)
+    artists = [' '.join(rng.sample(words, 2)).title() for _ in range(count // 20 + 1)]
+    return [{'title': ' '.join(rng.choice(words) for _ in range(rng.randint(2, 5))).title(),
+             'artist': rng.choice(artists), 'video_id': f'vid{i:08d}', 'src': f'/static/mp3/vid{i:08d}.mp3'}
+            for i in range(count)]
+
+
+def typo(text, rng):
+    i = rng.randrange(len(text))
+    return text[:i] + rng.choice('aeiourst') + text[i + 1:]
+
+
+def make_queries(tracks, count, rng):
+    queries = []
+    for i in range(count):
+        track = rng.choice(tracks)
+        title = track['title']
+        kind = i % 3
+        if kind == 0:
+            queries.append((title, track))
+        elif kind == 1:
+            queries.append((typo(title, rng), track))
+        else:
+            words = title.split()
+            queries.append((' '.join(words[:max(1, len(words) - 1)]), track))
+    return queries
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--difflib-queries', type=int, default=10, help='difflib is slow; fewer samples')
+    args = parser.parse_args()
+    rng = random.Random(3)
+    tracks = make_tracks(args.tracks, rng)
+    queries = make_queries(tracks, args.queries, rng)
+
+    index = TrackIndex()
+    started = time.perf_counter()
+    for track in tracks:
+        index.add(track)
+    build = time.perf_counter() - started
+    print(f"build: {args.tracks} tracks in {build:.2f}s ({args.tracks / build:.0f} adds/s)")
+
+    latencies, found = [], 0
+    for query, expected in queries:
+        started = time.perf_counter()
+        results = index.search(query)
+        latencies.append(time.perf_counter() - started)
+        found += any(track is expected for _, track in results)
+    print(f"TrackIndex  p50 {pct(latencies, 0.5) * 1000:6.2f} ms  p99 {pct(latencies, 0.99) * 1000:6.2f} ms  "
+          f"max {max(latencies) * 1000:6.2f} ms  expected track in top 5: {found / len(queries):.0%}")
+
+    titles = [t['title'].lower() for t in tracks]
+    latencies, found = [], 0
+    for query, expected in queries[:args.difflib_queries]:
+        started = time.perf_counter()
+        matches = difflib.get_close_matches(query.lower(), titles, n=3, cutoff=0.6)
+        latencies.append(time.perf_counter() - started)
+        found += expected['title'].lower() in matches
+    print(f"difflib     p50 {pct(latencies, 0.5) * 1000:6.0f} ms  ({len(latencies)} queries)  "
+          f"expected title in top 3: {found / len(latencies):.0%}")
+
+
+if __name__ == '__main__':
+    main()
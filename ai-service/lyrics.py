@@ -0,0 +1,162 @@
+"""Async lyrics lookups with request coalescing and a persistent SQLite cache.
+
+The upstream is pluggable: anything with `async fetch(client, artist, title)`
+returning the lyrics, or None when the song has none, can stand in for
+lyrics.ovh. LYRICS_API_URL points the default provider at any
+lyrics.ovh-compatible server, e.g. a local stub for tests and benchmarks.
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from urllib.parse import quote
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LYRICS_API_URL = os.getenv('LYRICS_API_URL', 'https://api.lyrics.ovh/v1')
+LYRICS_CACHE_PATH = os.getenv('LYRICS_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lyrics_cache.sqlite3'))
+LYRICS_TTL = int(os.getenv('LYRICS_TTL', str(30 * 24 * 3600)))
+# "Not found" is cached too, for less time: lyrics sites do add songs
+LYRICS_NOT_FOUND_TTL = int(os.getenv('LYRICS_NOT_FOUND_TTL', str(24 * 3600)))
+LYRICS_TIMEOUT = float(os.getenv('LYRICS_TIMEOUT', '10'))
+LYRICS_MAX_CONNECTIONS = int(os.getenv('LYRICS_MAX_CONNECTIONS', '20'))
+
+_BRACKETS = re.compile(r'[\(\[][^\)\]]*[\)\]]')
+_FEATURING = re.compile(r'\s(feat|ft|featuring)\.?\s.*$')
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text):
+    """'Adele - Hello (Official Video) ' and 'adele hello' share one cache key."""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _BRACKETS.sub(' ', text)
+    text = _FEATURING.sub('', f' {text}')
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def cache_key(artist, title):
+    return f'{normalize(artist)}\x1f{normalize(title)}'
+
+
+class LyricsError(Exception):
+    pass
+
+
+class LyricsOvhProvider:
+    def __init__(self, base_url=LYRICS_API_URL):
+        self.base_url = base_url.rstrip('/')
+
+    async def fetch(self, client, artist, title):
+        url = f"{self.base_url}/{quote(artist, safe='')}/{quote(title, safe='')}"
+        try:
+            with metrics.HTTP_CLIENT_SECONDS.time('lyrics', 'GET'):
+                resp = await client.get(url)
+        except httpx.HTTPError:
+            metrics.HTTP_CLIENT_RESPONSES.labels('lyrics', 'GET', 'error').inc()
+            raise
+        metrics.HTTP_CLIENT_RESPONSES.labels('lyrics', 'GET', str(resp.status_code)).inc()
+        if resp.status_code == 404:
+            return None
+        if resp.status_code != 200:
+            raise LyricsError(f'Upstream returned {resp.status_code}')
+        return resp.json().get('lyrics') or None
+
+
+class LyricsCache:
+    """artist/title -> lyrics (NULL for "not found"), with per-row fetch time."""
+
+    def __init__(self, path=LYRICS_CACHE_PATH, ttl=LYRICS_TTL, not_found_ttl=LYRICS_NOT_FOUND_TTL):
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        # Used from the event loop thread only; lookups are single indexed reads
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS lyrics (
+            key TEXT PRIMARY KEY,
+            lyrics TEXT,
+            fetched_at REAL NOT NULL
+        )''')
+        self._db.commit()
+
+    def get(self, key):
+        """(hit, lyrics): lyrics is None for a cached "not found"."""
+        row = self._db.execute('SELECT lyrics, fetched_at FROM lyrics WHERE key=?', (key,)).fetchone()
+        if row is None:
+            return False, None
+        lyrics, fetched_at = row
+        ttl = self.ttl if lyrics is not None else self.not_found_ttl
+        if time.time() - fetched_at > ttl:
+            return False, None
+        return True, lyrics
+
+    def put(self, key, lyrics):
+        with metrics.sqlite_write('lyrics_cache'), self._db:
+            self._db.execute('INSERT OR REPLACE INTO lyrics (key, lyrics, fetched_at) VALUES (?, ?, ?)',
+                             (key, lyrics, time.time()))
+
+    def close(self):
+        self._db.close()
+
+
+class LyricsService:
+    """Cache, then one in-flight upstream request per normalized artist/title."""
+
+    def __init__(self, provider=None, cache=None, timeout=LYRICS_TIMEOUT, max_connections=LYRICS_MAX_CONNECTIONS):
+        self.provider = provider or LyricsOvhProvider()
+        self.cache = cache or LyricsCache()
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+        self._inflight = {}
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.cache.close()
+
+    async def get(self, artist, title):
+        """Lyrics, or None if the song has none. Raises LyricsError or httpx.TimeoutException."""
+        key = cache_key(artist, title)
+        hit, lyrics = self.cache.get(key)
+        if hit:
+            self.stats['hits'] += 1
+            return lyrics
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats['misses'] += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(key, artist, title))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+        # shield: one caller giving up (client disconnect) mustn't cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, artist, title):
+        try:
+            lyrics = await self.provider.fetch(self._client, artist, title)
+        except (httpx.TimeoutException, LyricsError):
+            self.stats['errors'] += 1
+            raise
+        except (httpx.HTTPError, ValueError) as e:
+            # Upstream trouble isn't "not found"; don't cache it
+            self.stats['errors'] += 1
+            raise LyricsError(str(e) or type(e).__name__) from e
+        self.cache.put(key, lyrics)
+        return lyrics
@@ -1,47 +1,184 @@
-from fastapi import FastAPI, Query
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response
 from pydantic import BaseModel
-import requests
-import difflib
-from typing import List
+import httpx
+from typing import List, Optional
 
-app = FastAPI()
+import metrics
+from audio_features import AudioDecodeError, MoodService
+from lyrics import LyricsService
+from recommender import PlayLog, Recommender
+from search_index import Catalog, TrackIndex, normalize
+
+logger = logging.getLogger(__name__)
+
+# One pooled HTTP client and cache for every /lyrics request
+lyrics_service = LyricsService()
+
+# --- Track catalog for /ai_play ---
+# Everything the bot has queued (any room, including journal history) and downloaded
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BASE_DIR, '..', 'zira-music-bot', 'backend')
+CATALOG_QUEUE_FILES = os.getenv('CATALOG_QUEUE_FILES', os.path.join(BASE_DIR, '..', 'queue.json')).split(os.pathsep)
+CATALOG_ROOMS_DIR = os.getenv('CATALOG_ROOMS_DIR', os.path.join(BACKEND_DIR, 'rooms'))
+# The bot's download folder, shared with /mood
+MP3_FOLDER = os.getenv('MP3_FOLDER', os.path.join(BACKEND_DIR, 'static', 'mp3'))
+CATALOG_REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', '10'))
+
+track_index = TrackIndex()
+catalog = Catalog(track_index, CATALOG_QUEUE_FILES, CATALOG_ROOMS_DIR, MP3_FOLDER)
+mood_service = MoodService(MP3_FOLDER)
+
+# --- Recommendations from the bot's play history ---
+PLAYS_DB_PATH = os.getenv('PLAYS_DB_PATH', os.path.join(BACKEND_DIR, 'botdata.sqlite3'))
+RECOMMEND_LIMIT = 5
+
+recommender = Recommender(lookup=track_index.get)
+play_log = PlayLog(PLAYS_DB_PATH)
+
+async def refresh_catalog():
+    while True:
+        try:
+            await asyncio.to_thread(catalog.refresh)
+        except Exception:
+            logger.exception("Catalog refresh failed")
+        try:
+            await asyncio.to_thread(play_log.feed, recommender)
+        except Exception:
+            logger.exception("Play history refresh failed")
+        try:
+            # New downloads get their mood features computed in the background
+            await mood_service.analyze_new()
+        except Exception:
+            logger.exception("Mood analysis failed")
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app):
+    await lyrics_service.start()
+    await mood_service.start()
+    refresher = asyncio.create_task(refresh_catalog())
+    yield
+    refresher.cancel()
+    await mood_service.close()
+    await lyrics_service.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# --- Metrics ---
+# Every route is timed; GET /metrics serves these with the lyrics, mood and SQLite timings (see metrics.py)
+HTTP_SECONDS = metrics.histogram('http_request_duration_seconds', 'Requests, by route', ['route', 'method'])
+HTTP_RESPONSES = metrics.counter('http_responses_total', 'Responses by route and status', ['route', 'method', 'status'])
+metrics.gauge('catalog_tracks', 'Tracks in the /ai_play search index', collect=lambda: len(track_index))
+metrics.gauge('mood_analyses_inflight', 'Mood analyses running or queued', collect=lambda: mood_service.inflight)
+
+@app.middleware('http')
+async def observe_request(request: Request, call_next):
+    started = time.perf_counter()
+    status = '500'
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        # The route pattern (set by the router once matched), not the raw path
+        route = request.scope.get('route')
+        route = route.path if route is not None else 'unmatched'
+        HTTP_SECONDS.labels(route, request.method).observe(time.perf_counter() - started)
+        HTTP_RESPONSES.labels(route, request.method, status).inc()
+
+@app.get('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # --- Lyrics Endpoint ---
 @app.get('/lyrics')
-def get_lyrics(artist: str = Query(...), title: str = Query(...)):
-    # Placeholder: Use lyrics.ovh API for demo
+async def get_lyrics(artist: str = Query(...), title: str = Query(...)):
     try:
-        resp = requests.get(f'https://api.lyrics.ovh/v1/{artist}/{title}', timeout=10)
-        data = resp.json()
-        return {'lyrics': data.get('lyrics', 'Not found')}
-    except requests.exceptions.Timeout:
+        lyrics = await lyrics_service.get(artist, title)
+        return {'lyrics': lyrics or 'Not found'}
+    except httpx.TimeoutException:
         return {'lyrics': 'Error: Request timeout'}
-    except requests.exceptions.RequestException as e:
-        return {'lyrics': f'Error: {str(e)}'}
     except Exception as e:
         return {'lyrics': f'Error: {str(e)}'}
 
+@app.get('/lyrics/stats')
+def lyrics_stats():
+    return lyrics_service.stats
+
 # --- Mood Detection Endpoint ---
 class MoodRequest(BaseModel):
-    url: str  # URL to audio file
+    # Any one of these, naming a track in the shared MP3 folder
+    video_id: Optional[str] = None
+    src: Optional[str] = None  # e.g. /static/mp3/<video_id>.mp3
+    url: Optional[str] = None  # e.g. http://host/static/mp3/<video_id>.mp3
 
 @app.post('/mood')
-def detect_mood(req: MoodRequest):
-    # Placeholder: Return random mood for demo
-    import random
-    moods = ['happy', 'sad', 'energetic', 'calm', 'angry', 'romantic']
-    return {'mood': random.choice(moods)}
+async def detect_mood(req: MoodRequest):
+    ref = req.video_id or req.src or req.url
+    if not ref:
+        raise HTTPException(status_code=422, detail='video_id, src or url is required')
+    video_id = os.path.basename(ref.split('?')[0])
+    if video_id.endswith('.mp3'):
+        video_id = video_id[:-4]
+    try:
+        features = await mood_service.features(video_id)
+    except AudioDecodeError as e:
+        raise HTTPException(status_code=422, detail=f'Could not decode audio: {e}')
+    if features is None:
+        raise HTTPException(status_code=404, detail='Track not downloaded')
+    features = dict(features)
+    return {'mood': features.pop('mood'), 'video_id': video_id, 'features': features}
 
 # --- Recommendation Endpoint ---
+# History and queue entries can be video_ids, titles, /static/mp3 paths or song objects
 class RecommendRequest(BaseModel):
-    history: list
+    history: list = []
+    queue: list = []
+    user_id: Optional[int] = None
+
+def recommend_tracks(history, queue, user_id=None):
+    if user_id is not None:
+        history = list(history) + play_log.user_history(user_id)
+    # The queue is what's about to play: it shapes the taste and is excluded like the history
+    return recommender.recommend(list(history) + list(queue), k=RECOMMEND_LIMIT)
+
+def _ref_keys(ref):
+    # What a history/queue entry can match a catalog track by: video_id, file name or title
+    if isinstance(ref, dict):
+        return [key for field in ('video_id', 'videoId', 'src', 'url', 'title') for key in _ref_keys(ref.get(field))]
+    if not isinstance(ref, str) or not ref:
+        return []
+    keys = [ref, normalize(ref)]
+    if ref.endswith('.mp3'):
+        keys.append(os.path.basename(ref.split('?')[0])[:-4])
+    return keys
+
+def catalog_fill(tracks, refs, k=RECOMMEND_LIMIT):
+    # A fresh deployment has no plays to recommend from: top up with the newest catalog tracks
+    # (the demo SONGS are the oldest), skipping what was listened to, queued or already picked
+    skip = {key for ref in list(refs) + tracks for key in _ref_keys(ref)}
+    tracks = list(tracks)
+    for track in reversed(track_index.tracks):
+        if len(tracks) >= k:
+            break
+        if track.get('video_id') not in skip and normalize(track.get('title')) not in skip:
+            tracks.append(track)
+            skip.update(_ref_keys(track))
+    return tracks
 
 @app.post('/recommend')
 def recommend(req: RecommendRequest):
-    # Placeholder: Recommend random genres
-    import random
-    genres = ['pop', 'rock', 'hip-hop', 'jazz', 'classical', 'edm']
-    return {'recommendations': random.sample(genres, 3)}
+    tracks = recommend_tracks(req.history, req.queue, req.user_id)
+    if len(tracks) < RECOMMEND_LIMIT:
+        tracks = catalog_fill(tracks, list(req.history) + list(req.queue))
+    return {'recommendations': [f"{t['title']} - {t['artist']}" if t.get('artist') else t['title'] for t in tracks],
+            'tracks': tracks}
 
 SONGS = [
     {"title": "Happy Tune", "artist": "Artist 1", "genre": "pop", "mood": "happy", "src": "/static/mp3/1P3ZgLOy-w8.mp3"},
@@ -51,23 +188,28 @@ SONGS = [
     {"title": "Romantic Ballad", "artist": "Artist 5", "genre": "classical", "mood": "romantic", "src": "/static/mp3/a0goLSCAcBw.mp3"},
 ]
 
+for song in SONGS:
+    track_index.add(song)
+
+# Trigram similarity a title needs to count as a fuzzy match
+FUZZY_CUTOFF = 0.5
+
 class PlayRequest(BaseModel):
     query: str
 
 @app.post('/ai_play')
 def ai_play(req: PlayRequest):
     q = req.query.lower()
-    # Find all matches by title substring
-    matches = [song for song in SONGS if q in song["title"].lower()]
+    results = track_index.search(req.query, limit=5)
+    # Title substring matches first
+    needle = normalize(req.query)
+    matches = [song for _, song in results if needle and needle in normalize(song["title"])]
     if len(matches) == 1:
         return {"song": matches[0]}
     elif len(matches) > 1:
         return {"multiple": matches}
     # Fuzzy match
-    titles = [song["title"].lower() for song in SONGS]
-    import difflib
-    fuzzy_matches = difflib.get_close_matches(q, titles, n=3, cutoff=0.6)
-    fuzzy_songs = [song for song in SONGS if song["title"].lower() in fuzzy_matches]
+    fuzzy_songs = [song for score, song in results if score >= FUZZY_CUTOFF][:3]
     if len(fuzzy_songs) == 1:
         return {"song": fuzzy_songs[0]}
     elif len(fuzzy_songs) > 1:
@@ -82,22 +224,27 @@ def ai_play(req: PlayRequest):
 
 class HistoryRequest(BaseModel):
     history: List[str]
+    queue: list = []
+    user_id: Optional[int] = None
+
+SONGS_BY_TITLE = {song["title"]: song for song in SONGS}
 
 @app.post('/personal_recommend')
 def personal_recommend(req: HistoryRequest):
-    user_genres = set()
-    user_moods = set()
-    for song_title in req.history:
-        for song in SONGS:
-            if song["title"] == song_title:
-                user_genres.add(song["genre"])
-                user_moods.add(song["mood"])
+    recommendations = recommend_tracks(req.history, req.queue, req.user_id)
+    if recommendations:
+        return {"recommendations": recommendations}
+    # No play history yet: same genre or mood as the listened-to demo songs
+    played = [SONGS_BY_TITLE[title] for title in req.history if title in SONGS_BY_TITLE]
+    user_genres = {song["genre"] for song in played}
+    user_moods = {song["mood"] for song in played}
+    history = set(req.history)
     recommendations = [
         song for song in SONGS
         if (song["genre"] in user_genres or song["mood"] in user_moods)
-        and song["title"] not in req.history
+        and song["title"] not in history
     ]
-    return {"recommendations": recommendations[:5]}
+    return {"recommendations": recommendations[:RECOMMEND_LIMIT]}
 
 @app.get('/health')
 def health():
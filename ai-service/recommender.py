@@ -0,0 +1,263 @@
+"""Track-to-track recommendations from real play history.
+
+Each track gets a fixed sparse random "index" vector (a few +/-1 entries in
+RECOMMEND_DIM dimensions); its context vector is the sum of the index
+vectors of the tracks played next to it in the same listening session
+(random indexing). That is a track-by-track co-occurrence matrix projected
+to a fixed, small width: 50k tracks need ~25 MB instead of 50k x 50k, and
+context[t] . index[h] still approximates how often t and h co-occur.
+
+Plays are folded in incrementally, in vectorized batches. A query is one
+matrix-vector product (cosine similarity to the history's context
+vectors) plus argpartition for the top k.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+from search_index import normalize
+
+logger = logging.getLogger(__name__)
+
+RECOMMEND_DIM = int(os.getenv('RECOMMEND_DIM', '128'))
+RECOMMEND_NONZEROS = 8  # +/-1 entries per index vector
+# Plays by the same user this close together (and at most WINDOW apart) co-occur
+RECOMMEND_WINDOW = int(os.getenv('RECOMMEND_WINDOW', '5'))
+RECOMMEND_SESSION_GAP = float(os.getenv('RECOMMEND_SESSION_GAP', str(3 * 3600)))
+
+
+class Recommender:
+    """Thread-safe: the play log poller adds while requests query."""
+
+    def __init__(self, dim=RECOMMEND_DIM, window=RECOMMEND_WINDOW, session_gap=RECOMMEND_SESSION_GAP,
+                 lookup=None, capacity=1024):
+        self.dim = dim
+        self.window = window
+        self.session_gap = session_gap
+        self.lookup = lookup  # video_id -> richer track dict (title/artist/src), or None
+        self.tracks = []  # track id -> {'video_id', 'title', ...}
+        self._ids = {}  # video_id -> track id
+        self._titles = {}  # normalized title -> track id
+        self._context = np.zeros((capacity, dim), dtype=np.float32)
+        self._inv_norm = np.zeros(capacity, dtype=np.float32)
+        self._plays = np.zeros(capacity, dtype=np.int64)
+        self._index_cols = np.zeros((capacity, RECOMMEND_NONZEROS), dtype=np.int64)
+        self._index_signs = np.zeros((capacity, RECOMMEND_NONZEROS), dtype=np.float32)
+        # Each user's last `window` plays, carried into the next batch so sessions span batches
+        self._tail_user = np.zeros(0, dtype=np.int64)
+        self._tail_track = np.zeros(0, dtype=np.int64)
+        self._tail_time = np.zeros(0, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    # --- Tracks ---
+    def _track_id(self, video_id, title):
+        tid = self._ids.get(video_id)
+        if tid is not None:
+            if title and not self.tracks[tid].get('title'):
+                self.tracks[tid]['title'] = title
+                self._titles[normalize(title)] = tid
+            return tid
+        tid = len(self.tracks)
+        if tid == len(self._context):
+            self._grow()
+        # Index vectors depend only on the video_id, so restarts rebuild identical vectors
+        rng = np.random.default_rng(zlib.crc32(video_id.encode()))
+        self._index_cols[tid] = rng.choice(self.dim, RECOMMEND_NONZEROS, replace=False)
+        self._index_signs[tid] = rng.choice((-1.0, 1.0), RECOMMEND_NONZEROS)
+        track = (self.lookup(video_id) if self.lookup else None) or {}
+        track = {'video_id': video_id, 'title': title or video_id, 'artist': '',
+                 'src': f'/static/mp3/{video_id}.mp3', **track}
+        self.tracks.append(track)
+        self._ids[video_id] = tid
+        self._titles[normalize(track['title'])] = tid
+        if title:
+            # The catalog may know it by a fuller title than the play log
+            self._titles.setdefault(normalize(title), tid)
+        return tid
+
+    def _grow(self):
+        capacity = 2 * len(self._context)
+        for name in ('_context', '_inv_norm', '_plays', '_index_cols', '_index_signs'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def resolve(self, ref):
+        """Track id for a video_id, title, src/url or song dict; None if unknown."""
+        if isinstance(ref, dict):
+            for key in ('video_id', 'videoId', 'src', 'url', 'title'):
+                if ref.get(key):
+                    tid = self.resolve(ref[key])
+                    if tid is not None:
+                        return tid
+            return None
+        if not isinstance(ref, str) or not ref:
+            return None
+        tid = self._ids.get(ref)
+        if tid is None and ref.endswith('.mp3'):
+            tid = self._ids.get(os.path.basename(ref)[:-4])
+        if tid is None:
+            tid = self._titles.get(normalize(ref))
+        return tid
+
+    # --- Plays ---
+    def add_plays(self, users, video_ids, times, titles=None):
+        """Fold a batch of plays (oldest first) into the context vectors."""
+        if not len(video_ids):
+            return
+        with self._lock:
+            tracks = np.array([self._track_id(v, titles[i] if titles else None)
+                               for i, v in enumerate(video_ids)], dtype=np.int64)
+            users = np.asarray(users, dtype=np.int64)
+            times = np.asarray(times, dtype=np.float64)
+            np.add.at(self._plays, tracks, 1)
+            # Only the tails of users in this batch matter for its pairs
+            batch_users = np.unique(users)
+            carried = np.isin(self._tail_user, batch_users)
+            user = np.concatenate([self._tail_user[carried], users])
+            track = np.concatenate([self._tail_track[carried], tracks])
+            when = np.concatenate([self._tail_time[carried], times])
+            new = np.concatenate([np.zeros(carried.sum(), bool), np.ones(len(users), bool)])
+            order = np.argsort(user, kind='stable')  # per user, carried tail first, then in time order
+            user, track, when, new = user[order], track[order], when[order], new[order]
+
+            targets, sources = [], []
+            for lag in range(1, self.window + 1):
+                i = np.arange(lag, len(user))
+                j = i - lag
+                pair = (new[i] & (user[i] == user[j]) & (track[i] != track[j])
+                        & (when[i] - when[j] <= self.session_gap))
+                a, b = track[i[pair]], track[j[pair]]
+                targets += [a, b]
+                sources += [b, a]
+            self._accumulate(np.concatenate(targets), np.concatenate(sources))
+
+            # Keep each user's last `window` plays for the next batch
+            last = np.r_[np.nonzero(user[1:] != user[:-1])[0], len(user) - 1]
+            group = np.repeat(np.arange(len(last)), np.diff(np.r_[-1, last]))
+            keep = last[group] - np.arange(len(user)) < self.window
+            self._tail_user = np.concatenate([self._tail_user[~carried], user[keep]])
+            self._tail_track = np.concatenate([self._tail_track[~carried], track[keep]])
+            self._tail_time = np.concatenate([self._tail_time[~carried], when[keep]])
+
+    def _accumulate(self, targets, sources):
+        """context[target] += index vector of source, for every pair."""
+        if not len(targets):
+            return
+        rows, local = np.unique(targets, return_inverse=True)
+        flat = (local[:, None] * self.dim + self._index_cols[sources]).ravel()
+        delta = np.bincount(flat, weights=self._index_signs[sources].ravel(), minlength=len(rows) * self.dim)
+        self._context[rows] += delta.reshape(len(rows), self.dim).astype(np.float32)
+        norms = np.linalg.norm(self._context[rows], axis=1)
+        self._inv_norm[rows] = np.where(norms > 0, 1.0 / np.maximum(norms, 1e-12), 0.0)
+
+    # --- Queries ---
+    def _index_vectors(self, tracks):
+        """Sum of the index vectors of `tracks`, as a dense vector."""
+        return np.bincount(self._index_cols[tracks].ravel(), weights=self._index_signs[tracks].ravel(),
+                           minlength=self.dim).astype(np.float32)
+
+    def recommend(self, history, exclude=(), k=5):
+        """Up to k track dicts like `history`, best first, skipping history and `exclude`.
+
+        Falls back to the most played tracks when nothing in the history has
+        been played next to anything yet, and tops up with them when fewer
+        than k tracks were played next to it.
+        """
+        with self._lock:
+            count = len(self.tracks)
+            if not count:
+                return []
+            seen = [t for t in (self.resolve(ref) for ref in history) if t is not None]
+            skip = seen + [t for t in (self.resolve(ref) for ref in exclude) if t is not None]
+            context = self._context[:count]
+            inv_norm = self._inv_norm[:count]
+            profile = np.zeros(self.dim, dtype=np.float32)
+            if seen:
+                seen = np.array(seen)
+                # Played next to the history (first order: the history's own index vectors) or next to
+                # the same tracks as the history (second order: its context vectors)
+                for part in (self._index_vectors(seen), (context[seen] * inv_norm[seen, None]).sum(axis=0)):
+                    norm = np.linalg.norm(part)
+                    if norm > 0:
+                        profile += part / norm
+            if profile.any():
+                scores = (context @ profile) * inv_norm
+            else:
+                scores = self._plays[:count].astype(np.float32)
+            if skip:
+                scores[np.array(skip)] = -np.inf
+            best = self._top(scores, k)
+            if len(best) < k and profile.any():
+                plays = self._plays[:count].astype(np.float32)
+                plays[np.array(skip + best, dtype=np.int64)] = -np.inf
+                best += self._top(plays, k - len(best))
+            return [dict(self.tracks[t]) for t in best]
+
+    @staticmethod
+    def _top(scores, k):
+        """Indices of the (up to) k highest positive scores, best first."""
+        top = min(k, len(scores))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [int(t) for t in best if np.isfinite(scores[t]) and scores[t] > 0]
+
+
+class PlayLog:
+    """Reads the bot's play history (UserStore's `plays` table) without writing to it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.last_id = 0
+
+    def _connect(self):
+        return sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=5)
+
+    def feed(self, recommender, batch=50000):
+        """Add plays newer than the last call to `recommender`; returns how many."""
+        if not os.path.exists(self.path):
+            return 0
+        added = 0
+        db = self._connect()
+        try:
+            while True:
+                rows = db.execute('SELECT play_id, user_id, video_id, played_at, title FROM plays '
+                                  'WHERE play_id > ? ORDER BY play_id LIMIT ?', (self.last_id, batch)).fetchall()
+                if not rows:
+                    break
+                self.last_id = rows[-1][0]
+                play_ids, users, video_ids, times, titles = zip(*rows)
+                # Plays without a user can't form sessions; give each its own id
+                users = [u if u is not None else -pid for pid, u in zip(play_ids, users)]
+                recommender.add_plays(users, video_ids, times, list(titles))
+                added += len(rows)
+        except sqlite3.OperationalError as e:
+            # The bot creates the table on first start
+            logger.debug(f"Play log not readable yet: {e}")
+        finally:
+            db.close()
+        if added:
+            logger.info(f"Recommender: added {added} plays ({len(recommender)} tracks)")
+        return added
+
+    def user_history(self, user_id, limit=200):
+        """The user's most recently played video_ids, newest first."""
+        if not os.path.exists(self.path):
+            return []
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT video_id FROM plays WHERE user_id=? ORDER BY played_at DESC LIMIT ?',
+                              (user_id, limit)).fetchall()
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            db.close()
+        return list(dict.fromkeys(row[0] for row in rows))
@@ -0,0 +1,241 @@
+"""Trigram inverted index over the track catalog, for /ai_play.
+
+Candidates come from the query's rarest trigrams (IDF-weighted overlap,
+summed with numpy over the posting lists), and the best of those are
+re-ranked by trigram containment/Dice similarity, with a bonus for substring
+matches.
+Tracks are only ever added, so posting lists stay sorted append-only arrays
+and new downloads are indexed without a rebuild. The one exception is a
+track first indexed under its file name (a download not seen in any queue
+yet), whose title is replaced in place once a queue file names it.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from array import array
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r'[^\w]+')
+# Posting lists scanned per query (rarest first, within a total length budget); the query's
+# other trigrams only count when re-ranking the candidates found through them
+MAX_QUERY_TRIGRAMS = 12
+POSTINGS_BUDGET = 100000
+CANDIDATES = 64
+
+
+def normalize(text):
+    text = (text or '').casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def _grams(normalized):
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams(text):
+    """Trigrams of the normalized text, padded so short words and word edges count."""
+    return _grams(normalize(text))
+
+
+def similarity(query_grams, doc_grams):
+    """Mostly how much of the query the track contains, plus Dice so tighter matches rank first."""
+    shared = len(query_grams & doc_grams)
+    if not shared:
+        return 0.0
+    return 0.75 * shared / len(query_grams) + 0.25 * 2.0 * shared / (len(query_grams) + len(doc_grams))
+
+
+class TrackIndex:
+    """Thread-safe: the catalog refresher adds while requests search."""
+
+    def __init__(self):
+        self.tracks = []
+        self._ids = {}  # video_id -> doc id
+        self._texts = []  # normalized ("title artist", "title") per doc, for re-ranking
+        self._postings = {}  # trigram -> array('I') of doc ids, ascending
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __contains__(self, video_id):
+        return video_id in self._ids
+
+    def get(self, video_id):
+        doc = self._ids.get(video_id)
+        return None if doc is None else self.tracks[doc]
+
+    def add(self, track):
+        """Index `track` (a dict with title/artist/video_id); False if already indexed.
+
+        A track indexed with its video_id as title (see Catalog.refresh) is
+        re-indexed when it comes again with a real one.
+        """
+        key = track.get('video_id') or track.get('src') or track.get('title')
+        if not key:
+            return False
+        title = normalize(track.get('title', ''))
+        text = f"{title} {normalize(track.get('artist', ''))}".strip()
+        with self._lock:
+            doc = self._ids.get(key)
+            if doc is not None:
+                if self.tracks[doc].get('title') != key or track.get('title', key) == key:
+                    return False
+                old = _grams(self._texts[doc][0])
+                new = _grams(text)
+                for gram in old - new:
+                    postings = self._postings[gram]
+                    postings.remove(doc)
+                    if not postings:
+                        # search() weighs trigrams by document frequency: none may be 0
+                        del self._postings[gram]
+                for gram in new - old:
+                    postings = self._postings.setdefault(gram, array('I'))
+                    postings.insert(bisect.bisect_left(postings, doc), doc)
+                self.tracks[doc] = track
+                self._texts[doc] = (text, title)
+                return True
+            doc = len(self.tracks)
+            self._ids[key] = doc
+            self.tracks.append(track)
+            self._texts.append((text, title))
+            for gram in _grams(text):
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array('I')
+                postings.append(doc)
+        return True
+
+    def search(self, query, limit=5, min_score=0.3):
+        """[(score, track)] best first. Scores are in [0, 1] plus up to 0.5 for a substring match."""
+        grams = trigrams(query)
+        needle = normalize(query)
+        if not grams or not needle:
+            return []
+        with self._lock:
+            count = len(self.tracks)
+            lists = [(len(p), g, p) for g in grams if (p := self._postings.get(g)) is not None]
+            if not lists:
+                return []
+            lists.sort()
+            ids, weights, scanned = [], [], 0
+            for df, _, postings in lists[:MAX_QUERY_TRIGRAMS]:
+                if ids and scanned + df > POSTINGS_BUDGET:
+                    break
+                scanned += df
+                # np.array copies, so no numpy view outlives the lock and blocks a later append
+                ids.append(np.array(postings, dtype=np.uint32))
+                weights.append(np.full(df, math.log(1 + count / df)))
+            scores = np.bincount(np.concatenate(ids), weights=np.concatenate(weights), minlength=count)
+            top = min(CANDIDATES, count)
+            # Selecting the smallest of -scores: asking for the largest (kth=-top) hits a slow
+            # path in introselect when most scores are zero
+            candidates = np.argpartition(-scores, top - 1)[:top]
+            candidates = [int(d) for d in candidates if scores[d] > 0]
+            texts = [(d, self._texts[d]) for d in candidates]
+            tracks = self.tracks
+        ranked = []
+        for doc, (text, title) in texts:
+            score = similarity(grams, _grams(text))
+            if needle in title:
+                score += 0.5
+            if score >= min_score:
+                ranked.append((score, doc))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, tracks[doc]) for score, doc in ranked[:limit]]
+
+
+def _songs_in(path):
+    """Every song a queue file or its journals ever held (legacy list, {seq, queue}, add records)."""
+    songs = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        songs.extend(data.get('queue', []) if isinstance(data, dict) else data)
+    except (OSError, ValueError):
+        pass
+    for journal in (path + '.journal.1', path + '.journal'):
+        try:
+            with open(journal, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    if record.get('op') == 'add':
+                        songs.append(record.get('song'))
+        except OSError:
+            pass
+    return [s for s in songs if isinstance(s, dict) and s.get('title')]
+
+
+class Catalog:
+    """Feeds a TrackIndex from the bot's queue files and MP3 folder.
+
+    refresh() re-reads only the files whose mtime/size changed since the
+    last call and adds tracks the index hasn't seen, so calling it every
+    few seconds is cheap.
+    """
+
+    def __init__(self, index, queue_files=(), rooms_dir=None, mp3_folder=None):
+        self.index = index
+        self.queue_files = list(queue_files)
+        self.rooms_dir = rooms_dir
+        self.mp3_folder = mp3_folder
+        self._seen = {}  # path -> (mtime_ns, size)
+
+    def _changed(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        stamp = (st.st_mtime_ns, st.st_size)
+        if self._seen.get(path) == stamp:
+            return False
+        self._seen[path] = stamp
+        return True
+
+    def _queue_files(self):
+        files = list(self.queue_files)
+        if self.rooms_dir and os.path.isdir(self.rooms_dir):
+            files += [os.path.join(self.rooms_dir, name) for name in os.listdir(self.rooms_dir)
+                      if name.endswith('.json')]
+        return files
+
+    def refresh(self):
+        added = 0
+        for path in self._queue_files():
+            if any([self._changed(path), self._changed(path + '.journal'), self._changed(path + '.journal.1')]):
+                for song in _songs_in(path):
+                    added += self.index.add(track_from_song(song))
+        # Directory mtime changes whenever a download is renamed into place
+        if self.mp3_folder and self._changed(self.mp3_folder):
+            for entry in os.scandir(self.mp3_folder):
+                name = entry.name
+                if name.endswith('.mp3') and not name.startswith('.') and name[:-4] not in self.index:
+                    # No metadata beyond the file name; the queue files usually index it first
+                    added += self.index.add({'title': name[:-4], 'artist': '', 'video_id': name[:-4],
+                                             'src': f'/static/mp3/{name}'})
+        if added:
+            logger.info(f"Catalog: indexed {added} new tracks ({len(self.index)} total)")
+        return added
+
+
+def track_from_song(song):
+    track = {key: song[key] for key in ('title', 'artist', 'video_id', 'albumArt', 'genre', 'mood') if song.get(key)}
+    track.setdefault('artist', '')
+    src = song.get('src') or (f"{song['video_id']}.mp3" if song.get('video_id') else '')
+    track['src'] = src if src.startswith('/') or '://' in src else f'/static/mp3/{os.path.basename(src)}'
+    return track
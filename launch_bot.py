@@ -8,6 +8,9 @@ from pathlib import Path
 
 # Global list to store all processes
 processes = []
+# ai-service imports metrics.py from the bot backend
+SHARED_DIR = Path(__file__).resolve().parent / "zira-music-bot" / "backend"
+AI_SERVICE_ENV = {"PYTHONPATH": os.pathsep.join(filter(None, [str(SHARED_DIR), os.environ.get("PYTHONPATH")]))}
 stop_event = threading.Event()
 
 def signal_handler(signum, frame):
@@ -110,7 +113,8 @@ def main():
     ai_service = start_process(
         "uvicorn main:app --host 0.0.0.0 --port 8000 --reload",
         "AI Service",
-        cwd="ai-service"
+        cwd="ai-service",
+        env=AI_SERVICE_ENV
     )
     if ai_service:
         wait_for_port(8000, "AI Service")
@@ -12,6 +12,9 @@ import signal
 from pathlib import Path
 
 processes = []
+# ai-service imports metrics.py from the bot backend
+SHARED_DIR = Path(__file__).resolve().parent / "zira-music-bot" / "backend"
+AI_SERVICE_ENV = {"PYTHONPATH": os.pathsep.join(filter(None, [str(SHARED_DIR), os.environ.get("PYTHONPATH")]))}
 
 def signal_handler(signum, frame):
     """Handle Ctrl+C to gracefully stop all processes"""
@@ -23,14 +26,17 @@ def signal_handler(signum, frame):
             pass
     sys.exit(0)
 
-def start_service(cmd, name, cwd=None):
+def start_service(cmd, name, cwd=None, env=None):
     """Start a service and return the process"""
     print(f"[LAUNCHER] Starting {name}...")
+    process_env = os.environ.copy()
+    if env:
+        process_env.update(env)
     try:
         if cwd:
-            proc = subprocess.Popen(cmd, shell=True, cwd=cwd)
+            proc = subprocess.Popen(cmd, shell=True, cwd=cwd, env=process_env)
         else:
-            proc = subprocess.Popen(cmd, shell=True)
+            proc = subprocess.Popen(cmd, shell=True, env=process_env)
         print(f"[LAUNCHER] {name} started (PID: {proc.pid})")
         processes.append(proc)
         return proc
@@ -56,7 +62,8 @@ def main():
     ai_service = start_service(
         "uvicorn main:app --host 0.0.0.0 --port 8000 --reload",
         "AI Service",
-        cwd="ai-service"
+        cwd="ai-service",
+        env=AI_SERVICE_ENV
     )
     time.sleep(3)  # Give AI service time to start
     
@@ -0,0 +1,152 @@
+import asyncio
+import html
+import logging
+import math
+import threading
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages over 4096 characters
+MESSAGE_LIMIT = 4096
+
+
+def format_user(user_id, first_name, last_name, username, songs=None):
+    name = html.escape(f"{first_name or ''} {last_name or ''}".strip())
+    uname = f"(@{html.escape(username)})" if username else ''
+    line = f"- {name} {uname} (ID: <code>{user_id}</code>)"
+    return line if songs is None else f"{line} | Songs: {songs}"
+
+
+def format_group(group_id, title, member_count, last_joined):
+    return (f"- {html.escape(title or '')} (ID: <code>{group_id}</code>) | Members: {member_count}"
+            f" | Last joined: {last_joined}")
+
+
+def fit(lines, limit=MESSAGE_LIMIT):
+    """Join lines, dropping the tail (with a note) if the message would be too long."""
+    text = ''
+    for i, line in enumerate(lines):
+        more = f"\n...and {len(lines) - i} more lines"
+        if len(text) + len(line) + 1 + len(more) > limit:
+            return text + more
+        text += line + "\n"
+    return text
+
+
+def full_report_page(store, page, page_size=30, groups=True):
+    """Page `page` (1-based) of the full report: user pages first, then group pages."""
+    user_total, group_total = store.counts()
+    user_pages = max(1, math.ceil(user_total / page_size))
+    group_pages = math.ceil(group_total / page_size) if groups else 0
+    pages = user_pages + group_pages
+    page = min(max(page, 1), pages)
+    if page <= user_pages:
+        rows = store.users(page_size, (page - 1) * page_size)
+        lines = [f"<b>Users ({user_total}):</b>"] + [format_user(*u) for u in rows]
+    else:
+        rows = store.groups(page_size, (page - user_pages - 1) * page_size)
+        lines = [f"<b>Groups ({group_total}):</b>"] + [format_group(*g) for g in rows]
+    lines = [f"<b>User & Group Report</b> (page {page}/{pages})", ""] + lines
+    if page < pages:
+        lines += ["", f"Next page: /{'report' if groups else 'users'} {page + 1}"]
+    return fit(lines)
+
+
+class AdminReporter:
+    """Coalesces user/group activity into one delta report per window.
+
+    UserStore commits feed record() (from its writer thread); the first change
+    after a report starts a `window`-second timer on the bot's loop, and
+    everything recorded until it fires goes out as one message. Work per
+    request is just merging a few dict entries, whatever the table sizes.
+    """
+
+    def __init__(self, window=60, max_lines=20):
+        self.window = window
+        self.max_lines = max_lines
+        self._lock = threading.Lock()
+        self._loop = None
+        self._send = None
+        self._timer = None
+        self._reset()
+
+    def _reset(self):
+        self._new_users = {}
+        self._new_groups = {}
+        self._songs = Counter()
+        self._names = {}
+        self._since = datetime.utcnow()
+
+    # --- Lifecycle ---
+    def start(self, send):
+        """`send(text)` is a coroutine function; call from the bot's event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._send = send
+
+    async def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        # Don't lose the last window's activity
+        await self._report()
+        self._loop = None
+
+    # --- Collecting ---
+    def record(self, changes):
+        with self._lock:
+            self._new_users.update(changes['new_users'])
+            self._new_groups.update(changes['new_groups'])
+            self._songs.update(changes['songs'])
+            for user_id in changes['songs']:
+                if user_id in changes['profiles']:
+                    self._names[user_id] = changes['profiles'][user_id]
+        loop = self._loop
+        if loop is not None and (changes['new_users'] or changes['new_groups'] or changes['songs']):
+            loop.call_soon_threadsafe(self._arm)
+
+    def _arm(self):
+        if self._timer is None or self._timer.done():
+            self._timer = self._loop.create_task(self._report_later())
+
+    async def _report_later(self):
+        await asyncio.sleep(self.window)
+        await self._report()
+
+    async def _report(self):
+        text = self.take()
+        if text and self._send is not None:
+            try:
+                await self._send(text)
+            except Exception as e:
+                logger.warning(f"Could not send admin report: {e}")
+
+    # --- Formatting ---
+    def take(self):
+        """The delta report since the last one (or None if nothing happened), and start over."""
+        with self._lock:
+            new_users, new_groups, songs, names, since = (
+                self._new_users, self._new_groups, self._songs, self._names, self._since)
+            self._reset()
+        if not (new_users or new_groups or songs):
+            return None
+        lines = [f"<b>Activity since {since:%Y-%m-%d %H:%M} UTC</b>"]
+        if new_users:
+            lines += ["", f"<b>New users ({len(new_users)}):</b>"]
+            lines += self._capped([format_user(uid, *profile) for uid, profile in new_users.items()])
+        if new_groups:
+            lines += ["", f"<b>New groups ({len(new_groups)}):</b>"]
+            lines += self._capped([format_group(gid, *group) for gid, group in new_groups.items()])
+        if songs:
+            lines += ["", f"<b>Songs requested ({sum(songs.values())}):</b>"]
+            lines += self._capped([
+                f"{format_user(uid, *names.get(uid, (None, None, None)))} | +{count}"
+                for uid, count in songs.most_common()
+            ])
+        lines += ["", "Full report: /report"]
+        return fit(lines)
+
+    def _capped(self, lines):
+        if len(lines) <= self.max_lines:
+            return lines
+        return lines[:self.max_lines] + [f"...and {len(lines) - self.max_lines} more"]
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Errors where the request never reached the server, so even a non-idempotent
+# command (next, prev, ...) is safe to send again.
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class ApiError(Exception):
+    pass
+
+
+class ApiClient:
+    """Async client for the API server, shared by all bot handlers.
+
+    One pooled httpx.AsyncClient keeps connections alive between calls. GETs
+    are retried with exponential backoff on any transport error or 5xx; other
+    methods only when the request provably wasn't sent. `fire()` sends control
+    commands without waiting for the reply; commands with the same key (the
+    chat) still reach the server in the order they were fired.
+    """
+
+    def __init__(self, base_url, timeout=5.0, retries=2, backoff=0.2, max_connections=20):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._client = None
+        self._tails = {}  # key -> last fired task for that key
+        self._pending = set()
+
+    # --- Lifecycle (hooked to Application.post_init / post_shutdown) ---
+    async def start(self, *args):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    async def stop(self, *args):
+        if self._pending:
+            # Let queued control commands go out before closing the pool
+            await asyncio.wait(set(self._pending), timeout=self.timeout)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # --- Requests ---
+    async def request(self, method, path, params=None, json=None, timeout=None):
+        if self._client is None:
+            raise ApiError('API client is not started')
+        attempt = 0
+        while True:
+            try:
+                response = await self._send(method, path, params, json, timeout)
+                if response.status_code >= 500 and method == 'GET' and attempt < self.retries:
+                    raise ApiError(f'{response.status_code} from {path}')
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPError, ApiError) as e:
+                retryable = isinstance(e, NOT_SENT_ERRORS) or (
+                    method == 'GET' and isinstance(e, (httpx.TransportError, ApiError)))
+                if not retryable or attempt >= self.retries:
+                    raise ApiError(str(e) or type(e).__name__) from e
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def _send(self, method, path, params, json, timeout):
+        # One attempt; retries are timed and counted one by one
+        try:
+            with metrics.HTTP_CLIENT_SECONDS.time('api_server', method):
+                response = await self._client.request(method, path, params=params, json=json,
+                                                      timeout=timeout or self.timeout)
+        except httpx.HTTPError:
+            metrics.HTTP_CLIENT_RESPONSES.labels('api_server', method, 'error').inc()
+            raise
+        metrics.HTTP_CLIENT_RESPONSES.labels('api_server', method, str(response.status_code)).inc()
+        return response
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    def fire(self, method, path, key=None, **kwargs):
+        """Send a request in the background. Errors are logged, not raised."""
+        previous = self._tails.get(key)
+
+        async def send():
+            if previous is not None:
+                # Keep per-chat ordering; the previous command's outcome doesn't matter here
+                await asyncio.wait({previous})
+            try:
+                await self.request(method, path, **kwargs)
+            except ApiError as e:
+                logger.warning(f"{method} {path} failed: {e}")
+
+        task = asyncio.get_running_loop().create_task(send())
+        self._tails[key] = task
+        self._pending.add(task)
+
+        def done(task):
+            self._pending.discard(task)
+            if self._tails.get(key) is task:
+                del self._tails[key]
+
+        task.add_done_callback(done)
+        return task
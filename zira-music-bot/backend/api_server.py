@@ -1,261 +1,636 @@
-from flask import Flask, request, jsonify, send_file, Response, send_from_directory
+from flask import Flask, request, jsonify, send_file, Response, abort, redirect
 from flask_cors import CORS
 import io, csv
 import yt_dlp
 import requests
 import json
 import os
-from flask_socketio import SocketIO, emit
+import atexit
+import time
+from flask_socketio import SocketIO, emit, join_room
+import config
+import metrics
+import music_manager
+import fingerprint
+from download_jobs import DownloadJobManager, DONE, FAILED
+from mp3_cache import Mp3Cache
+from renditions import Renditions
+from prefetch import Prefetcher
+from fanout import RateLimiter, ReactionAggregator
+from audio_stream import send_audio
+from search_cache import SearchCache
+from song_queue import Song
+from rooms import RoomRegistry, DEFAULT_ROOM, valid_room_id
+from shared_state import open_store
+from socketio_queue import socketio_options
+from werkzeug.utils import safe_join
 
 # Define absolute paths for project root, queue file, and MP3 folder
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-QUEUE_FILE = os.path.join(PROJECT_ROOT, 'queue.json')
-MP3_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'mp3')
+QUEUE_FILE = os.path.abspath(config.QUEUE_FILE)
+MP3_FOLDER = config.MP3_FOLDER
 
 app = Flask(__name__)
 CORS(app, origins="*")
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
-
-# In-memory queue and state
-music_queue = []  # Initialize as empty, will be loaded from file
-current_song_index = 0
-is_paused = False
-
-# --- Real-Time Chat & Reactions ---
-chat_history = []  # Store recent chat messages (max 50)
-
-def save_queue():
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(QUEUE_FILE), exist_ok=True)
-    with open(QUEUE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(music_queue, f, ensure_ascii=False, indent=2)
-
-def load_queue():
-    global music_queue
-    if os.path.exists(QUEUE_FILE):
-        with open(QUEUE_FILE, 'r', encoding='utf-8') as f:
-            music_queue.clear()
-            music_queue.extend(json.load(f))
-
-# Load queue on startup
-load_queue()
-
-def broadcast_queue_update():
-    socketio.emit('queue_update', {
-        "queue": music_queue,
-        "current": current_song_index,
-        "is_paused": is_paused
-    })
+# With a message queue, emits from any worker reach clients on every worker
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
+                    **socketio_options(config.SOCKETIO_MESSAGE_QUEUE))
+
+# --- Metrics ---
+# Every route and Socket.IO event is timed; GET /metrics serves these along with the
+# yt-dlp, transcode and SQLite timings the other modules record (see metrics.py)
+HTTP_SECONDS = metrics.histogram('http_request_duration_seconds', 'Flask requests, by route', ['route', 'method'])
+HTTP_RESPONSES = metrics.counter('http_responses_total', 'Flask responses by route and status',
+                                 ['route', 'method', 'status'])
+SOCKETIO_SECONDS = metrics.histogram('socketio_event_duration_seconds', 'Socket.IO event handlers, by event', ['event'])
+SOCKETIO_ERRORS = metrics.counter('socketio_event_errors_total', 'Socket.IO event handlers that raised', ['event'])
+
+# Each access through the `request` proxy costs about a microsecond: resolve it once per hook
+@app.before_request
+def start_request_timer():
+    request._get_current_object().environ['metrics.started'] = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    req = request._get_current_object()
+    started = req.environ.get('metrics.started')
+    if started is not None:
+        # The route pattern, not the path: /static/mp3/<filename> is one series, not one per track
+        route = req.url_rule.rule if req.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.labels(route, req.method).observe(time.perf_counter() - started)
+        HTTP_RESPONSES.labels(route, req.method, str(response.status_code)).inc()
+    return response
+
+@app.after_request
+def request_client_hints(response):
+    response.headers['Accept-CH'] = CLIENT_HINTS
+    return response
+
+def on_event(event):
+    # @socketio.on(event), with the handler timed
+    def decorator(handler):
+        return socketio.on(event)(metrics.timed(SOCKETIO_SECONDS, event, errors=SOCKETIO_ERRORS)(handler))
+    return decorator
+
+# --- Rooms ---
+# One queue, playback state and chat history per Telegram chat (see rooms.py).
+# Requests pick their room with ?room=<chat_id> (or "room" in the JSON body);
+# without it they use the "default" room, which keeps the old queue.json.
+# With STATE_STORE set, rooms live in a store shared by all workers (see shared_state.py):
+# handlers refresh the room before reading it and change it inside room.mutate().
+# Clients hear about a change only after mutate() exits, once other workers can read it too.
+store = open_store(config.STATE_STORE, replay_size=config.QUEUE_REPLAY_SIZE,
+                   compact_after=config.QUEUE_COMPACT_AFTER, chat_history_size=config.CHAT_HISTORY_SIZE,
+                   sleep=socketio.sleep)
+rooms = RoomRegistry(config.ROOMS_DIR, QUEUE_FILE,
+                     idle_timeout=config.ROOM_IDLE_TIMEOUT,
+                     replay_size=config.QUEUE_REPLAY_SIZE,
+                     fsync_interval=config.QUEUE_FSYNC_INTERVAL,
+                     compact_after=config.QUEUE_COMPACT_AFTER,
+                     chat_history_size=config.CHAT_HISTORY_SIZE,
+                     store=store)
+atexit.register(rooms.close)
+client_rooms = {}  # Socket.IO sid -> room id
+
+def request_room():
+    data = request.get_json(silent=True)
+    room_id = request.args.get('room') or (data.get('room') if isinstance(data, dict) else None) or DEFAULT_ROOM
+    try:
+        room = rooms.get(str(room_id))
+    except ValueError:
+        abort(400, description='Invalid room id')
+    room.refresh()
+    return room
+
+# Lighter bitrates of each track, made the first time someone asks for one.
+# Without ?quality= the rung is picked from these client hints, which browsers only
+# send once a response from this origin asked for them (Accept-CH)
+CLIENT_HINTS = 'Save-Data, ECT, Downlink'
+renditions = Renditions(MP3_FOLDER, config.RENDITION_BITRATES, music_manager.MP3_BITRATE,
+                        config.RENDITION_OPUS_BITRATE, config.FFMPEG_BINARY, config.RENDITION_WORKERS,
+                        config.RENDITION_RETRY_SECONDS)
+atexit.register(renditions.shutdown)
+
+# Shared with bot.py: one folder, one disk budget, renditions included (charged to their track)
+mp3_cache = Mp3Cache(MP3_FOLDER, config.MP3_CACHE_MAX_BYTES, config.MP3_CACHE_POLICY, on_evict=renditions.remove,
+                     derived_sizes=renditions.sizes)
+renditions.on_transcoded = mp3_cache.add_derived
+# Re-uploads of a downloaded track reuse its file (see fingerprint.py)
+fingerprints = (fingerprint.FingerprintIndex(MP3_FOLDER, config.FINGERPRINT_SECONDS, config.FINGERPRINT_PROBE_SECONDS,
+                                             config.FFMPEG_BINARY)
+                if config.FINGERPRINT_DEDUP and fingerprint.available() else None)
+
+def pin_queued_tracks():
+    # Never evict something queued to play in a loaded room (any room, with a shared store:
+    # the pins are shared by every worker)
+    video_ids = set() if store is None else store.queued_video_ids()
+    for room in rooms.loaded():
+        video_ids.update(room.queue.video_ids())
+    mp3_cache.pin(video_ids)
+
+def save_queue(room, op, **fields):
+    # Record a mutation that has already been applied to room.queue (a shared store
+    # persists it from the deltas instead). Called after room.mutate() exits: pinning
+    # reads the store, which shouldn't happen while holding its lock
+    if room.journal is not None:
+        room.journal.append(op, **fields)
+    if op == 'add':
+        mp3_cache.pin([fields['song']['video_id']], replace=False)
+    else:
+        pin_queued_tracks()
+
+# --- Prefetch ---
+# The next few songs of every room are fetched ahead of time (see prefetch.py)
+def prefetch_track(video_id, should_cancel):
+    """Runs on a low-priority Prefetcher worker; returns the files to keep in the page cache."""
+    filename = music_manager.download_mp3(video_id, MP3_FOLDER, cache=mp3_cache, lookup=False,
+                                          should_cancel=should_cancel, fingerprints=fingerprints)
+    canonical = filename[:-4]
+    # Queued before its file existed, so save_queue couldn't pin it
+    mp3_cache.pin([canonical], replace=False)
+    paths = [os.path.join(MP3_FOLDER, filename)]
+    for label in renditions.labels():
+        if label == renditions.original or should_cancel():
+            continue
+        path = renditions.prepare(canonical, label)
+        if path:
+            paths.append(path)
+    return filename, paths
+
+def prefetched_entry(room, video_id, filename):
+    # (index, the queue entry for video_id as it should be now that its file is known), or None if
+    # it's fine as is. Entries queued with metadata only get a src; a re-upload gets the file (and
+    # the video_id, unless that one is queued too) of the track it duplicates
+    index = room.queue.position(video_id)
+    if index is None:
+        return None
+    song = room.queue[index].to_dict()
+    canonical = filename[:-4]
+    if canonical == video_id and song['src']:
+        return None
+    updated = dict(song, src=filename, variants=renditions.variants(filename))
+    if canonical != video_id and canonical not in room.queue:
+        updated['video_id'] = canonical
+    return (index, updated) if updated != song else None
+
+def on_prefetched(video_id, filename):
+    # Called on the server thread by drain_prefetch_events
+    for room in rooms.loaded():
+        room.refresh()
+        if prefetched_entry(room, video_id, filename) is None:
+            continue
+        with room.mutate():
+            entry = prefetched_entry(room, video_id, filename)
+            if entry is None:
+                continue
+            index, song = entry
+            song = room.queue.replace(index, song).to_dict()
+            deltas = record_changes(room, ('update', index, song))
+        save_queue(room, 'update', index=index, song=song)
+        broadcast_queue_update(room, deltas)
+
+prefetcher = Prefetcher(prefetch_track, config.PREFETCH_WORKERS, config.PREFETCH_NICENESS, on_fetched=on_prefetched)
+atexit.register(prefetcher.shutdown)
+
+def drain_prefetch_events():
+    while True:
+        prefetcher.drain_events()
+        socketio.sleep(0.25)
+
+socketio.start_background_task(drain_prefetch_events)
+
+def prefetch_upcoming(room):
+    # The current song first, then the ones next/skip will move to
+    count = min(len(room.queue), config.PREFETCH_LOOKAHEAD + 1)
+    prefetcher.update(room.id, [room.queue[(room.current + i) % len(room.queue)].video_id for i in range(count)])
+
+# Load the default room on startup
+rooms.get(DEFAULT_ROOM)
+mp3_cache.scan()
+pin_queued_tracks()
+mp3_cache.evict()
+
+def unload_idle_rooms():
+    while True:
+        socketio.sleep(60)
+        unloaded = rooms.unload_idle()
+        if unloaded:
+            prefetcher.forget(unloaded)
+            pin_queued_tracks()
+
+socketio.start_background_task(unload_idle_rooms)
+
+# --- Queue broadcasts ---
+# Clients that connect with ?protocol=delta get versioned deltas (see queue_sync.py).
+# Everyone else keeps getting the full queue_update snapshot on every change.
+# Either way, only clients in the same room hear about it.
+def record_changes(room, *changes):
+    # Inside room.mutate(): changes are (op, index, payload) tuples describing what just
+    # happened, in order. Returns them as numbered deltas (a shared store keeps them on exit).
+    return [room.deltas.record(op, index, payload) for op, index, payload in changes]
+
+def broadcast_queue_update(room, deltas):
+    # After room.mutate() has exited, with the deltas record_changes returned.
+    # Every change to a room's queue or position comes through here, so this is also
+    # where the prefetcher learns what the room plays next.
+    prefetch_upcoming(room)
+    for delta in deltas:
+        socketio.emit('queue_delta', delta, to=room.delta_room)
+    # Snapshot clients connected to other workers aren't in our legacy_clients
+    if room.legacy_clients or store is not None:
+        socketio.emit('queue_update', room.snapshot(), to=room.snapshot_room)
 
 @app.route('/api/queue', methods=['GET'])
 def get_queue():
-    return jsonify({"queue": music_queue, "current": current_song_index, "is_paused": is_paused})
+    room = request_room()
+    return jsonify({"queue": room.queue.to_list(), "current": room.current, "is_paused": room.is_paused})
 
 @app.route('/api/queue', methods=['POST'])
 def add_song():
-    global current_song_index
     data = request.json
     print(f"[API] Adding song: {data}")
     # Prevent duplicates (fix KeyError)
     if not isinstance(data, dict):
         return jsonify({"success": False, "error": "Invalid data format"}), 400
-    if any(isinstance(item, dict) and item.get('video_id') == data.get('video_id') for item in music_queue):
-        print(f"[API] Song {data.get('video_id')} already in queue.")
-        return jsonify({"success": False, "message": "Song already in queue", "queue": music_queue, "current": current_song_index})
-    music_queue.append({
-        "title": data.get("title", "Unknown"),
-        "artist": data.get("artist", "Unknown"),
-        "video_id": data.get("video_id", ""),
-        "albumArt": data.get("albumArt", ""),
-        "src": data.get("src", "")
-    })
-    current_song_index = len(music_queue) - 1  # Always set to the newly added song
-    save_queue()
-    broadcast_queue_update()  # Real-time update
-    print(f"[API] Current song index set to {current_song_index}")
-    return jsonify({"success": True, "queue": music_queue, "current": current_song_index})
+    room = request_room()
+    with room.mutate():
+        if data.get('video_id') and data['video_id'] in room.queue:
+            print(f"[API] Song {data.get('video_id')} already in queue of room {room.id}.")
+            return jsonify({"success": False, "message": "Song already in queue", "queue": room.queue.to_list(), "current": room.current})
+        song = room.queue.append(Song(
+            title=data.get("title", "Unknown"),
+            artist=data.get("artist", "Unknown"),
+            video_id=data.get("video_id", ""),
+            albumArt=data.get("albumArt", ""),
+            src=data.get("src", ""),
+            variants=renditions.variants(data["src"]) if data.get("src") else None
+        ))
+        room.current = len(room.queue) - 1  # Always set to the newly added song
+        deltas = record_changes(room, ('add', room.current, song.to_dict()), ('current', room.current, None))
+    save_queue(room, 'add', song=song.to_dict())
+    broadcast_queue_update(room, deltas)  # Real-time update
+    print(f"[API] Current song index of room {room.id} set to {room.current}")
+    return jsonify({"success": True, "queue": room.queue.to_list(), "current": room.current})
 
 @app.route('/api/next', methods=['POST'])
 def next_song():
-    global current_song_index
-    if music_queue:
-        current_song_index = (current_song_index + 1) % len(music_queue)
-    broadcast_queue_update()  # Real-time update
-    return jsonify({"current": current_song_index})
+    room = request_room()
+    with room.mutate():
+        if room.queue:
+            room.current = (room.current + 1) % len(room.queue)
+        deltas = record_changes(room, ('current', room.current, None))
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"current": room.current})
 
 @app.route('/api/prev', methods=['POST'])
 def prev_song():
-    global current_song_index
-    if music_queue:
-        current_song_index = (current_song_index - 1 + len(music_queue)) % len(music_queue)
-    broadcast_queue_update()  # Real-time update
-    return jsonify({"current": current_song_index})
+    room = request_room()
+    with room.mutate():
+        if room.queue:
+            room.current = (room.current - 1 + len(room.queue)) % len(room.queue)
+        deltas = record_changes(room, ('current', room.current, None))
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"current": room.current})
 
 @app.route('/api/pause', methods=['POST'])
 def pause():
-    global is_paused
-    is_paused = True
-    broadcast_queue_update()  # Real-time update
-    return jsonify({"is_paused": is_paused})
+    room = request_room()
+    with room.mutate():
+        room.is_paused = True
+        deltas = record_changes(room, ('paused', None, room.is_paused))
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"is_paused": room.is_paused})
 
 @app.route('/api/resume', methods=['POST'])
 def resume():
-    global is_paused
-    is_paused = False
-    broadcast_queue_update()  # Real-time update
-    return jsonify({"is_paused": is_paused})
+    room = request_room()
+    with room.mutate():
+        room.is_paused = False
+        deltas = record_changes(room, ('paused', None, room.is_paused))
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"is_paused": room.is_paused})
 
 @app.route('/api/skip', methods=['POST'])
 def skip():
     # This just advances to the next song. The frontend will handle playback.
-    global current_song_index
-    if music_queue:
-        current_song_index = (current_song_index + 1) % len(music_queue)
-    broadcast_queue_update()  # Real-time update
-    return jsonify({"current": current_song_index})
+    room = request_room()
+    with room.mutate():
+        if room.queue:
+            room.current = (room.current + 1) % len(room.queue)
+        deltas = record_changes(room, ('current', room.current, None))
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"current": room.current})
 
 @app.route('/api/playlist', methods=['GET'])
 def get_playlist():
-    return jsonify({"queue": music_queue})
+    room = request_room()
+    return jsonify({"queue": room.queue.to_list()})
 
 @app.route('/api/end', methods=['POST'])
 def end():
-    # Clears the entire queue
-    global music_queue, current_song_index, is_paused
-    music_queue.clear()
-    current_song_index = 0
-    is_paused = False
-    save_queue()
-    broadcast_queue_update()  # Real-time update
-    return jsonify({"queue": music_queue, "current": current_song_index, "is_paused": is_paused})
+    # Clears the room's entire queue
+    room = request_room()
+    with room.mutate():
+        room.queue.clear()
+        room.current = 0
+        room.is_paused = False
+        deltas = record_changes(room, ('clear', None, None))
+    save_queue(room, 'clear')
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"queue": room.queue.to_list(), "current": room.current, "is_paused": room.is_paused})
 
 @app.route('/api/playlist/export', methods=['GET'])
 def export_playlist():
+    room = request_room()
     output = io.StringIO()
     writer = csv.writer(output)
     writer.writerow(['Title', 'Artist', 'Source'])
-    for song in music_queue:
+    for song in room.queue:
         writer.writerow([song.get('title', ''), song.get('artist', ''), song.get('src', '')])
     output.seek(0)
     return send_file(io.BytesIO(output.getvalue().encode()), mimetype='text/csv', as_attachment=True, download_name='playlist.csv')
 
 @app.route('/api/play/<int:index>', methods=['POST'])
 def play_song_by_index(index):
-    global current_song_index
-    if 0 <= index < len(music_queue):
-        current_song_index = index
-        broadcast_queue_update()  # Real-time update
-        return jsonify({"success": True, "current": current_song_index})
-    return jsonify({"success": False, "error": "Invalid index"}), 400
+    room = request_room()
+    with room.mutate():
+        if not 0 <= index < len(room.queue):
+            return jsonify({"success": False, "error": "Invalid index"}), 400
+        room.current = index
+        deltas = record_changes(room, ('current', room.current, None))
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return jsonify({"success": True, "current": room.current})
 
 @app.route('/static/mp3/<filename>')
 def serve_mp3(filename):
-    return send_from_directory(MP3_FOLDER, filename)
+    # Only finished tracks; in-progress downloads and the cache index are dot-prefixed
+    if not filename.endswith('.mp3') or filename.startswith('.'):
+        return jsonify({'error': 'Not found'}), 404
+    path = safe_join(MP3_FOLDER, filename)
+    if path is None:
+        return jsonify({'error': 'Not found'}), 404
+    video_id = filename[:-4]
+    mp3_cache.touch(video_id)
+    quality = request.args.get('quality')
+    label = renditions.choose(quality, save_data=request.headers.get('Save-Data', '').lower() == 'on',
+                              ect=request.headers.get('ECT'), downlink=request.headers.get('Downlink', type=float))
+    if label == renditions.original and quality in (None, label):
+        if quality is None and renditions.adaptive:
+            # Other hints would have redirected this URL: no immutable caching, and caches key on the hints
+            response = send_audio(path, immutable=False)
+            response.headers['Vary'] = CLIENT_HINTS
+            return response
+        return send_audio(path)
+    if label != quality:
+        # Picked from client hints: send the client to that rendition's own (cacheable) URL
+        return quality_redirect(filename, label)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Not found'}), 404
+    rendition = renditions.get(video_id, label)
+    if rendition is None:
+        # Still transcoding: play the original, under its own URL so range requests
+        # for this playback keep hitting the same bytes
+        return quality_redirect(filename, renditions.original)
+    return send_audio(rendition, mimetype=renditions.mimetype(label))
+
+def quality_redirect(filename, label):
+    response = redirect(f'/static/mp3/{filename}?quality={label}', code=302)
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Vary'] = CLIENT_HINTS
+    return response
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = mp3_cache.stats()
+    if fingerprints is not None:
+        stats['fingerprints'] = fingerprints.stats()
+    stats['renditions'] = renditions.stats()
+    stats['prefetch'] = prefetcher.stats()
+    return jsonify(stats)
+
+search_cache = SearchCache(
+    music_manager.search_youtube,
+    ttl=config.SEARCH_CACHE_TTL,
+    stale_ttl=config.SEARCH_CACHE_STALE_TTL,
+    max_entries=config.SEARCH_CACHE_SIZE,
+    store_path=config.SEARCH_CACHE_PATH,
+)
 
 @app.route('/api/search')
 def search_youtube():
     query = request.args.get('q', '')
     if not query:
         return jsonify({'error': 'No query provided'}), 400
-    ydl_opts = {
-        'quiet': True,
-        'skip_download': True,
-        'extract_flat': True,
-        'default_search': 'ytsearch5',
-        'forcejson': True,
-    }
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(query, download=False) or {}
-            entries = info.get('entries', []) if isinstance(info, dict) else []
-            results = []
-            for entry in entries:
-                if not isinstance(entry, dict):
-                    entry = dict()
-                results.append({
-                    'title': entry.get('title', ''),
-                    'artist': entry.get('uploader', ''),
-                    'video_id': entry.get('id', ''),
-                    'thumbnail': entry.get('thumbnail', ''),
-                })
-            return jsonify({'results': results})
+        return jsonify({'results': search_cache.get(query)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search/stats', methods=['GET'])
+def search_stats():
+    return jsonify(search_cache.stats())
+
+def download_mp3(video_id, progress):
+    """Blocking yt-dlp download + mp3 transcode. Runs on a DownloadJobManager worker."""
+    # download_and_add already looked the track up in the cache
+    return music_manager.download_mp3(video_id, MP3_FOLDER, progress=progress, cache=mp3_cache, lookup=False,
+                                      fingerprints=fingerprints)
+
+def add_downloaded_song(room, song):
+    # Returns False if the song was already queued
+    with room.mutate():
+        song = room.queue.append(song)
+        if song is None:
+            return False
+        room.current = len(room.queue) - 1
+        deltas = record_changes(room, ('add', room.current, song.to_dict()), ('current', room.current, None))
+    save_queue(room, 'add', song=song.to_dict())
+    broadcast_queue_update(room, deltas)  # Real-time update
+    return True
+
+def on_download_job_update(job, snapshot):
+    # Called on the server thread by drain_download_events
+    room = rooms.get(job.payload['room'])
+    if snapshot['state'] == DONE:
+        # A re-upload comes back as the file (and so the video_id) of the track it duplicates
+        song = dict(job.payload['song'], src=snapshot['result'], video_id=snapshot['result'][:-4],
+                    variants=renditions.variants(snapshot['result']))
+        added = add_downloaded_song(room, song)
+        print(f"[API] Download job {job.id} finished for {job.video_id} in room {room.id} (added={added})")
+    elif snapshot['state'] == FAILED:
+        print(f"[API] Download job {job.id} failed for {job.video_id}: {snapshot['error']}")
+    socketio.emit('download_progress', snapshot, to=room.sio_room)
+
+download_jobs = DownloadJobManager(download_mp3, on_download_job_update, max_workers=config.DOWNLOAD_WORKERS)
+
+def drain_download_events():
+    while True:
+        download_jobs.drain_events()
+        socketio.sleep(0.25)
+
+socketio.start_background_task(drain_download_events)
+
 @app.route('/api/download_and_add', methods=['POST'])
 def download_and_add():
-    global current_song_index
     data = request.json
     if not isinstance(data, dict):
         return jsonify({'success': False, 'error': 'Invalid data format'}), 400
     video_id = data.get('video_id')
-    title = data.get('title', 'Unknown')
-    artist = data.get('artist', 'Unknown')
-    albumArt = data.get('albumArt', '')
-    requested_by = data.get('requested_by', 'WebApp')
-    duration = data.get('duration', '')
     if not video_id:
         return jsonify({'success': False, 'error': 'No video_id provided'}), 400
+    room = request_room()
     mp3_filename = f"{video_id}.mp3"
-    mp3_path = os.path.join('static', 'mp3', mp3_filename)
-    # Download if not already present
-    if not os.path.exists(mp3_path):
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': mp3_path,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,
-        }
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([f'https://www.youtube.com/watch?v={video_id}'])
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'Failed to download: {e}'}), 500
-    # Add to queue if not already present
-    if any(isinstance(item, dict) and item.get('video_id') == video_id for item in music_queue):
-        return jsonify({'success': False, 'message': 'Song already in queue', 'queue': music_queue, 'current': current_song_index})
     song = {
-        'title': title,
-        'artist': artist,
+        'title': data.get('title', 'Unknown'),
+        'artist': data.get('artist', 'Unknown'),
         'video_id': video_id,
-        'albumArt': albumArt,
+        'albumArt': data.get('albumArt', ''),
         'src': mp3_filename,
-        'duration': duration,
-        'requested_by': requested_by
+        'variants': renditions.variants(mp3_filename),
+        'duration': data.get('duration', ''),
+        'requested_by': data.get('requested_by', 'WebApp')
     }
-    music_queue.append(song)
-    current_song_index = len(music_queue) - 1
-    save_queue()
-    broadcast_queue_update()  # Real-time update
-    return jsonify({'success': True, 'queue': music_queue, 'current': current_song_index})
+    # Already cached: nothing to wait for, add right away
+    if mp3_cache.lookup(video_id):
+        if not add_downloaded_song(room, song):
+            return jsonify({'success': False, 'message': 'Song already in queue', 'queue': room.queue.to_list(), 'current': room.current})
+        return jsonify({'success': True, 'queue': room.queue.to_list(), 'current': room.current})
+    if video_id in room.queue:
+        return jsonify({'success': False, 'message': 'Song already in queue', 'queue': room.queue.to_list(), 'current': room.current})
+    # Not cached: hand it to the download workers and return straight away.
+    # The song is added to the queue when the job finishes (see on_download_job_update).
+    job, created = download_jobs.submit(video_id, {'room': room.id, 'song': song}, key=(room.id, video_id))
+    return jsonify({'success': True, 'job_id': job.id, 'created': created, 'job': job.to_dict()}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = download_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+# --- Chat and reactions ---
+# Reactions reach the room as one reaction_summary per window (see fanout.py);
+# every client is rate limited per event type.
+reactions = ReactionAggregator(config.REACTION_WINDOW)
+reaction_limits = RateLimiter(config.REACTION_RATE, config.REACTION_BURST)
+chat_limits = RateLimiter(config.CHAT_RATE, config.CHAT_BURST)
+
+def flush_reactions():
+    for sio_room, summary in reactions.drain():
+        socketio.emit('reaction_summary', summary, to=sio_room)
+
+def drain_reactions():
+    while True:
+        socketio.sleep(reactions.window)
+        flush_reactions()
+
+if reactions.window > 0:
+    socketio.start_background_task(drain_reactions)
+
+@app.route('/api/chat/stats', methods=['GET'])
+def chat_stats():
+    return jsonify({
+        'reactions': reactions.stats(),
+        'dropped': {'reaction': reaction_limits.dropped, 'chat_message': chat_limits.dropped},
+        'clients': len(client_rooms),
+    })
+
+# --- Metrics endpoint ---
+metrics.gauge('socketio_clients', 'Socket.IO clients connected to this worker', collect=lambda: len(client_rooms))
+metrics.gauge('rooms_loaded', 'Rooms held in memory', collect=lambda: len(rooms.loaded()))
+metrics.gauge('download_jobs_active', 'Download jobs queued or running', collect=download_jobs.active)
+metrics.counter('socketio_rate_limited_total', 'Socket.IO events dropped by the per-client rate limits', ['event'],
+                collect=lambda: [(('reaction',), reaction_limits.dropped), (('chat_message',), chat_limits.dropped)])
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 # --- SocketIO Events ---
-@socketio.on('chat_message')
+def client_room():
+    room_id = client_rooms.get(request.sid)
+    return rooms.get(room_id) if room_id else None
+
+@on_event('chat_message')
 def handle_chat_message(data):
     # data: {"user": str, "message": str, "timestamp": str}
-    chat_history.append(data)
-    if len(chat_history) > 50:
-        chat_history.pop(0)
-    socketio.emit('chat_message', data)
+    room = client_room()
+    if room is None:
+        return
+    if not chat_limits.allow(request.sid):
+        emit('rate_limited', {'event': 'chat_message'})
+        return
+    room.add_chat(data)
+    socketio.emit('chat_message', data, to=room.sio_room)
 
-@socketio.on('reaction')
+@on_event('reaction')
 def handle_reaction(data):
     # data: {"user": str, "reaction": str, "song_id": str, "timestamp": str}
-    socketio.emit('reaction', data)
-
-@socketio.on('connect')
-def handle_connect():
-    emit('queue_update', {
-        "queue": music_queue,
-        "current": current_song_index,
-        "is_paused": is_paused
-    })
-    emit('chat_history', chat_history)
+    room = client_room()
+    if room is None or not isinstance(data, dict):
+        return
+    # Over-limit reactions are dropped quietly: answering each one would be its own storm
+    if not reaction_limits.allow(request.sid):
+        return
+    if reactions.window <= 0:
+        socketio.emit('reaction', data, to=room.sio_room)
+        return
+    reactions.add(room.sio_room, data.get('song_id'), data.get('reaction'))
+
+@on_event('connect')
+def handle_connect(auth=None):
+    # Clients pick their chat with ?room=<chat_id>; old clients land in the default room
+    room_id = request.args.get('room') or DEFAULT_ROOM
+    if not valid_room_id(room_id):
+        return False
+    room = rooms.get(room_id)
+    room.refresh()
+    client_rooms[request.sid] = room.id
+    room.clients.add(request.sid)
+    join_room(room.sio_room)
+    if request.args.get('protocol') == 'delta':
+        join_room(room.delta_room)
+    else:
+        # Old clients: full snapshots on every change, exactly as before
+        join_room(room.snapshot_room)
+        room.legacy_clients.add(request.sid)
+    emit('queue_update', room.snapshot())
+    emit('chat_history', room.recent_chat())
+    # A player just opened: make sure what it's about to play is on disk
+    prefetch_upcoming(room)
+
+@on_event('disconnect')
+def handle_disconnect(*args):
+    room = client_room()
+    client_rooms.pop(request.sid, None)
+    reaction_limits.forget(request.sid)
+    chat_limits.forget(request.sid)
+    if room is not None:
+        room.clients.discard(request.sid)
+        room.legacy_clients.discard(request.sid)
+
+@on_event('sync')
+def handle_sync(data):
+    # data: {"epoch": str, "version": int} - the last delta the client applied
+    room = client_room()
+    if room is None:
+        return
+    data = data if isinstance(data, dict) else {}
+    room.refresh()
+    try:
+        version = int(data.get('version', -1))
+    except (TypeError, ValueError):
+        version = -1
+    missed = room.deltas.since(data.get('epoch'), version)
+    if missed is None:
+        emit('queue_update', room.snapshot())
+        return
+    for delta in missed:
+        emit('queue_delta', delta)
 
 if __name__ == '__main__':
+    # Only when serving: importing the module shouldn't start downloads
+    prefetch_upcoming(rooms.get(DEFAULT_ROOM))
     # Use socketio.run to support Flask-SocketIO
-    socketio.run(app, host='0.0.0.0', port=8080, debug=True) 
\ No newline at end of file
+    socketio.run(app, host='0.0.0.0', port=config.API_PORT, debug=config.API_DEBUG) 
\ No newline at end of file
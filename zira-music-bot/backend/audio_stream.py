@@ -0,0 +1,98 @@
+import mmap
+import os
+
+from flask import Response, request
+from werkzeug.http import http_date
+from werkzeug.wsgi import wrap_file
+
+# Files are named after the video_id (or a rendition of it) and never rewritten,
+# so clients and proxies may keep them for a year without revalidating.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CHUNK_SIZE = 256 * 1024
+
+
+def _etag(st):
+    # Strong validator: a given name only ever holds one byte sequence, and a
+    # replaced file gets a new size/mtime pair.
+    return f'{st.st_size:x}-{st.st_mtime_ns:x}'
+
+
+def _mmap_body(f, start, stop):
+    """Yield memoryview slices of an mmap over [start, stop).
+
+    The slices point straight at the page cache, so the server writes them to the
+    socket without building intermediate bytes objects.
+    """
+    try:
+        with f:
+            # The mapping outlives the descriptor, and is unmapped once the last
+            # slice handed to the server is released.
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except ValueError:
+        # Empty files can't be mapped
+        return
+    for offset in range(start, stop, CHUNK_SIZE):
+        yield view[offset:min(offset + CHUNK_SIZE, stop)]
+
+
+def _body(f, start, stop):
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        # Servers with a file_wrapper (gunicorn, uwsgi, ...) use sendfile() from
+        # the current offset up to Content-Length.
+        f.seek(start)
+        return wrap_file(request.environ, f, CHUNK_SIZE)
+    return _mmap_body(f, start, stop)
+
+
+def send_audio(path, mimetype='audio/mpeg', immutable=True):
+    """Serve `path` with byte ranges, ETag/Last-Modified validation and caching headers."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return Response(status=404)
+    size = st.st_size
+    etag = _etag(st)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else 'no-cache',
+    }
+
+    # Conditional GET: If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+    elif request.if_modified_since and int(st.st_mtime) <= request.if_modified_since.timestamp():
+        return Response(status=304, headers=headers)
+
+    start, stop, status = 0, size, 200
+    byte_range = request.range
+    if byte_range is not None and _if_range_matches(etag, st):
+        # Multi-range requests are rare for audio; answering them with the full body is allowed
+        if len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, stop = bounds
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(stop - start)
+
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, mimetype=mimetype)
+    f = open(path, 'rb')
+    return Response(_body(f, start, stop), status=status, headers=headers,
+                    mimetype=mimetype, direct_passthrough=True)
+
+
+def _if_range_matches(etag, st):
+    # A Range is only honoured if the client's copy is still the current file
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(st.st_mtime) <= if_range.date.timestamp()
+    return True
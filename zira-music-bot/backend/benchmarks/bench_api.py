@@ -0,0 +1,331 @@
+"""API server load test: REST throughput/latency and queue_update delivery latency.
+
+Every scenario starts api_server.py in its own process on localhost (eventlet,
+like production) with temporary folders, a pre-built queue of --queue-lengths
+songs and a stubbed yt-dlp, so nothing touches the network or the real queue.
+Then, for --duration seconds:
+
+- --callers REST clients loop over GET /api/queue, POST /api/next and
+  GET /api/search (queries drawn from a fixed pool, so the search cache sees
+  hits and misses), each over its own keep-alive connection;
+- --listener-counts Socket.IO clients sit in a second room, where a ticker
+  POSTs /api/next every --tick seconds; each listener timestamps every
+  queue_update (or queue_delta with --protocol delta) it receives, matched
+  to the tick by version.
+
+It reports requests/s and p50/p95/p99 per endpoint plus delivery latency,
+writes everything to --out as JSON, and with --baseline compares against a
+previous --out file: a throughput drop or p95/p99 rise beyond --tolerance is
+reported as a regression and the exit status is 1.
+
+    python benchmarks/bench_api.py --queue-lengths 10 1000 --listener-counts 0 50 --out results.json
+    python benchmarks/bench_api.py --queue-lengths 10 1000 --listener-counts 0 50 --baseline results.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+LOAD_ROOM = 'bench'
+FANOUT_ROOM = 'bench_fanout'
+# Share of REST calls per endpoint
+MIX = (('GET /api/queue', 5), ('POST /api/next', 3), ('GET /api/search', 2))
+
+
+# --- Fixtures ---
+
+def make_song(i):
+    return {
+        'title': f'Song {i}',
+        'artist': f'Artist {i % 97}',
+        'video_id': f'vid{i:08d}',
+        'albumArt': f'https://i.ytimg.com/vi/vid{i:08d}/maxresdefault.jpg',
+        'src': f'vid{i:08d}.mp3',
+    }
+
+
+def write_queue(path, length):
+    # QueueJournal snapshot format
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'seq': 0, 'queue': [make_song(i) for i in range(length)]}, f)
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL: searches sleep --search-latency and return made-up entries,
+    downloads fail straight away (the prefetcher will try the fixture songs)."""
+
+    latency = 0.05
+
+    def __init__(self, opts=None):
+        self.opts = opts or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False, **kwargs):
+        if not url.startswith('ytsearch'):
+            import yt_dlp
+            raise yt_dlp.utils.DownloadError('downloads are stubbed out in bench_api.py')
+        time.sleep(self.latency)
+        count, query = url[len('ytsearch'):].split(':', 1)
+        seed = sum(map(ord, query))
+        return {'entries': [{'id': f's{seed:06d}{i:04d}', 'title': f'{query} {i}', 'uploader': 'Bench',
+                             'duration': 200} for i in range(int(count or 1))]}
+
+
+def serve(port, search_latency):
+    import yt_dlp
+    FakeYoutubeDL.latency = search_latency
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    import api_server
+    api_server.socketio.run(api_server.app, host='127.0.0.1', port=port, debug=False, log_output=False)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(tmp, queue_length, search_latency):
+    rooms_dir = os.path.join(tmp, 'rooms')
+    os.makedirs(rooms_dir, exist_ok=True)
+    write_queue(os.path.join(rooms_dir, f'{LOAD_ROOM}.json'), queue_length)
+    write_queue(os.path.join(rooms_dir, f'{FANOUT_ROOM}.json'), queue_length)
+    port = free_port()
+    env = dict(os.environ, QUEUE_FILE=os.path.join(tmp, 'queue.json'), ROOMS_DIR=rooms_dir,
+               MP3_FOLDER=os.path.join(tmp, 'mp3'), SEARCH_CACHE_PATH=os.path.join(tmp, 'search.sqlite3'),
+               API_DEBUG='0')
+    proc = subprocess.Popen([sys.executable, __file__, '--serve', str(port), '--search-latency', str(search_latency)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('api_server did not start')
+
+
+# --- Measurements ---
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def summarize(samples, seconds, errors=0):
+    return {'requests': len(samples), 'errors': errors, 'rps': len(samples) / seconds,
+            'p50': percentile(samples, 50), 'p95': percentile(samples, 95), 'p99': percentile(samples, 99)}
+
+
+def rest_caller(port, stop, latencies, errors, seed, queries):
+    rng = random.Random(seed)
+    endpoints = [name for name, weight in MIX for _ in range(weight)]
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while not stop.is_set():
+        name = rng.choice(endpoints)
+        method, path = name.split(' ')
+        if path == '/api/search':
+            path += f'?q=song+{rng.randrange(queries)}&room={LOAD_ROOM}'
+        else:
+            path += f'?room={LOAD_ROOM}'
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=b'' if method == 'POST' else None)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            ok = False
+        if ok:
+            latencies[name].append(time.perf_counter() - start)
+        else:
+            errors[name] += 1
+    conn.close()
+
+
+def connect_listeners(port, count, protocol):
+    import socketio
+    event = 'queue_delta' if protocol == 'delta' else 'queue_update'
+    listeners = []
+    for _ in range(count):
+        client = socketio.Client()
+        received = []  # (version, perf_counter)
+        initial = []  # version of the snapshot sent on connect
+
+        def on_snapshot(data, received=received, initial=initial):
+            if not initial:
+                initial.append(data['version'])
+            elif event == 'queue_update':
+                received.append((data['version'], time.perf_counter()))
+
+        client.on('queue_update', on_snapshot)
+        if event == 'queue_delta':
+            client.on(event, lambda data, received=received: received.append((data['version'], time.perf_counter())))
+        query = f'room={FANOUT_ROOM}' + ('&protocol=delta' if protocol == 'delta' else '')
+        client.connect(f'http://127.0.0.1:{port}?{query}', wait_timeout=10)
+        listeners.append((client, received, initial))
+    deadline = time.time() + 10
+    while time.time() < deadline and not all(initial for _, _, initial in listeners):
+        time.sleep(0.05)
+    return listeners
+
+
+def run_scenario(args, queue_length, listener_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, port = start_server(tmp, queue_length, args.search_latency)
+        try:
+            listeners = connect_listeners(port, listener_count, args.protocol) if listener_count else []
+            stop = threading.Event()
+            latencies = {name: [] for name, _ in MIX}
+            errors = {name: 0 for name, _ in MIX}
+            callers = [threading.Thread(target=rest_caller, args=(port, stop, latencies, errors, i, args.search_queries))
+                       for i in range(args.callers)]
+            sent = {}  # version -> perf_counter when the tick was sent
+            version = listeners[0][2][0] if listeners else 0
+
+            def ticker():
+                nonlocal version
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                while not stop.wait(args.tick):
+                    version += 1
+                    sent[version] = time.perf_counter()
+                    conn.request('POST', f'/api/next?room={FANOUT_ROOM}', body=b'')
+                    conn.getresponse().read()
+                conn.close()
+
+            threads = callers + ([threading.Thread(target=ticker)] if listeners else [])
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - started
+            time.sleep(1)  # let the last ticks arrive
+
+            result = {'queue_length': queue_length, 'listeners': listener_count, 'callers': args.callers,
+                      'duration': seconds, 'protocol': args.protocol,
+                      'rest': {name: summarize(latencies[name], seconds, errors[name]) for name, _ in MIX}}
+            if listeners:
+                delays, lost = [], 0
+                for client, received, _ in listeners:
+                    got = {v: t for v, t in received}
+                    for v, t in sent.items():
+                        if v in got:
+                            delays.append(got[v] - t)
+                        else:
+                            lost += 1
+                    client.disconnect()
+                result['fanout'] = dict(summarize(delays, seconds), ticks=len(sent), lost=lost)
+            return result
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+# --- Reporting ---
+
+def key(result):
+    return (f"queue={result['queue_length']} listeners={result['listeners']} "
+            f"callers={result['callers']} protocol={result['protocol']}")
+
+
+def fmt(ms):
+    return '     -' if ms is None else f'{ms:6.1f}'
+
+
+def report(result):
+    print(key(result))
+    for name, stats in list(result['rest'].items()) + [('queue_update delivery', result.get('fanout'))]:
+        if not stats:
+            continue
+        extra = f"  lost {stats['lost']}" if 'lost' in stats else (f"  errors {stats['errors']}" if stats['errors'] else '')
+        print(f"  {name:<22} {stats['rps']:8.1f}/s  p50 {fmt(stats['p50'])}  p95 {fmt(stats['p95'])}  "
+              f"p99 {fmt(stats['p99'])} ms{extra}")
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing every metric that got worse than `baseline` by more than `tolerance`."""
+    previous = {key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        pairs = [(name, stats, old['rest'].get(name)) for name, stats in result['rest'].items()]
+        if 'fanout' in result:
+            pairs.append(('queue_update delivery', result['fanout'], old.get('fanout')))
+        for name, new_stats, old_stats in pairs:
+            if not old_stats:
+                continue
+            if name != 'queue_update delivery' and old_stats['rps'] and \
+                    new_stats['rps'] < old_stats['rps'] * (1 - tolerance):
+                regressions.append(f"{key(result)} {name}: {old_stats['rps']:.1f}/s -> {new_stats['rps']:.1f}/s")
+            for p in ('p95', 'p99'):
+                if old_stats[p] and new_stats[p] and new_stats[p] > old_stats[p] * (1 + tolerance):
+                    regressions.append(f"{key(result)} {name}: {p} {old_stats[p]:.1f} -> {new_stats[p]:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue-lengths', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--listener-counts', type=int, nargs='+', default=[0, 20])
+    parser.add_argument('--callers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--tick', type=float, default=0.1, help='seconds between ticks in the listeners\' room')
+    parser.add_argument('--protocol', choices=('snapshot', 'delta'), default='snapshot')
+    parser.add_argument('--search-latency', type=float, default=0.05, help='seconds a stubbed search takes')
+    parser.add_argument('--search-queries', type=int, default=200, help='distinct search queries')
+    parser.add_argument('--out', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON from an earlier --out to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.search_latency)
+        return
+
+    results = []
+    for queue_length in args.queue_lengths:
+        for listener_count in args.listener_counts:
+            result = run_scenario(args, queue_length, listener_count)
+            report(result)
+            results.append(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'created': time.time(), 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
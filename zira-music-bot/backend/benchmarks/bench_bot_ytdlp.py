@@ -0,0 +1,126 @@
+"""Bot update latency while yt-dlp downloads are in flight.
+
+A fake extractor stands in for yt-dlp: it sleeps in small steps (network and
+ffmpeg), burns a little CPU per step (yt-dlp's own Python work), reports
+progress and honours should_cancel like music_manager.download_mp3. A probe
+coroutine plays the part of incoming Telegram updates and records how late
+each one is handled.
+
+"inline" runs the downloads in the handler coroutine, the way /play used to;
+"executor" runs them through YtdlpExecutor. Executor latency should stay flat
+as --inflight grows, and cancelled jobs should return within one step.
+
+    python benchmarks/bench_bot_ytdlp.py --inflight 1 4 16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ytdlp_executor import YtdlpExecutor, JobCancelled, DOWNLOADING
+
+
+class FakeCancelled(Exception):
+    pass
+
+
+def fake_download(video_id, seconds, step, cpu_ms, progress=None, should_cancel=None):
+    steps = max(1, int(seconds / step))
+    for i in range(steps):
+        if should_cancel is not None and should_cancel():
+            raise FakeCancelled(video_id)
+        time.sleep(step)
+        spin_until = time.perf_counter() + cpu_ms / 1000.0
+        while time.perf_counter() < spin_until:
+            pass
+        if progress is not None:
+            progress(DOWNLOADING, (i + 1) * 100.0 / steps)
+    return f'{video_id}.mp3'
+
+
+async def probe(stop, interval, lags):
+    """Simulated updates: each should run `interval` after the previous one."""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def run_inline(n, args):
+    for i in range(n):
+        fake_download(f'v{i}', args.seconds, args.step, args.cpu_ms)
+        await asyncio.sleep(0)
+
+
+async def run_executor(n, args, executor):
+    async def one(i):
+        job = executor.new_job()
+        try:
+            if i < args.cancel:
+                asyncio.get_running_loop().call_later(args.seconds / 4, job.cancel)
+            started = time.perf_counter()
+            try:
+                await executor.run(fake_download, f'v{i}', args.seconds, args.step, args.cpu_ms,
+                                   progress=job.progress, should_cancel=job.should_cancel,
+                                   job=job, state=DOWNLOADING)
+                return None
+            except JobCancelled:
+                return time.perf_counter() - started - args.seconds / 4
+        finally:
+            executor.finish(job)
+    return [r for r in await asyncio.gather(*(one(i) for i in range(n))) if r is not None]
+
+
+async def measure(mode, n, args):
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(stop, args.interval, lags))
+    await asyncio.sleep(args.interval * 5)
+    cancel_delays = []
+    started = time.perf_counter()
+    if mode == 'inline':
+        await run_inline(n, args)
+    elif n:
+        executor = YtdlpExecutor(max_workers=args.workers, timeout=args.seconds * n + 30)
+        cancel_delays = await run_executor(n, args, executor)
+        executor.shutdown()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    return lags, cancel_delays, elapsed
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inflight', type=int, nargs='+', default=[0, 1, 4, 16])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=1.0, help='fake download time')
+    parser.add_argument('--step', type=float, default=0.05, help='progress hook interval')
+    parser.add_argument('--cpu-ms', type=float, default=2.0, help='CPU work per progress step')
+    parser.add_argument('--interval', type=float, default=0.01, help='simulated update interval')
+    parser.add_argument('--cancel', type=int, default=2, help='jobs cancelled part-way (executor only)')
+    parser.add_argument('--skip-inline', action='store_true')
+    args = parser.parse_args()
+    modes = ['executor'] if args.skip_inline else ['inline', 'executor']
+    for n in args.inflight:
+        for mode in modes:
+            lags, cancel_delays, elapsed = asyncio.run(measure(mode, n, args))
+            line = (f"{mode:>8} in-flight={n:>3}  updates={len(lags):>5}  "
+                    f"lag p50 {pct(lags, 0.5) * 1000:7.1f} ms  p99 {pct(lags, 0.99) * 1000:7.1f} ms  "
+                    f"max {max(lags, default=0) * 1000:7.1f} ms  wall {elapsed:6.2f}s")
+            if cancel_delays:
+                line += f"  cancel->return {statistics.mean(cancel_delays) * 1000:.0f} ms"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Reaction storm: messages/sec delivered vs. generated, per-event re-emit vs. windowed summaries.
+
+--users clients join one room through Flask-SocketIO's test client (the
+real api_server handlers, rooms and broadcast path) and each sends --rate
+reactions per second for --duration seconds. "baseline" runs with
+REACTION_WINDOW=0 and no rate limit, which is the old behaviour: every
+reaction is re-emitted to every socket. "aggregated" runs with the
+defaults from config.py. Each variant runs in its own process. The clients
+live in the same process, so CPU covers both ends; a variant that can't
+keep up sends less than the offered load.
+
+    python benchmarks/bench_fanout.py --users 200 --rate 8 --duration 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+VARIANTS = {
+    'baseline': {'REACTION_WINDOW': '0', 'REACTION_RATE': '0'},
+    'aggregated': {},
+}
+EMOJI = ['🔥', '❤️', '😂', '👏', '💯']
+
+
+def child(args):
+    sys.path.insert(0, BACKEND_DIR)
+    import api_server
+
+    clients = [api_server.socketio.test_client(api_server.app, query_string='room=bench') for _ in range(args.users)]
+    for client in clients:
+        client.get_received()
+
+    delivered = 0
+
+    def collect():
+        count = 0
+        for client in clients:
+            count += sum(1 for packet in client.get_received() if packet['name'] in ('reaction', 'reaction_summary'))
+        return count
+
+    interval = 1.0 / (args.users * args.rate)
+    generated = 0
+    cpu = time.process_time()
+    start = time.perf_counter()
+    next_collect = start + 0.5
+    while True:
+        now = time.perf_counter()
+        if now - start >= args.duration:
+            break
+        # Send everything that's due, round robin over the users; a saturated server falls behind
+        due = int((now - start) / interval)
+        while generated < due and (generated % 50 or time.perf_counter() - start < args.duration):
+            clients[generated % args.users].emit('reaction', {
+                'user': f'user{generated % args.users}', 'reaction': EMOJI[generated % len(EMOJI)],
+                'song_id': 'song', 'timestamp': str(now)})
+            generated += 1
+        if now >= next_collect:
+            delivered += collect()
+            next_collect = now + 0.5
+        api_server.socketio.sleep(0.002)
+    api_server.socketio.sleep(api_server.reactions.window + 0.05)
+    elapsed = time.perf_counter() - start
+    delivered += collect()
+    print(json.dumps({
+        'generated': generated, 'delivered': delivered, 'seconds': elapsed,
+        'dropped': api_server.reaction_limits.dropped, 'cpu': time.process_time() - cpu,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=8, help='reactions per second per user')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    print(f"{args.users} users in one room, {args.rate:g} reactions/s each "
+          f"(offered {args.users * args.rate:,.0f} msg/s), {args.duration:g} s")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, overrides in VARIANTS.items():
+            env = dict(os.environ, QUEUE_FILE=os.path.join(tmp, f'{name}.json'), ROOMS_DIR=os.path.join(tmp, 'rooms'),
+                       MP3_FOLDER=os.path.join(tmp, 'mp3'), SEARCH_CACHE_PATH=os.path.join(tmp, 'search.sqlite3'),
+                       **overrides)
+            out = subprocess.run([sys.executable, __file__, '--child', name, '--users', str(args.users),
+                                  '--rate', str(args.rate), '--duration', str(args.duration)],
+                                 env=env, capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            seconds = result['seconds']
+            print(f"{name:>10}: sent {result['generated'] / seconds:7,.0f} msg/s  "
+                  f"delivered {result['delivered'] / seconds:11,.0f} msg/s  "
+                  f"({result['delivered'] / max(1, result['generated']):6.1f} per reaction)  "
+                  f"rate-limited {result['dropped']:6}  CPU {result['cpu']:5.1f} s")
+
+
+if __name__ == '__main__':
+    main()
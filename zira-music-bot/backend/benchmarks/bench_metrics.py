@@ -0,0 +1,127 @@
+"""Cost of the instrumentation in metrics.py: per operation, under thread contention, and per request.
+
+The micro numbers are nanoseconds per call of each primitive the hot paths
+use (a counter increment, a histogram observation, a timed block, a timed
+function call against the bare call), single-threaded and with --threads
+threads hammering the same child. "render" is one /metrics scrape with
+--series histogram series registered. "route hooks" is what api_server's
+before/after_request hooks add to every request, next to the time of a
+whole GET /api/queue through Flask's test client (the real app).
+
+    python benchmarks/bench_metrics.py --ops 200000 --requests 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+import metrics  # noqa: E402
+
+
+def best(fn, ops, repeat):
+    """Nanoseconds per fn() call, best of `repeat` runs (like timeit: the least disturbed one)."""
+    return min(timeit.repeat(fn, number=ops, repeat=repeat)) / ops * 1e9
+
+
+def micro(ops, repeat):
+    counter = metrics.counter('bench_counter_total', 'bench', ['kind'])
+    histogram = metrics.histogram('bench_duration_seconds', 'bench', ['kind'])
+    counter_child = counter.labels('a')
+    histogram_child = histogram.labels('a')
+
+    def noop():
+        return None
+
+    def time_block():
+        with histogram.time('a'):
+            pass
+
+    # Every number below has the cost of calling a no-op function taken off
+    baseline = best(noop, ops, repeat)
+    return [(name, best(fn, ops, repeat) - baseline) for name, fn in [
+        ('counter child inc()', counter_child.inc),
+        ('counter labels().inc()', lambda: counter.labels('a').inc()),
+        ('histogram child observe()', lambda: histogram_child.observe(0.003)),
+        ('with histogram.time()', time_block),
+        ('@timed call (over bare call)', metrics.timed(histogram, 'timed')(noop)),
+    ]]
+
+
+def contended(ops, threads):
+    child = metrics.histogram('bench_contended_seconds', 'bench').labels()
+
+    def work():
+        for _ in range(ops):
+            child.observe(0.003)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    count = child.snapshot()[0]
+    assert sum(count) == ops * threads, 'lost observations'
+    return elapsed / (ops * threads) * 1e9
+
+
+def scrape(series):
+    histogram = metrics.histogram('bench_scrape_seconds', 'bench', ['series'])
+    for i in range(series):
+        histogram.labels(str(i)).observe(0.01)
+    start = time.perf_counter()
+    body = metrics.render()
+    return (time.perf_counter() - start) * 1e3, len(body)
+
+
+def request_hooks(count, repeat):
+    """(microseconds the before/after_request hooks add to a request, microseconds per GET /api/queue)."""
+    tmp = tempfile.mkdtemp()
+    os.environ.update(QUEUE_FILE=os.path.join(tmp, 'queue.json'), ROOMS_DIR=os.path.join(tmp, 'rooms'),
+                      MP3_FOLDER=os.path.join(tmp, 'mp3'), SEARCH_CACHE_PATH=os.path.join(tmp, 'search.sqlite3'))
+    import api_server
+    client = api_server.app.test_client()
+    # Timed on their own: the difference between two runs of whole requests is mostly noise
+    with api_server.app.test_request_context('/api/queue'):
+        response = api_server.app.response_class()
+
+        def hooks():
+            api_server.start_request_timer()
+            api_server.observe_request(response)
+
+        hooks_us = best(hooks, count, repeat) / 1000
+    request_us = best(lambda: client.get('/api/queue'), count, repeat) / 1000
+    return hooks_us, request_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--series', type=int, default=200, help='histogram series in the scraped registry')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each measurement; the best one counts')
+    parser.add_argument('--requests', type=int, default=2000, help='per run; 0 skips the route hook measurement')
+    args = parser.parse_args()
+
+    print(f"{args.ops:,} operations each, best of {args.repeat}")
+    for name, ns in micro(args.ops, args.repeat):
+        print(f"{name:>30}: {ns:7.0f} ns")
+    print(f"{'observe(), ' + str(args.threads) + ' threads':>30}: {contended(args.ops, args.threads):7.0f} ns "
+          f"(wall clock per observation)")
+    ms, size = scrape(args.series)
+    print(f"{'render()':>30}: {ms:7.2f} ms for {args.series} histogram series ({size / 1024:.0f} KiB)")
+    if args.requests:
+        hooks_us, request_us = request_hooks(args.requests, args.repeat)
+        print(f"{'route hooks':>30}: {hooks_us * 1000:7.0f} ns per request, "
+              f"{hooks_us / request_us * 100:.1f}% of a GET /api/queue ({request_us:.0f} us)")
+
+
+if __name__ == '__main__':
+    main()
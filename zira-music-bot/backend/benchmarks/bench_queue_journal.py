@@ -0,0 +1,80 @@
+"""Queue mutations/sec: full queue.json rewrite (old save_queue) vs QueueJournal.
+
+Starts from a queue of N songs and keeps adding songs for --seconds per case.
+The journal numbers include its background fsyncs and compactions.
+
+    python benchmarks/bench_queue_journal.py --sizes 10 1000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from queue_journal import QueueJournal
+
+
+def make_song(i):
+    return {
+        'title': f'Song {i}',
+        'artist': f'Artist {i % 97}',
+        'video_id': f'vid{i:08d}',
+        'albumArt': f'https://i.ytimg.com/vi/vid{i:08d}/maxresdefault.jpg',
+        'src': f'vid{i:08d}.mp3',
+    }
+
+
+def bench_rewrite(path, size, seconds):
+    queue = [make_song(i) for i in range(size)]
+    ops, i = 0, size
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        queue.append(make_song(i))
+        i += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(queue, f, ensure_ascii=False, indent=2)
+        ops += 1
+    return ops / (time.perf_counter() - started)
+
+
+def bench_journal(path, size, seconds):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([make_song(i) for i in range(size)], f)
+    queue = []
+    journal = QueueJournal(path, state=lambda: queue)
+    queue.extend(journal.load())
+    ops, i = 0, size
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        song = make_song(i)
+        queue.append(song)
+        i += 1
+        journal.append('add', song=song)
+        ops += 1
+    journal.close()
+    elapsed = time.perf_counter() - started
+    # Sanity check: replay gives back what we wrote
+    replayed = QueueJournal(path, state=list).load()
+    assert len(replayed) == len(queue), (len(replayed), len(queue))
+    return ops / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            rewrite = bench_rewrite(os.path.join(tmp, 'rewrite.json'), size, args.seconds)
+            journal = bench_journal(os.path.join(tmp, 'queue.json'), size, args.seconds)
+        print(f"queue={size:>7}  rewrite={rewrite:>10.1f} ops/s  journal={journal:>10.1f} ops/s  speedup={journal / rewrite:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
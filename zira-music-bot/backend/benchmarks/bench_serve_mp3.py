@@ -0,0 +1,151 @@
+"""Throughput and server CPU per listener for /static/mp3, before and after audio_stream.
+
+Each variant runs in its own eventlet server process (like api_server.py does),
+so the CPU numbers only count the server. Every simulated listener loops:
+seek to a random offset and read to the end (HTTP Range), then revalidate
+the file with If-None-Match like a reconnecting mobile client.
+
+    python benchmarks/bench_serve_mp3.py --listeners 200 --duration 10
+"""
+import argparse
+import http.client
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+VARIANTS = ('baseline', 'streaming')
+
+
+def serve(variant, port, folder):
+    import eventlet
+    import eventlet.wsgi
+    from flask import Flask, send_from_directory
+    from audio_stream import send_audio
+
+    app = Flask(__name__)
+
+    @app.route('/static/mp3/<filename>')
+    def serve_mp3(filename):
+        if variant == 'baseline':
+            return send_from_directory(folder, filename)
+        return send_audio(os.path.join(folder, filename))
+
+    eventlet.wsgi.server(eventlet.listen(('127.0.0.1', port)), app, log_output=False)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def listener(port, size, stop_at, totals, lock):
+    nbytes = requests = errors = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    etag = None
+    while time.time() < stop_at:
+        try:
+            start = random.randrange(0, size)
+            conn.request('GET', '/static/mp3/track.mp3', headers={'Range': f'bytes={start}-'})
+            resp = conn.getresponse()
+            while True:
+                chunk = resp.read(256 * 1024)
+                if not chunk:
+                    break
+                nbytes += len(chunk)
+            etag = resp.getheader('ETag') or etag
+            requests += 1
+            if etag:
+                conn.request('GET', '/static/mp3/track.mp3', headers={'If-None-Match': etag})
+                conn.getresponse().read()
+                requests += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.close()
+    with lock:
+        totals['bytes'] += nbytes
+        totals['requests'] += requests
+        totals['errors'] += errors
+
+
+def run_variant(variant, folder, size, listeners, duration):
+    port = free_port()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc = subprocess.Popen([sys.executable, __file__, '--serve', variant, '--port', str(port), '--folder', folder])
+    try:
+        wait_for_port(port)
+        totals = {'bytes': 0, 'requests': 0, 'errors': 0}
+        lock = threading.Lock()
+        stop_at = time.time() + duration
+        threads = [threading.Thread(target=listener, args=(port, size, stop_at, totals, lock)) for _ in range(listeners)]
+        started = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+    finally:
+        proc.terminate()
+        proc.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    mb = totals['bytes'] / (1024 * 1024)
+    return {
+        'variant': variant,
+        'listeners': listeners,
+        'MB/s': mb / elapsed,
+        'req/s': totals['requests'] / elapsed,
+        'errors': totals['errors'],
+        'server_cpu_s': cpu,
+        'cpu_ms_per_listener_s': cpu * 1000 / (listeners * elapsed),
+        'cpu_ms_per_MB': cpu * 1000 / mb if mb else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listeners', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--size-mb', type=float, default=5)
+    parser.add_argument('--serve', choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--folder', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.folder)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        size = int(args.size_mb * 1024 * 1024)
+        with open(os.path.join(folder, 'track.mp3'), 'wb') as f:
+            f.write(os.urandom(size))
+        for variant in VARIANTS:
+            result = run_variant(variant, folder, size, args.listeners, args.duration)
+            print(' '.join(f'{k}={v:.2f}' if isinstance(v, float) else f'{k}={v}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""SongQueue vs the old list-of-dicts queue: add with duplicate check, lookups and memory.
+
+    python benchmarks/bench_song_queue.py --sizes 1000 10000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from song_queue import Song, SongQueue
+
+
+def make_song(i):
+    return {
+        'title': f'Song {i}',
+        'artist': f'Artist {i % 97}',
+        'video_id': f'vid{i:08d}',
+        'albumArt': f'https://i.ytimg.com/vi/vid{i:08d}/maxresdefault.jpg',
+        'src': f'vid{i:08d}.mp3',
+        'duration': '3:30',
+        'requested_by': 'User',
+    }
+
+
+def fill_list(songs):
+    queue = []
+    for data in songs:
+        # What add_song/download_and_add used to do on every add
+        if any(isinstance(item, dict) and item.get('video_id') == data['video_id'] for item in queue):
+            continue
+        queue.append(dict(data))
+    return queue
+
+
+def fill_song_queue(songs):
+    queue = SongQueue()
+    for data in songs:
+        if data['video_id'] in queue:
+            continue
+        queue.append(Song.from_dict(data))
+    return queue
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def measure_memory(fn, songs):
+    tracemalloc.start()
+    queue = fn(songs)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del queue
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+    for size in args.sizes:
+        # Strings are shared by both variants, so memory only counts the containers
+        songs = [make_song(i) for i in range(size)]
+        as_list, list_fill = timed(fill_list, songs)
+        as_queue, queue_fill = timed(fill_song_queue, songs)
+
+        probe = [songs[(i * 7919) % size]['video_id'] for i in range(args.lookups)]
+        _, list_lookup = timed(lambda: [next((n for n, item in enumerate(as_list) if item['video_id'] == v), None) for v in probe])
+        _, queue_lookup = timed(lambda: [as_queue.position(v) for v in probe])
+
+        list_mem = measure_memory(lambda s: [dict(d) for d in s], songs)
+        queue_mem = measure_memory(lambda s: SongQueue(Song.from_dict(d) for d in s), songs)
+
+        print(f"queue={size:>7}  "
+              f"add: list {size / list_fill:>10.0f}/s  SongQueue {size / queue_fill:>10.0f}/s  |  "
+              f"position: list {args.lookups / list_lookup:>10.0f}/s  SongQueue {args.lookups / queue_lookup:>10.0f}/s  |  "
+              f"bytes/song: list {list_mem / size:.0f}  SongQueue {queue_mem / size:.0f}")
+
+
+if __name__ == '__main__':
+    main()
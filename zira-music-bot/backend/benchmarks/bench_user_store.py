@@ -0,0 +1,97 @@
+"""User/group tracking throughput: the old SELECT + INSERT/UPDATE + commit per call vs UserStore.
+
+Updates are /start-style profile writes spread over --users distinct users,
+with a song count bump every fourth update; --threads handlers write at once.
+
+    python benchmarks/bench_user_store.py --users 100000 --updates 200000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from user_store import UserStore, SCHEMA
+
+
+def make_updates(users, count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(users), i % 4 == 0) for i in range(count)]
+
+
+def run_legacy(path, updates):
+    # What bot.py used to do: one shared cursor, a SELECT and a commit per call
+    conn = sqlite3.connect(path, check_same_thread=False)
+    c = conn.cursor()
+    for statement in SCHEMA:
+        c.execute(statement)
+    conn.commit()
+    started = time.perf_counter()
+    for user_id, played in updates:
+        c.execute('SELECT * FROM users WHERE user_id=?', (user_id,))
+        if c.fetchone():
+            c.execute('UPDATE users SET first_name=?, last_name=?, username=? WHERE user_id=?',
+                      ('First', 'Last', f'user{user_id}', user_id))
+        else:
+            c.execute('INSERT INTO users (user_id, first_name, last_name, username, song_count) VALUES (?, ?, ?, ?, 0)',
+                      (user_id, 'First', 'Last', f'user{user_id}'))
+        conn.commit()
+        if played:
+            c.execute('UPDATE users SET song_count = song_count + 1 WHERE user_id=?', (user_id,))
+            conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed
+
+
+def run_store(path, updates, threads):
+    store = UserStore(path)
+    chunks = [updates[i::threads] for i in range(threads)]
+
+    def worker(chunk):
+        for user_id, played in chunk:
+            store.log_user(user_id, 'First', 'Last', f'user{user_id}')
+            if played:
+                store.add_songs(user_id)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    recorded = time.perf_counter() - started
+    store.flush(timeout=600)
+    durable = time.perf_counter() - started
+    rows = len(store.users())
+    store.close()
+    return recorded, durable, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--updates', type=int, default=200000)
+    parser.add_argument('--legacy-updates', type=int, default=5000,
+                        help='the old path commits per call, so it gets a smaller sample')
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_updates = make_updates(args.users, args.legacy_updates)
+        legacy = run_legacy(os.path.join(tmp, 'legacy.sqlite3'), legacy_updates)
+        print(f"legacy     {len(legacy_updates) / legacy:>10.0f} updates/s  ({len(legacy_updates)} updates)")
+
+        updates = make_updates(args.users, args.updates)
+        recorded, durable, rows = run_store(os.path.join(tmp, 'store.sqlite3'), updates, args.threads)
+        print(f"UserStore  {len(updates) / durable:>10.0f} updates/s committed  "
+              f"({len(updates) / recorded:.0f}/s accepted by handlers, {args.threads} threads, {rows} users)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,22 @@
 import logging
 import config  # Import the config file for BOT_TOKEN, ADMIN_GROUP_ID, ADMINS
+import metrics
+import music_manager
+import fingerprint
+from mp3_cache import Mp3Cache
+from renditions import Renditions
+from search_cache import SearchCache
+from api_client import ApiClient, ApiError
+from user_store import UserStore
+from admin_report import AdminReporter, full_report_page
+from ytdlp_executor import YtdlpExecutor, JobCancelled, QUEUED, SEARCHING, DOWNLOADING, PROCESSING
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, InputMediaPhoto
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler, ChatMemberHandler
-import requests
-import yt_dlp
+from telegram.error import BadRequest, TelegramError
+import asyncio
+import contextlib
+import html
 import os
-import sqlite3
-from datetime import datetime
 
 # Enable logging
 logging.basicConfig(
@@ -15,79 +25,34 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# In-memory data store (for simplicity). For a real bot, use a database.
-music_queue = {}  # {chat_id: [song1, song2, ...]}
-current_song = {} # {chat_id: "current_playing_song"}
-
 # --- Database Setup ---
 DB_PATH = os.path.join(os.path.dirname(__file__), 'botdata.sqlite3')
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-c = conn.cursor()
-c.execute('''CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    first_name TEXT,
-    last_name TEXT,
-    username TEXT,
-    phone TEXT,
-    song_count INTEGER DEFAULT 0
-)''')
-c.execute('''CREATE TABLE IF NOT EXISTS groups (
-    group_id INTEGER PRIMARY KEY,
-    title TEXT,
-    member_count INTEGER,
-    last_joined TIMESTAMP
-)''')
-conn.commit()
+# New users/groups and song requests reach the admin group as one delta report per window
+reporter = AdminReporter(window=config.ADMIN_REPORT_WINDOW)
+store = UserStore(DB_PATH, flush_interval=config.USER_STORE_FLUSH_INTERVAL, on_commit=reporter.record)
 
 # --- Helper Functions ---
 def is_admin(user_id):
     return user_id == config.OWNER_ID or user_id in getattr(config, 'ADMINS', [])
 
 def log_user(user):
-    c.execute('SELECT * FROM users WHERE user_id=?', (user.id,))
-    if c.fetchone():
-        c.execute('''UPDATE users SET first_name=?, last_name=?, username=? WHERE user_id=?''',
-                  (user.first_name, user.last_name, user.username, user.id))
-    else:
-        c.execute('''INSERT INTO users (user_id, first_name, last_name, username, song_count) VALUES (?, ?, ?, ?, 0)''',
-                  (user.id, user.first_name, user.last_name, user.username))
-    conn.commit()
-
-def increment_song_count(user):
-    c.execute('UPDATE users SET song_count = song_count + 1 WHERE user_id=?', (user.id,))
-    conn.commit()
+    store.log_user(user.id, user.first_name, user.last_name, user.username)
+
+def record_play(user, chat, video_id, title):
+    # Also bumps the user's song_count
+    if user:
+        log_user(user)
+    store.record_play(user.id if user else None, chat.id if chat else None, video_id, title)
 
 def log_group(chat, member_count=None):
-    c.execute('SELECT * FROM groups WHERE group_id=?', (chat.id,))
-    if c.fetchone():
-        c.execute('''UPDATE groups SET title=?, member_count=?, last_joined=? WHERE group_id=?''',
-                  (chat.title, member_count or 0, datetime.utcnow(), chat.id))
-    else:
-        c.execute('''INSERT INTO groups (group_id, title, member_count, last_joined) VALUES (?, ?, ?, ?)''',
-                  (chat.id, chat.title, member_count or 0, datetime.utcnow()))
-    conn.commit()
-
-def get_all_users():
-    c.execute('SELECT user_id, first_name, last_name, username, song_count FROM users')
-    return c.fetchall()
-
-def get_all_groups():
-    c.execute('SELECT group_id, title, member_count, last_joined FROM groups')
-    return c.fetchall()
-
-def send_admin_report(app):
-    users = get_all_users()
-    groups = get_all_groups()
-    msg = f"<b>User & Group Report</b>\n\n<b>Users ({len(users)}):</b>\n"
-    for u in users:
-        name = f"{u[1] or ''} {u[2] or ''}".strip()
-        uname = f"(@{u[3]})" if u[3] else ''
-        msg += f"- {name} {uname} (ID: <code>{u[0]}</code>) | Songs: {u[4]}\n"
-    msg += f"\n<b>Groups ({len(groups)}):</b>\n"
-    for g in groups:
-        msg += f"- {g[1]} (ID: <code>{g[0]}</code>) | Members: {g[2]} | Last joined: {g[3]}\n"
+    store.log_group(chat.id, chat.title, member_count or 0)
+
+async def send_admin_report(bot, text):
     if config.ADMIN_GROUP_ID:
-        app.bot.send_message(chat_id=config.ADMIN_GROUP_ID, text=msg, parse_mode='HTML')
+        await bot.send_message(chat_id=config.ADMIN_GROUP_ID, text=text, parse_mode='HTML')
+
+def page_arg(context):
+    return int(context.args[0]) if context.args and context.args[0].isdigit() else 1
 
 # --- Configuration ---
 # Define the correct API URL and paths relative to the project root
@@ -96,11 +61,89 @@ API_URL = "http://localhost:8080/api"
 # For local testing, you can use a file path, but it may not work on all Telegram clients.
 # Replace this with your actual URL when deploying.
 MINI_APP_URL = "https://samy-dj19.github.io/ziramusicroom/"
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-MP3_FOLDER = os.path.join(PROJECT_ROOT, 'static', 'mp3')
 
-# Ensure the MP3 folder exists
-os.makedirs(MP3_FOLDER, exist_ok=True)
+# One pooled async client for every handler, so API calls never block the event loop
+api = ApiClient(API_URL, timeout=config.API_TIMEOUT, retries=config.API_RETRIES)
+
+# Every chat has its own room (queue, playback state, chat) on the API server
+def room_params(update):
+    return {"room": str(update.effective_chat.id)}
+
+def mini_app_url(update):
+    return f"{MINI_APP_URL}?room={update.effective_chat.id}"
+
+# Same folder the API server serves from, under one shared disk budget
+MP3_FOLDER = config.MP3_FOLDER
+# Evicting a track also drops the lighter renditions the API server made of it
+renditions = Renditions(MP3_FOLDER, config.RENDITION_BITRATES, music_manager.MP3_BITRATE, config.RENDITION_OPUS_BITRATE)
+mp3_cache = Mp3Cache(MP3_FOLDER, config.MP3_CACHE_MAX_BYTES, config.MP3_CACHE_POLICY, on_evict=renditions.remove,
+                     derived_sizes=renditions.sizes)
+# Shared with the API server too: re-uploads of a downloaded track reuse its file
+fingerprints = (fingerprint.FingerprintIndex(MP3_FOLDER, config.FINGERPRINT_SECONDS, config.FINGERPRINT_PROBE_SECONDS,
+                                             config.FFMPEG_BINARY)
+                if config.FINGERPRINT_DEDUP and fingerprint.available() else None)
+search_cache = SearchCache(
+    music_manager.search_youtube,
+    ttl=config.SEARCH_CACHE_TTL,
+    stale_ttl=config.SEARCH_CACHE_STALE_TTL,
+    max_entries=config.SEARCH_CACHE_SIZE,
+    store_path=config.SEARCH_CACHE_PATH,
+)
+
+# --- yt-dlp work ---
+# Searches and downloads run on a small thread pool so the event loop keeps answering other updates
+ytdlp = YtdlpExecutor(max_workers=config.BOT_YTDLP_WORKERS, timeout=config.BOT_DOWNLOAD_TIMEOUT)
+
+PROGRESS_TEXT = {
+    QUEUED: "⏳ Waiting for a free downloader...",
+    SEARCHING: "🔎 Searching...",
+    DOWNLOADING: "⬇️ Downloading...",
+    PROCESSING: "🎛️ Converting to MP3...",
+}
+
+def cancel_keyboard(job):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_{job.id}")]])
+
+async def report_progress(message, job):
+    """Keep `message` showing the job's progress; deleting the message cancels the job."""
+    shown = message.text
+    while True:
+        await asyncio.sleep(config.BOT_PROGRESS_INTERVAL)
+        text = PROGRESS_TEXT.get(job.state, "⏳ Working...")
+        if job.percent is not None:
+            text += f" {job.percent:.0f}%"
+        if text == shown:
+            continue
+        try:
+            await message.edit_text(text, reply_markup=cancel_keyboard(job))
+            shown = text
+        except BadRequest as e:
+            if "not found" in str(e).lower():
+                logger.info(f"Progress message for job {job.id} is gone, cancelling")
+                job.cancel()
+                return
+            logger.warning(f"Could not update progress for job {job.id}: {e}")
+        except TelegramError as e:
+            logger.warning(f"Could not update progress for job {job.id}: {e}")
+
+@contextlib.asynccontextmanager
+async def progress_message(message, job):
+    task = asyncio.create_task(report_progress(message, job)) if message else None
+    try:
+        yield
+    finally:
+        if task:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        ytdlp.finish(job)
+
+async def show_cancelled(message):
+    # The message may be what got deleted
+    try:
+        await message.edit_text("✖️ Cancelled.")
+    except TelegramError:
+        pass
 
 # --- Bot Command Handlers ---
 
@@ -126,28 +169,44 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "/skip - Skips the current song.\n"
         "/playlist - Shows the current song queue.\n"
         "/end - Stops playback and clears the queue.\n"
-        "/users - List users (admin only)"
+        "/users - List users (admin only)\n"
+        "/report - Full user & group report (admin only)"
     )
     await update.message.reply_html(help_text)
 
 # --- Health Check Command ---
 async def health(update: Update, context: CallbackContext) -> None:
-    await update.message.reply_text("Bot is running and healthy!")
+    search = search_cache.stats()
+    await update.message.reply_text(
+        "Bot is running and healthy!\n"
+        f"Search cache hit ratio: {search['hit_ratio']:.0%} ({search['entries']} queries cached)"
+    )
 
 # --- Statistics Command ---
 async def stats(update: Update, context: CallbackContext) -> None:
-    users = get_all_users()
-    c.execute('SELECT title, COUNT(*) as cnt FROM users, songs WHERE users.user_id = songs.user_id GROUP BY title ORDER BY cnt DESC LIMIT 5')
-    top_songs = c.fetchall() if c.description else []
-    msg = f"<b>Bot Stats</b>\n\n<b>Total Users:</b> {len(users)}\n"
-    if top_songs:
-        msg += "<b>Top Songs:</b>\n"
-        for i, (title, cnt) in enumerate(top_songs):
-            msg += f"{i+1}. {title} ({cnt} plays)\n"
-    else:
-        msg += "No song stats available.\n"
+    chat = update.effective_chat
+    # Groups also get their own numbers; everything comes from precomputed aggregates
+    chat_id = chat.id if chat and chat.type in ['group', 'supergroup'] else None
+    # Off the event loop: reads wait for the writer thread to commit what's pending
+    s = await asyncio.to_thread(store.stats, chat_id)
+    msg = (
+        f"<b>Bot Stats</b>\n\n<b>Total Users:</b> {s['users']}\n"
+        f"<b>Plays:</b> {s['plays_24h']} (24h) | {s['plays_7d']} (7d) | {s['plays']} (all time)\n"
+    )
+    if chat_id is not None:
+        msg += f"<b>Plays Here:</b> {s['chat_plays_24h']} (24h) | {s['chat_plays_7d']} (7d)\n"
+        msg += format_top_songs("Top Songs Here", s['chat_top_tracks'])
+    msg += format_top_songs("Top Songs", s['top_tracks'])
     await update.message.reply_html(msg)
 
+def format_top_songs(heading, top_songs):
+    if not top_songs:
+        return f"\n<b>{heading}:</b>\nNo song stats available.\n"
+    msg = f"\n<b>{heading}:</b>\n"
+    for i, (title, cnt) in enumerate(top_songs):
+        msg += f"{i+1}. {html.escape(title or 'Unknown Title')} ({cnt} plays)\n"
+    return msg
+
 # --- Enhanced /play Command ---
 async def play(update: Update, context: CallbackContext) -> None:
     if not context.args:
@@ -155,64 +214,66 @@ async def play(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text("Usage: /play <song name or artist - song>")
         return
     song_query = " ".join(context.args)
-    if hasattr(update, 'message') and update.message:
-        searching_msg = await update.message.reply_text("⏳ Searching and downloading...")
-    elif hasattr(update, 'effective_chat') and update.effective_chat:
-        searching_msg = await update.effective_chat.send_message("⏳ Searching and downloading...")
-    else:
-        searching_msg = None
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(MP3_FOLDER, '%(id)s.%(ext)s'),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'default_search': 'ytsearch',
-    }
+    job = ytdlp.new_job(update.effective_chat.id if update.effective_chat else None)
+    searching_msg = None
+    # Everything from new_job on is in the try, so the job is dropped even if sending the message fails
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_list = ydl.extract_info(f"ytsearch5:{song_query}", download=False)['entries']
-            if not info_list:
-                if searching_msg:
-                    await searching_msg.edit_text(f"❌ No results for '{song_query}'.")
-                return
-            # If multiple, show options as inline buttons
-            if len(info_list) > 1:
-                keyboard = [
-                    [InlineKeyboardButton(f"{i+1}. {info['title']} - {info.get('uploader', 'Unknown')}", callback_data=f"play_{info['id']}")]
-                    for i, info in enumerate(info_list)
-                ]
-                if searching_msg:
-                    await searching_msg.edit_text(
-                        "Multiple results found. Select one:",
-                        reply_markup=InlineKeyboardMarkup(keyboard)
-                    )
-                context.user_data['multi_results'] = {info['id']: info for info in info_list}
-                return
-            info = info_list[0]
-            # Download the selected song
-            ydl.download([info['webpage_url']])
-            video_id = info.get('id')
-            filename = f"{video_id}.mp3"
-            file_path = os.path.join(MP3_FOLDER, filename)
-            if not os.path.exists(file_path):
-                if searching_msg:
-                    await searching_msg.edit_text(f"❌ Download failed. Check ffmpeg is installed.")
-                return
-            title = info.get('title', "Unknown Title")
-            artist = info.get('uploader', 'Unknown Artist')
-            thumbnail = info.get('thumbnail') or 'https://i.ibb.co/G5rGWWd/default-album-art.png'
-            duration = info.get('duration', 0)
-            duration_str = f"{int(duration // 60)}:{int(duration % 60):02d}" if duration else "N/A"
-            src_filename = filename
+        if hasattr(update, 'message') and update.message:
+            searching_msg = await update.message.reply_text("⏳ Searching and downloading...", reply_markup=cancel_keyboard(job))
+        elif hasattr(update, 'effective_chat') and update.effective_chat:
+            searching_msg = await update.effective_chat.send_message("⏳ Searching and downloading...", reply_markup=cancel_keyboard(job))
+        async with progress_message(searching_msg, job):
+            # Cached search results are shared with the API server's /api/search
+            info_list = await ytdlp.run(search_cache.get, song_query, job=job, state=SEARCHING,
+                                        timeout=config.BOT_SEARCH_TIMEOUT)
+            if len(info_list) == 1:
+                info = info_list[0]
+                # Download the selected song (shared with other chats and the API server)
+                filename = await ytdlp.run(
+                    music_manager.download_mp3, info['video_id'], MP3_FOLDER, url=info['webpage_url'],
+                    cache=mp3_cache, progress=job.progress, should_cancel=job.should_cancel,
+                    fingerprints=fingerprints, job=job, state=DOWNLOADING,
+                )
+    except (JobCancelled, music_manager.DownloadCancelled):
+        if searching_msg:
+            await show_cancelled(searching_msg)
+        return
+    except TimeoutError:
+        if searching_msg:
+            await searching_msg.edit_text("❌ That took too long. Please try again later.")
+        return
     except Exception as e:
         if searching_msg:
             await searching_msg.edit_text(f"❌ Error: {e}")
         logger.error(f"Error in /play: {e}", exc_info=True)
         return
+    finally:
+        ytdlp.finish(job)
+    if not info_list:
+        if searching_msg:
+            await searching_msg.edit_text(f"❌ No results for '{song_query}'.")
+        return
+    # If multiple, show options as inline buttons
+    if len(info_list) > 1:
+        keyboard = [
+            [InlineKeyboardButton(f"{i+1}. {info['title']} - {info.get('artist') or 'Unknown'}", callback_data=f"play_{info['video_id']}")]
+            for i, info in enumerate(info_list)
+        ]
+        if searching_msg:
+            await searching_msg.edit_text(
+                "Multiple results found. Select one:",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        context.user_data['multi_results'] = {info['video_id']: info for info in info_list}
+        return
+    # A re-upload of a track we already have comes back as that track's file
+    video_id = filename[:-4]
+    title = info.get('title') or "Unknown Title"
+    artist = info.get('artist') or 'Unknown Artist'
+    thumbnail = info.get('thumbnail') or 'https://i.ibb.co/G5rGWWd/default-album-art.png'
+    duration = info.get('duration', 0)
+    duration_str = f"{int(duration // 60)}:{int(duration % 60):02d}" if duration else "N/A"
+    src_filename = filename
     song_data = {
         "title": title,
         "artist": artist,
@@ -223,11 +284,10 @@ async def play(update: Update, context: CallbackContext) -> None:
         "requested_by": update.effective_user.first_name if hasattr(update, 'effective_user') and update.effective_user and hasattr(update.effective_user, 'first_name') else "User"
     }
     try:
-        response = requests.post(f"{API_URL}/queue", json=song_data)
-        response.raise_for_status()
-        backend_response = response.json()
+        backend_response = await api.post("/queue", json=song_data, params=room_params(update))
+        record_play(update.effective_user, update.effective_chat, video_id, title)
         keyboard = [
-            [InlineKeyboardButton("▶️ LAUNCH ROOM", web_app=WebAppInfo(url=MINI_APP_URL))],
+            [InlineKeyboardButton("▶️ LAUNCH ROOM", web_app=WebAppInfo(url=mini_app_url(update)))],
             [
                 InlineKeyboardButton("⏮️", callback_data="prev"),
                 InlineKeyboardButton("⏸️", callback_data="pause"),
@@ -248,11 +308,10 @@ async def play(update: Update, context: CallbackContext) -> None:
                 caption=caption,
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
-    except requests.exceptions.RequestException as e:
+    except ApiError as e:
         if searching_msg:
             await searching_msg.edit_text(f"❌ Backend error: {e}")
         return
-    send_admin_report(context.application)
 
 async def unknown_command(update: Update, context: CallbackContext) -> None:
     """Handles any command that is not recognized."""
@@ -261,42 +320,40 @@ async def unknown_command(update: Update, context: CallbackContext) -> None:
 async def pause(update: Update, context: CallbackContext) -> None:
     # Note: These commands are now less useful as controls are in the UI
     try:
-        requests.post(f"{API_URL}/pause")
+        await api.post("/pause", params=room_params(update))
         await update.message.reply_text("⏸️ Pause command sent to player.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error communicating with player: {e}")
 
 async def resume(update: Update, context: CallbackContext) -> None:
     try:
-        requests.post(f"{API_URL}/resume")
+        await api.post("/resume", params=room_params(update))
         await update.message.reply_text("▶️ Resume command sent to player.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error communicating with player: {e}")
 
 async def skip(update: Update, context: CallbackContext) -> None:
     try:
-        requests.post(f"{API_URL}/skip")
+        await api.post("/skip", params=room_params(update))
         await update.message.reply_text("⏭️ Skip command sent to player.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error communicating with player: {e}")
 
 async def playlist(update: Update, context: CallbackContext) -> None:
     try:
-        response = requests.get(f"{API_URL}/playlist")
-        response.raise_for_status()
-        data = response.json()
+        data = await api.get("/playlist", params=room_params(update))
         queue = data.get("queue", [])
         if not queue:
             await update.message.reply_text("The playlist is currently empty.")
         else:
             playlist_text = '\n'.join([f"*{i+1}.* {song.get('title', 'N/A')} - _{song.get('artist', 'N/A')}_" for i, song in enumerate(queue)])
             await update.message.reply_text(f"*Current Playlist:*\n{playlist_text}", parse_mode='Markdown')
-    except requests.exceptions.RequestException as e:
+    except ApiError as e:
         await update.message.reply_text(f"❌ Failed to fetch playlist: {e}")
 
 async def end(update: Update, context: CallbackContext) -> None:
     try:
-        requests.post(f"{API_URL}/end")
+        await api.post("/end", params=room_params(update))
         await update.message.reply_text("🛑 End command sent. Player queue cleared.")
     except Exception as e:
         await update.message.reply_text(f"❌ Error communicating with player: {e}")
@@ -306,21 +363,24 @@ async def users_command(update: Update, context: CallbackContext) -> None:
     if not is_admin(user.id):
         await update.message.reply_text("You are not authorized to use this command.")
         return
-    users = get_all_users()
-    msg = f"<b>Total Users: {len(users)}</b>\n\n"
-    for u in users:
-        name = f"{u[1] or ''} {u[2] or ''}".strip()
-        uname = f"(@{u[3]})" if u[3] else ''
-        msg += f"- {name} {uname} (ID: <code>{u[0]}</code>) | Songs: {u[4]}\n"
-    await update.message.reply_html(msg)
+    # Off the event loop: the store's reads wait for pending writes to commit
+    page = await asyncio.to_thread(full_report_page, store, page_arg(context), config.ADMIN_REPORT_PAGE_SIZE,
+                                   groups=False)
+    await update.message.reply_html(page)
+
+async def report_command(update: Update, context: CallbackContext) -> None:
+    """Full user & group report, one page at a time: /report [page]"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+    page = await asyncio.to_thread(full_report_page, store, page_arg(context), config.ADMIN_REPORT_PAGE_SIZE)
+    await update.message.reply_html(page)
 
 async def group_join(update: Update, context: CallbackContext) -> None:
     chat = update.effective_chat
     if chat.type in ['group', 'supergroup']:
         member_count = await context.bot.get_chat_members_count(chat.id)
         log_group(chat, member_count)
-        # Optionally send report to admin group
-        send_admin_report(context.application)
 
 # Update button handler to handle play_<video_id> callback
 async def button(update: Update, context: CallbackContext):
@@ -329,16 +389,16 @@ async def button(update: Update, context: CallbackContext):
     if query.data == "close_room":
         await query.delete_message()
     elif query.data == "pause":
-        requests.post(f"{API_URL}/pause")
+        api.fire("POST", "/pause", key=update.effective_chat.id, params=room_params(update))
         await query.answer("Paused!")
     elif query.data == "play":
-        requests.post(f"{API_URL}/resume")
+        api.fire("POST", "/resume", key=update.effective_chat.id, params=room_params(update))
         await query.answer("Resumed!")
     elif query.data == "skip":
-        requests.post(f"{API_URL}/next")
+        api.fire("POST", "/next", key=update.effective_chat.id, params=room_params(update))
         await query.answer("Skipped!")
     elif query.data == "prev":
-        requests.post(f"{API_URL}/prev")
+        api.fire("POST", "/prev", key=update.effective_chat.id, params=room_params(update))
         await query.answer("Previous!")
     elif query.data.startswith("play_"):
         video_id = query.data.split("_", 1)[1]
@@ -347,27 +407,18 @@ async def button(update: Update, context: CallbackContext):
             await query.edit_message_text("Song info not found. Please try again.")
             return
         # Download and play/add the selected song
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(MP3_FOLDER, '%(id)s.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,
-        }
+        job = ytdlp.new_job(update.effective_chat.id)
         try:
-            import yt_dlp
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([info['webpage_url']])
-            filename = f"{video_id}.mp3"
-            file_path = os.path.join(MP3_FOLDER, filename)
-            if not os.path.exists(file_path):
-                await query.edit_message_text(f"❌ Download failed. Check ffmpeg is installed.")
-                return
-            title = info.get('title', "Unknown Title")
-            artist = info.get('uploader', 'Unknown Artist')
+            await query.edit_message_text("⏳ Downloading...", reply_markup=cancel_keyboard(job))
+            async with progress_message(query.message, job):
+                filename = await ytdlp.run(
+                    music_manager.download_mp3, video_id, MP3_FOLDER, url=info['webpage_url'],
+                    cache=mp3_cache, progress=job.progress, should_cancel=job.should_cancel,
+                    fingerprints=fingerprints, job=job, state=DOWNLOADING,
+                )
+            video_id = filename[:-4]
+            title = info.get('title') or "Unknown Title"
+            artist = info.get('artist') or 'Unknown Artist'
             thumbnail = info.get('thumbnail') or 'https://i.ibb.co/G5rGWWd/default-album-art.png'
             duration = info.get('duration', 0)
             duration_str = f"{int(duration // 60)}:{int(duration % 60):02d}" if duration else "N/A"
@@ -381,11 +432,10 @@ async def button(update: Update, context: CallbackContext):
                 "duration": duration_str,
                 "requested_by": query.from_user.first_name if hasattr(query, 'from_user') and query.from_user and hasattr(query.from_user, 'first_name') else "User"
             }
-            response = requests.post(f"{API_URL}/queue", json=song_data)
-            response.raise_for_status()
-            backend_response = response.json()
+            backend_response = await api.post("/queue", json=song_data, params=room_params(update))
+            record_play(query.from_user, update.effective_chat, video_id, title)
             keyboard = [
-                [InlineKeyboardButton("▶️ LAUNCH ROOM", web_app=WebAppInfo(url=MINI_APP_URL))],
+                [InlineKeyboardButton("▶️ LAUNCH ROOM", web_app=WebAppInfo(url=mini_app_url(update)))],
                 [
                     InlineKeyboardButton("⏮️", callback_data="prev"),
                     InlineKeyboardButton("⏸️", callback_data="pause"),
@@ -404,35 +454,90 @@ async def button(update: Update, context: CallbackContext):
                 media=InputMediaPhoto(media=song_data["albumArt"], caption=caption),
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+        except (JobCancelled, music_manager.DownloadCancelled):
+            await show_cancelled(query.message)
+        except TimeoutError:
+            await query.edit_message_text("❌ That took too long. Please try again later.")
         except Exception as e:
             await query.edit_message_text(f"❌ Error: {e}")
+        finally:
+            # Also when the "Downloading..." edit itself failed, before progress_message could
+            ytdlp.finish(job)
         return
+    elif query.data.startswith("cancel_"):
+        job = ytdlp.get(query.data.split("_", 1)[1])
+        # Anyone in the chat may cancel, but only that chat's jobs
+        if job and job.chat_id == update.effective_chat.id:
+            job.cancel()
+
+# --- Metrics ---
+# Every handler is timed; yt-dlp, SQLite and API calls are timed where they happen. The bot has
+# no web server, so a sidecar listener serves GET /metrics on BOT_METRICS_PORT.
+HANDLER_SECONDS = metrics.histogram('bot_handler_duration_seconds', 'Telegram update handlers, by handler',
+                                    ['handler'])
+HANDLER_ERRORS = metrics.counter('bot_handler_errors_total', 'Telegram update handlers that raised', ['handler'])
+metrics.gauge('user_store_pending', 'User/group/play updates waiting for the next batch write',
+              collect=lambda: store.pending)
+metrics_server = None
+
+def timed(name, callback):
+    return metrics.timed(HANDLER_SECONDS, name, errors=HANDLER_ERRORS)(callback)
+
+def start_metrics_server():
+    global metrics_server
+    if not config.BOT_METRICS_PORT:
+        return
+    try:
+        metrics_server = metrics.serve(config.BOT_METRICS_PORT)
+    except OSError as e:
+        # Not worth stopping the bot over
+        logger.warning(f"Could not serve metrics on port {config.BOT_METRICS_PORT}: {e}")
 
 # --- Main Bot Execution ---
 
+async def startup(app):
+    start_metrics_server()
+    await api.start()
+    reporter.start(lambda text: send_admin_report(app.bot, text))
+
+async def stop(app):
+    # The bot can still send here (not in post_shutdown); report what's left of the window
+    store.flush()
+    await reporter.stop()
+
+async def shutdown(app):
+    ytdlp.shutdown()
+    await api.stop()
+    store.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
 def main():
     """Start the bot."""
     if not config.BOT_TOKEN:
         raise ValueError("No BOT_TOKEN found in environment variables!")
-    app = ApplicationBuilder().token(config.BOT_TOKEN).build()
+    # The shared API client and the admin reporter start with the application and stop with it
+    app = (ApplicationBuilder().token(config.BOT_TOKEN)
+           .post_init(startup).post_stop(stop).post_shutdown(shutdown).build())
 
     # on different commands - answer in Telegram
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("play", play))
-    app.add_handler(CommandHandler("skip", skip))
-    app.add_handler(CommandHandler("playlist", playlist))
-    app.add_handler(CommandHandler("end", end))
-    app.add_handler(CommandHandler("users", users_command))
-    app.add_handler(CommandHandler("health", health))
-    app.add_handler(CommandHandler("stats", stats))
-    app.add_handler(ChatMemberHandler(group_join, ChatMemberHandler.CHAT_MEMBER))
+    app.add_handler(CommandHandler("start", timed("start", start)))
+    app.add_handler(CommandHandler("help", timed("help", help_command)))
+    app.add_handler(CommandHandler("play", timed("play", play)))
+    app.add_handler(CommandHandler("skip", timed("skip", skip)))
+    app.add_handler(CommandHandler("playlist", timed("playlist", playlist)))
+    app.add_handler(CommandHandler("end", timed("end", end)))
+    app.add_handler(CommandHandler("users", timed("users", users_command)))
+    app.add_handler(CommandHandler("report", timed("report", report_command)))
+    app.add_handler(CommandHandler("health", timed("health", health)))
+    app.add_handler(CommandHandler("stats", timed("stats", stats)))
+    app.add_handler(ChatMemberHandler(timed('group_join', group_join), ChatMemberHandler.CHAT_MEMBER))
 
     # Handler for unknown commands
-    app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    app.add_handler(MessageHandler(filters.COMMAND, timed('unknown_command', unknown_command)))
 
     # Handler for button queries
-    app.add_handler(CallbackQueryHandler(button))
+    app.add_handler(CallbackQueryHandler(timed('button', button)))
 
     # Run the bot until the user presses Ctrl-C
     app.run_polling()
@@ -22,4 +22,111 @@ API_KEY = os.getenv('API_KEY')
 # Set your admin group chat ID here (as an integer, e.g. -1001234567890)
 ADMIN_GROUP_ID = 4823177816
 # List of admin user IDs (comma-separated in .env, or hardcode as list)
-ADMINS = [int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip().isdigit()] 
\ No newline at end of file
+ADMINS = [int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip().isdigit()] 
+
+# --- Downloads ---
+# Number of yt-dlp downloads the API server runs at the same time
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+
+# --- MP3 cache ---
+# One folder shared by bot.py and api_server.py (api_server.py serves it at /static/mp3)
+MP3_FOLDER = os.getenv("MP3_FOLDER", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'mp3'))
+# Disk budget for downloaded audio; least recently used (or least frequently, with "lfu") tracks are evicted
+MP3_CACHE_MAX_BYTES = int(os.getenv("MP3_CACHE_MAX_MB", "2048")) * 1024 * 1024
+MP3_CACHE_POLICY = os.getenv("MP3_CACHE_POLICY", "lru")
+
+# --- Duplicate detection ---
+# New downloads are fingerprinted (first FINGERPRINT_SECONDS of audio); a re-upload of a track
+# already on disk reuses that file. The first FINGERPRINT_PROBE_SECONDS are checked before the
+# full download (0 turns the probe off). Needs numpy; without it every download is kept.
+FINGERPRINT_DEDUP = os.getenv("FINGERPRINT_DEDUP", "1") == "1"
+FINGERPRINT_SECONDS = int(os.getenv("FINGERPRINT_SECONDS", "120"))
+FINGERPRINT_PROBE_SECONDS = int(os.getenv("FINGERPRINT_PROBE_SECONDS", "20"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# --- Renditions ---
+# Lower bitrates (kbps) each track can also be streamed at, via /static/mp3/<file>?quality=<kbps>
+# or picked from Save-Data/ECT/Downlink hints; each is transcoded on first request.
+# RENDITION_OPUS_BITRATE > 0 adds an Opus rendition (?quality=opus).
+RENDITION_BITRATES = [int(x) for x in os.getenv("RENDITION_BITRATES", "64,128").split(",") if x.strip().isdigit()]
+RENDITION_OPUS_BITRATE = int(os.getenv("RENDITION_OPUS_BITRATE", "0"))
+RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", "1"))
+# A rendition whose transcode failed is served from the original until this many seconds have passed
+RENDITION_RETRY_SECONDS = int(os.getenv("RENDITION_RETRY_SECONDS", "600"))
+
+# --- Prefetch ---
+# The API server keeps each room's current song and the next PREFETCH_LOOKAHEAD after it downloaded,
+# transcoded and in the page cache, on PREFETCH_WORKERS threads niced by PREFETCH_NICENESS
+PREFETCH_LOOKAHEAD = int(os.getenv("PREFETCH_LOOKAHEAD", "2"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "1"))
+PREFETCH_NICENESS = int(os.getenv("PREFETCH_NICENESS", "10"))
+
+# --- Search cache ---
+# Shared by bot.py and api_server.py; results younger than TTL are fresh, up to STALE_TTL they
+# are served immediately and refreshed in the background
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_cache.sqlite3'))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", "21600"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+
+# --- Queue persistence ---
+# The default room's queue (other rooms live in ROOMS_DIR)
+QUEUE_FILE = os.getenv("QUEUE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'queue.json'))
+# Journal records are fsynced in batches this often (seconds), and folded into queue.json
+# after this many records
+QUEUE_FSYNC_INTERVAL = float(os.getenv("QUEUE_FSYNC_INTERVAL", "0.05"))
+QUEUE_COMPACT_AFTER = int(os.getenv("QUEUE_COMPACT_AFTER", "1000"))
+# Socket.IO clients that reconnect within this many queue changes get only the deltas they missed
+QUEUE_REPLAY_SIZE = int(os.getenv("QUEUE_REPLAY_SIZE", "256"))
+
+# --- Rooms ---
+# Per-chat queue files live here; rooms with no connected clients are unloaded after ROOM_IDLE_TIMEOUT seconds
+ROOMS_DIR = os.getenv("ROOMS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rooms'))
+ROOM_IDLE_TIMEOUT = int(os.getenv("ROOM_IDLE_TIMEOUT", "600"))
+
+# --- Scale-out ---
+# To run several API server workers (see serve_workers.py), they need shared room state and a
+# Socket.IO message queue. STATE_STORE: "sqlite:///<path>" ("" keeps state in the process).
+# SOCKETIO_MESSAGE_QUEUE: "sqlite:///<path>", or a redis://, amqp://, kafka:// or zmq URL.
+STATE_STORE = os.getenv("STATE_STORE", "")
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_DEBUG = os.getenv("API_DEBUG", "1") == "1"
+
+# --- Chat and reactions ---
+# Rooms keep the last CHAT_HISTORY_SIZE chat messages for clients that join. Reactions are counted
+# per song and sent to the room as one reaction_summary every REACTION_WINDOW seconds (0 re-emits
+# each one as before). Each client may send RATE events per second, bursts of up to BURST (rate 0: no limit).
+CHAT_HISTORY_SIZE = int(os.getenv("CHAT_HISTORY_SIZE", "50"))
+REACTION_WINDOW = float(os.getenv("REACTION_WINDOW", "0.25"))
+REACTION_RATE = float(os.getenv("REACTION_RATE", "5"))
+REACTION_BURST = int(os.getenv("REACTION_BURST", "10"))
+CHAT_RATE = float(os.getenv("CHAT_RATE", "1"))
+CHAT_BURST = int(os.getenv("CHAT_BURST", "5"))
+
+# --- Bot -> API server calls ---
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "5"))
+API_RETRIES = int(os.getenv("API_RETRIES", "2"))
+
+# --- Bot yt-dlp work ---
+# Searches/downloads the bot runs at once (others wait), and how long each may take before the
+# user gets a timeout; progress messages are edited at most every BOT_PROGRESS_INTERVAL seconds
+BOT_YTDLP_WORKERS = int(os.getenv("BOT_YTDLP_WORKERS", "2"))
+BOT_SEARCH_TIMEOUT = int(os.getenv("BOT_SEARCH_TIMEOUT", "30"))
+BOT_DOWNLOAD_TIMEOUT = int(os.getenv("BOT_DOWNLOAD_TIMEOUT", "300"))
+BOT_PROGRESS_INTERVAL = float(os.getenv("BOT_PROGRESS_INTERVAL", "2"))
+
+# --- Bot user/group tracking ---
+# User and group updates are written to botdata.sqlite3 in one batch this often (seconds)
+USER_STORE_FLUSH_INTERVAL = float(os.getenv("USER_STORE_FLUSH_INTERVAL", "0.5"))
+
+# --- Metrics ---
+# api_server.py and ai-service serve GET /metrics on their own port; the bot has no web server,
+# so it serves it on BOT_METRICS_PORT (0 turns the listener off)
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9101"))
+
+# --- Admin reports ---
+# Activity is collected for this many seconds and sent to ADMIN_GROUP_ID as one report;
+# /report and /users pages list this many rows
+ADMIN_REPORT_WINDOW = int(os.getenv("ADMIN_REPORT_WINDOW", "300"))
+ADMIN_REPORT_PAGE_SIZE = int(os.getenv("ADMIN_REPORT_PAGE_SIZE", "30"))
@@ -0,0 +1,133 @@
+import itertools
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states, in the order a job normally moves through them
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+FINISHED_STATES = (DONE, FAILED)
+
+
+class DownloadJob:
+    def __init__(self, video_id, payload, key=None):
+        self.id = uuid.uuid4().hex
+        self.video_id = video_id
+        self.key = key if key is not None else video_id
+        self.payload = payload  # whatever the caller needs back once the file is ready
+        self.state = QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'video_id': self.video_id,
+            'state': self.state,
+            'progress': round(self.progress, 1),
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+
+class DownloadJobManager:
+    """Runs downloads on a bounded thread pool and reports back on the caller's thread.
+
+    Workers never touch shared app state. Every state change is put on an event
+    queue as a snapshot, and `drain_events()` hands them to `on_update` from
+    whichever thread calls it (the Socket.IO background task in api_server.py).
+    That keeps queue mutations and emits on the server's own green thread.
+    """
+
+    def __init__(self, download_fn, on_update, max_workers=2, keep_finished=200):
+        self._download_fn = download_fn  # download_fn(video_id, progress_cb) -> result
+        self._on_update = on_update
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download')
+        self._events = queue.Queue()
+        self._jobs = {}
+        self._active = {}  # key -> job, so the same request isn't queued twice
+        self._lock = threading.Lock()
+        self._keep_finished = keep_finished
+        self._order = itertools.count()
+        self._finished = []
+
+    def submit(self, video_id, payload=None, key=None):
+        # `key` defaults to the video_id; callers that deliver the same track to
+        # several places (e.g. rooms) include the destination in it. The download
+        # itself is still shared through music_manager's single-flight.
+        job = DownloadJob(video_id, payload or {}, key)
+        with self._lock:
+            active = self._active.get(job.key)
+            if active is not None:
+                return active, False
+            self._jobs[job.id] = job
+            self._active[job.key] = job
+        self._events.put((job, job.to_dict()))
+        self._pool.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self):
+        """Jobs queued or running."""
+        with self._lock:
+            return len(self._active)
+
+    def _update(self, job, **changes):
+        with self._lock:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            job.updated_at = time.time()
+            if job.state in FINISHED_STATES:
+                self._active.pop(job.key, None)
+                self._finished.append(job.id)
+                while len(self._finished) > self._keep_finished:
+                    self._jobs.pop(self._finished.pop(0), None)
+            snapshot = job.to_dict()
+        self._events.put((job, snapshot))
+
+    def _run(self, job):
+        self._update(job, state=DOWNLOADING)
+
+        def progress(state, percent=None):
+            if percent is not None:
+                self._update(job, state=state, progress=percent)
+            else:
+                self._update(job, state=state)
+
+        try:
+            result = self._download_fn(job.video_id, progress)
+        except Exception as e:
+            self._update(job, state=FAILED, error=str(e))
+            return
+        self._update(job, state=DONE, progress=100.0, result=result)
+
+    def drain_events(self, limit=100):
+        # Only the latest state of each job matters, so collapse repeated progress ticks.
+        # A finished state is always the last event for its job, so it is delivered exactly once.
+        pending = {}
+        for _ in range(limit):
+            try:
+                job, snapshot = self._events.get_nowait()
+            except queue.Empty:
+                break
+            pending[job.id] = (next(self._order), job, snapshot)
+        for _, job, snapshot in sorted(pending.values(), key=lambda item: item[0]):
+            self._on_update(job, snapshot)
+        return len(pending)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
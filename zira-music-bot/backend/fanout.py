@@ -0,0 +1,96 @@
+"""Rate limits and reaction aggregation for the chat/reaction Socket.IO events.
+
+Re-emitting every reaction to every socket in the room makes a busy room
+cost users x reactions messages: a few hundred listeners mashing emoji
+during a drop is a message storm. Instead reactions are counted per room and
+song, and each room gets one `reaction_summary` per window. Every sender is
+also held to a token bucket, for reactions and chat separately.
+"""
+import time
+from collections import Counter
+
+# Longest reaction string that's counted (an emoji sequence, not a message)
+MAX_REACTION_LENGTH = 32
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved up."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """One TokenBucket per key (a Socket.IO sid). rate=0 turns limiting off."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets = {}
+        self.dropped = 0
+
+    def allow(self, key, now=None):
+        if not self.rate:
+            return True
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        if bucket.take(now):
+            return True
+        self.dropped += 1
+        return False
+
+    def forget(self, key):
+        self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ReactionAggregator:
+    """Per-room, per-song reaction counts for the current window."""
+
+    def __init__(self, window=0.25):
+        self.window = window
+        self._pending = {}  # room id -> {song_id: Counter(reaction -> count)}
+        self.received = 0
+        self.summaries = 0
+
+    def add(self, room_id, song_id, reaction):
+        """Count one reaction; False if it isn't one (wrong type or too long)."""
+        if not isinstance(reaction, str) or not reaction or len(reaction) > MAX_REACTION_LENGTH:
+            return False
+        song_id = str(song_id or '')[:64]
+        self._pending.setdefault(room_id, {}).setdefault(song_id, Counter())[reaction] += 1
+        self.received += 1
+        return True
+
+    def drain(self):
+        """(room_id, summary) for every room that got reactions since the last drain."""
+        pending, self._pending = self._pending, {}
+        summaries = []
+        for room_id, songs in pending.items():
+            summaries.append((room_id, {
+                'window_ms': int(self.window * 1000),
+                'songs': {song_id: dict(counts) for song_id, counts in songs.items()},
+                'total': sum(sum(counts.values()) for counts in songs.values()),
+            }))
+        self.summaries += len(summaries)
+        return summaries
+
+    def stats(self):
+        return {'received': self.received, 'summaries': self.summaries, 'window_ms': int(self.window * 1000)}
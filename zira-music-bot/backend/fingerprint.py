@@ -0,0 +1,227 @@
+"""Spectral-peak audio fingerprints, to spot re-uploads of a track we already have.
+
+A fingerprint is a set of landmark hashes: pairs of nearby spectrogram peaks
+packed as (freq1, freq2, time delta), each stored with the anchor's time.
+Two recordings of the same audio share many hashes at one consistent time
+offset, whatever the upload's bitrate, loudness or lead-in; unrelated audio
+doesn't. The index lives in a SQLite file inside the MP3 folder, next to
+Mp3Cache's, so bot.py and api_server.py share it.
+
+NumPy is optional: without it fingerprints are never computed and downloads
+behave exactly as before.
+"""
+import logging
+import os
+import sqlite3
+import subprocess
+import time
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = '.fingerprints.sqlite3'
+SAMPLE_RATE = 8000
+FFT_SIZE = 512
+HOP = 256  # 32 ms per frame
+PEAK_TIME = 10  # frames either side a peak must dominate
+PEAK_FREQ = 10  # bins either side a peak must dominate
+PEAKS_PER_SECOND = 30
+FAN_OUT = 5  # pairs per anchor peak
+MAX_DT = 63  # frames (6 bits)
+# A match needs this many hashes at one offset, and this share of the query's hashes
+MIN_MATCHES = 20
+MIN_MATCH_RATIO = 0.05
+
+
+def available():
+    return np is not None
+
+
+# --- Fingerprints ---
+
+def decode(source, seconds, ffmpeg='ffmpeg', headers=None):
+    """The first `seconds` of `source` (file or URL) as mono float32 PCM at SAMPLE_RATE."""
+    cmd = [ffmpeg, '-v', 'error', '-nostdin']
+    if headers:
+        cmd += ['-headers', ''.join(f'{k}: {v}\r\n' for k, v in headers.items())]
+    cmd += ['-t', str(seconds), '-i', source, '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-']
+    result = subprocess.run(cmd, capture_output=True, timeout=max(30, seconds * 2))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors='replace').strip() or f'ffmpeg exited with {result.returncode}')
+    data = result.stdout[:len(result.stdout) // 2 * 2]
+    return np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def _max_filter(values, size, axis):
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (size, size)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * size + 1, axis=axis).max(axis=-1)
+
+
+def fingerprint(samples):
+    """(hashes, times) for mono PCM at SAMPLE_RATE, as int64 arrays."""
+    empty = np.zeros(0, dtype=np.int64)
+    if len(samples) < FFT_SIZE * 4:
+        return empty, empty
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::HOP]
+    spec = np.log(np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE), axis=1)) + 1e-6)[:, 1:FFT_SIZE // 2 + 1]
+    local_max = _max_filter(_max_filter(spec, PEAK_TIME, 0), PEAK_FREQ, 1)
+    t, f = np.nonzero((spec == local_max) & (spec > spec.mean()))
+    # Keep the strongest peaks, at a fixed density, so quiet passages and re-encodes yield similar sets
+    keep = min(len(t), int(len(spec) * HOP / SAMPLE_RATE * PEAKS_PER_SECOND))
+    strongest = np.argsort(spec[t, f])[::-1][:keep]
+    order = np.lexsort((f[strongest], t[strongest]))
+    t, f = t[strongest][order], f[strongest][order]
+    hashes, times = [], []
+    for k in range(1, FAN_OUT + 1):
+        dt = t[k:] - t[:-k]
+        ok = (dt > 0) & (dt <= MAX_DT)
+        f1 = np.minimum(f[:-k][ok], 255)
+        f2 = np.minimum(f[k:][ok], 255)
+        hashes.append((f1 << 14) | (f2 << 6) | dt[ok])
+        times.append(t[:-k][ok])
+    return np.concatenate(hashes).astype(np.int64), np.concatenate(times).astype(np.int64)
+
+
+# --- Index ---
+
+class FingerprintIndex:
+    """Landmark hashes of every downloaded track, plus video_id aliases for re-uploads.
+
+    Like Mp3Cache, every call opens a short-lived connection, so separate
+    processes can share the file.
+    """
+
+    def __init__(self, folder, seconds=120, probe_seconds=20, ffmpeg='ffmpeg'):
+        self.folder = folder
+        self.seconds = seconds
+        self.probe_seconds = probe_seconds
+        self.ffmpeg = ffmpeg
+        self.index_path = os.path.join(folder, INDEX_NAME)
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS tracks (
+                track_id INTEGER PRIMARY KEY,
+                video_id TEXT UNIQUE NOT NULL,
+                hashes INTEGER NOT NULL,
+                added_at REAL NOT NULL
+            )''')
+            db.execute('''CREATE TABLE IF NOT EXISTS hashes (
+                hash INTEGER NOT NULL,
+                track_id INTEGER NOT NULL,
+                t INTEGER NOT NULL
+            )''')
+            db.execute('CREATE INDEX IF NOT EXISTS hashes_by_hash ON hashes (hash)')
+            # video_id of a re-upload -> video_id whose file it shares
+            db.execute('''CREATE TABLE IF NOT EXISTS aliases (
+                video_id TEXT PRIMARY KEY,
+                canonical TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                added_at REAL NOT NULL
+            )''')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.index_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _exists(self, video_id):
+        return os.path.exists(os.path.join(self.folder, f'{video_id}.mp3'))
+
+    def fingerprint_file(self, path):
+        return fingerprint(decode(path, self.seconds, self.ffmpeg))
+
+    def fingerprint_stream(self, url, headers=None):
+        """Fingerprint of the first probe_seconds of a remote stream; ffmpeg only fetches that much."""
+        return fingerprint(decode(url, self.probe_seconds, self.ffmpeg, headers))
+
+    # --- Lookups ---
+    def alias(self, video_id):
+        """The video_id whose file `video_id` is a re-upload of, if that file is still on disk."""
+        with self._connect() as db:
+            row = db.execute('SELECT canonical FROM aliases WHERE video_id=?', (video_id,)).fetchone()
+        return row[0] if row and self._exists(row[0]) else None
+
+    def match(self, hashes, times, exclude=None):
+        """(video_id, score) of the indexed track sharing the most hashes at one offset, or None."""
+        if not len(hashes):
+            return None
+        unique = np.unique(hashes).tolist()
+        rows = []
+        with self._connect() as db:
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                rows += db.execute(f"SELECT hash, track_id, t FROM hashes WHERE hash IN ({','.join('?' * len(chunk))})",
+                                   chunk).fetchall()
+        if not rows:
+            return None
+        found = np.array(rows, dtype=np.int64)
+        # Pair every query occurrence of a hash with every stored occurrence
+        order = np.argsort(hashes, kind='stable')
+        q_hash, q_time = hashes[order], times[order]
+        lo = np.searchsorted(q_hash, found[:, 0], 'left')
+        hi = np.searchsorted(q_hash, found[:, 0], 'right')
+        counts = hi - lo
+        rep = np.repeat(np.arange(len(found)), counts)
+        q_idx = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)]) if len(rep) else np.zeros(0, np.int64)
+        track = found[rep, 1]
+        # Offsets are bucketed in pairs of frames: re-encodes don't land on the same frame grid
+        offset = (found[rep, 2] - q_time[q_idx]) // 2
+        keys, votes = np.unique(track * (1 << 32) + (offset + (1 << 31)), return_counts=True)
+        best = np.argsort(votes)[::-1]
+        with self._connect() as db:
+            for i in best[:5]:
+                score = int(votes[i])
+                if score < MIN_MATCHES or score < MIN_MATCH_RATIO * len(hashes):
+                    return None
+                row = db.execute('SELECT video_id FROM tracks WHERE track_id=?', (int(keys[i] >> 32),)).fetchone()
+                if row is None or row[0] == exclude:
+                    continue
+                if not self._exists(row[0]):
+                    # Evicted; its hashes can't be reused
+                    self.remove(row[0])
+                    continue
+                return row[0], score
+        return None
+
+    # --- Updates ---
+    def add(self, video_id, hashes, times):
+        with metrics.sqlite_write('fingerprint'), self._connect() as db:
+            db.execute('DELETE FROM hashes WHERE track_id IN (SELECT track_id FROM tracks WHERE video_id=?)', (video_id,))
+            cur = db.execute('''INSERT INTO tracks (video_id, hashes, added_at) VALUES (?, ?, ?)
+                                ON CONFLICT(video_id) DO UPDATE SET hashes=excluded.hashes, added_at=excluded.added_at
+                                RETURNING track_id''', (video_id, len(hashes), time.time()))
+            track_id = cur.fetchone()[0]
+            db.executemany('INSERT INTO hashes (hash, track_id, t) VALUES (?, ?, ?)',
+                           zip(hashes.tolist(), [track_id] * len(hashes), times.tolist()))
+
+    def add_alias(self, video_id, canonical, score):
+        with metrics.sqlite_write('fingerprint'), self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO aliases (video_id, canonical, score, added_at) VALUES (?, ?, ?, ?)',
+                       (video_id, canonical, score, time.time()))
+        logger.info(f"{video_id} is a re-upload of {canonical} ({score} matching hashes); reusing its file")
+
+    def remove(self, video_id):
+        with metrics.sqlite_write('fingerprint'), self._connect() as db:
+            db.execute('DELETE FROM hashes WHERE track_id IN (SELECT track_id FROM tracks WHERE video_id=?)', (video_id,))
+            db.execute('DELETE FROM tracks WHERE video_id=?', (video_id,))
+            db.execute('DELETE FROM aliases WHERE canonical=?', (video_id,))
+
+    def stats(self):
+        with self._connect() as db:
+            tracks, hashes = db.execute('SELECT COUNT(*), COALESCE(SUM(hashes), 0) FROM tracks').fetchone()
+            aliases = db.execute('SELECT COUNT(*) FROM aliases').fetchone()[0]
+        return {'tracks': tracks, 'hashes': hashes, 'aliases': aliases}
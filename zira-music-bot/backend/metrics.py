@@ -0,0 +1,398 @@
+"""Counters, gauges and latency histograms, rendered in the Prometheus text format.
+
+Metrics are created once at import time and live in one registry per process:
+
+    SEARCHES = metrics.histogram('ytdlp_phase_duration_seconds', 'yt-dlp work', ['phase'])
+
+    with SEARCHES.time('search'):
+        ...
+    SEARCHES.labels('search').observe(seconds)
+
+labels() returns the child for those label values (created on first use and
+then cached, so hot paths can keep it). Counters and histograms keep one
+set of numbers per thread, so recording takes no lock: an observation is a
+per-thread lookup, a bisect and two list updates, about a microsecond
+(benchmarks/bench_metrics.py); a scrape adds the threads' numbers up.
+Counters and gauges can also be computed at scrape time by a `collect`
+callable, for numbers another object already keeps.
+
+render() is the body of a /metrics response; serve() runs it on its own
+port for processes without a web server (the bot). Only the standard
+library is used. ai-service imports this same file: its launchers put this
+directory on PYTHONPATH, and its image copies the file in at build time.
+"""
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds: from a SQLite write (milliseconds) to a yt-dlp download (minutes)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = {}  # name -> metric, in creation order
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if type(value) is int:
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _label_text(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# --- Children: one set of label values ---
+
+class _Timer:
+    """Observes the seconds spent in a `with` block; also counts it in `errors` if the block raised."""
+
+    __slots__ = ('child', 'errors', 'start')
+
+    def __init__(self, child, errors=None):
+        self.child = child
+        self.errors = errors
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.child.observe(time.perf_counter() - self.start)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc()
+        return False
+
+
+class _Sharded:
+    """Numbers kept per OS thread: each thread only ever writes its own list, so no lock is needed.
+
+    Readers add the lists up; they may see one thread's update half done (a
+    count without its sum), never lose one. Shards are keyed by the native
+    thread id, which eventlet's monkey patching leaves alone: greenlets of
+    one thread share a shard, and can't switch in the middle of an update.
+    """
+
+    __slots__ = ('_shards', '_lock', '_size')
+
+    def __init__(self, size):
+        self._shards = {}  # native thread id -> list
+        self._lock = threading.Lock()
+        self._size = size
+
+    def _shard(self):
+        shard = self._shards.get(threading.get_native_id())
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(threading.get_native_id(), [0] * self._size)
+        return shard
+
+    def _totals(self):
+        with self._lock:
+            shards = list(self._shards.values())
+        return [sum(column) for column in zip(*shards)] if shards else [0] * self._size
+
+
+class _CounterValue(_Sharded):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    @property
+    def value(self):
+        return self._totals()[0]
+
+
+class _GaugeValue:
+    # set() has to be seen by every thread, so gauges are one locked number
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue(_Sharded):
+    __slots__ = ('bounds',)
+
+    def __init__(self, bounds):
+        # Per thread: a count per bucket, +Inf last, then the sum
+        super().__init__(len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value):
+        shard = self._shard()
+        # Buckets are "less than or equal": bisect_left finds the first bound >= value
+        shard[bisect.bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+    def time(self, errors=None):
+        return _Timer(self, errors)
+
+    def snapshot(self):
+        """(count per bucket, +Inf last; sum)"""
+        totals = self._totals()
+        return totals[:-1], totals[-1]
+
+
+# --- Metrics ---
+
+class _Metric:
+    """A metric and its children; with `collect` (counters and gauges), the value is computed when scraped.
+
+    collect() returns the value, or for a metric with labels an iterable of
+    (label values tuple, value) pairs. Use it for numbers something else
+    already keeps (a queue's length, a limiter's drop count).
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for these label values (in labelnames order)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {values}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        """(suffix, label text, value) for every child."""
+        if self.collect is not None:
+            try:
+                collected = self.collect()
+            except Exception:
+                logger.exception(f'Could not collect {self.name}')
+                return
+            if not self.labelnames:
+                collected = [((), collected)]
+            for values, value in collected:
+                yield '', _label_text(self.labelnames, values), value
+            return
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            yield '', _label_text(self.labelnames, values), child.value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{labels} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._le = [f'le="{_number(float(bound))}"' for bound in self.bounds + (float('inf'),)]
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self, *values, errors=None):
+        """Context manager timing its block into the child for `values`.
+
+        errors: a Counter with the same labels, incremented when the block raises.
+        """
+        return _Timer(self.labels(*values), errors.labels(*values) if errors is not None else None)
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            counts, total = child.snapshot()
+            labels = _label_text(self.labelnames, values)
+            # The bucket lines' labels are these plus le="..."
+            prefix = labels[:-1] + ',' if labels else '{'
+            cumulative = 0
+            for le, count in zip(self._le, counts):
+                cumulative += count
+                yield '_bucket', prefix + le + '}', cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+# --- Registry ---
+
+def _register(cls, name, documentation, labelnames, **options):
+    """The metric called `name`, created on first use, so modules can share one."""
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labelnames, **options)
+        elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+            raise ValueError(f'{name} is already registered as a {metric.type} with labels {metric.labelnames}')
+    return metric
+
+
+def counter(name, documentation, labelnames=(), collect=None):
+    return _register(Counter, name, documentation, labelnames, collect=collect)
+
+
+def gauge(name, documentation, labelnames=(), collect=None):
+    return _register(Gauge, name, documentation, labelnames, collect=collect)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def timed(metric, *values, errors=None):
+    """Decorator timing every call of a function (or coroutine function) into metric.labels(*values)."""
+    def decorator(fn):
+        child = metric.labels(*values)
+        error_child = errors.labels(*values) if errors is not None else None
+        # Inlined rather than `with _Timer(...)`: this wraps every Socket.IO and bot handler
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException:
+                    if error_child is not None:
+                        error_child.inc()
+                    raise
+                finally:
+                    child.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                if error_child is not None:
+                    error_child.inc()
+                raise
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def render():
+    """Every registered metric, in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# --- Metrics shared by several modules ---
+# Every SQLite write transaction (wrap the connection: the commit is part of it) and
+# every HTTP call to another service
+SQLITE_WRITE_SECONDS = histogram('sqlite_write_duration_seconds', 'SQLite write transactions, by database', ['db'])
+SQLITE_WRITE_ERRORS = counter('sqlite_write_errors_total', 'SQLite write transactions that failed, by database', ['db'])
+HTTP_CLIENT_SECONDS = histogram('http_client_request_duration_seconds', 'Outbound HTTP requests, by target service',
+                                ['target', 'method'])
+HTTP_CLIENT_RESPONSES = counter('http_client_responses_total',
+                                'Outbound HTTP requests by target and status ("error": no response)',
+                                ['target', 'method', 'status'])
+
+
+def sqlite_write(db):
+    """with metrics.sqlite_write('mp3_cache'), self._connect() as db: ..."""
+    return SQLITE_WRITE_SECONDS.time(db, errors=SQLITE_WRITE_ERRORS)
+
+
+# --- Sidecar listener ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes come every few seconds; don't fill the log with them
+        pass
+
+
+def serve(port, host='0.0.0.0'):
+    """Serve GET /metrics on a daemon thread; returns the server (call shutdown() to stop it)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,213 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOKUPS = metrics.counter('mp3_cache_lookups_total', 'MP3 cache lookups by result (hit, miss), this process only',
+                          ['result'])
+
+INDEX_NAME = '.cache_index.sqlite3'
+POLICIES = ('lru', 'lfu')
+# serve_mp3 touches a file on every request; don't write last_access more often than this
+TOUCH_INTERVAL = 60
+
+
+class Mp3Cache:
+    """Disk-budgeted cache index over the shared MP3 folder.
+
+    bot.py and api_server.py run as separate processes, so the index lives in a
+    SQLite file inside the folder itself and every call opens a short-lived
+    connection. Tracks in the API server's queue are pinned and never evicted.
+    Files made from a track (its renditions) count against the same budget:
+    their bytes are charged to the track (add_derived) and freed with it.
+    """
+
+    def __init__(self, folder, max_bytes, policy='lru', on_evict=None, derived_sizes=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy {policy!r}, expected one of {POLICIES}")
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_evict = on_evict  # on_evict(video_id), e.g. to drop files derived from it
+        self.derived_sizes = derived_sizes  # derived_sizes() -> {video_id: bytes of those files}, for scan()
+        self.index_path = os.path.join(folder, INDEX_NAME)
+        self._last_touch = {}
+        self._touch_lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS tracks (
+                video_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                pinned INTEGER NOT NULL DEFAULT 0,
+                derived_size INTEGER NOT NULL DEFAULT 0
+            )''')
+            if 'derived_size' not in {row[1] for row in db.execute('PRAGMA table_info(tracks)')}:
+                # Index created before renditions were counted
+                db.execute('ALTER TABLE tracks ADD COLUMN derived_size INTEGER NOT NULL DEFAULT 0')
+            db.execute('''CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )''')
+            db.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.index_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    # --- Lookups ---
+    def lookup(self, video_id):
+        """Return the cached filename for `video_id` (counting a hit), or None (counting a miss)."""
+        filename = f"{video_id}.mp3"
+        now = time.time()
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            row = db.execute('SELECT filename FROM tracks WHERE video_id=?', (video_id,)).fetchone()
+            if row and not os.path.exists(self._path(row[0])):
+                # Deleted behind our back
+                db.execute('DELETE FROM tracks WHERE video_id=?', (video_id,))
+                row = None
+            if row is None and os.path.exists(self._path(filename)):
+                # File predates the index (or came from another tool), adopt it
+                self._upsert(db, video_id, filename, now)
+                row = (filename,)
+            if row is None:
+                db.execute("UPDATE counters SET value = value + 1 WHERE name='misses'")
+                LOOKUPS.labels('miss').inc()
+                return None
+            db.execute('UPDATE tracks SET last_access=?, hits = hits + 1 WHERE video_id=?', (now, video_id))
+            db.execute("UPDATE counters SET value = value + 1 WHERE name='hits'")
+            LOOKUPS.labels('hit').inc()
+            return row[0]
+
+    def touch(self, video_id):
+        # Record a read (e.g. a stream) without counting it as a hit or miss
+        now = time.time()
+        with self._touch_lock:
+            if now - self._last_touch.get(video_id, 0) < TOUCH_INTERVAL:
+                return
+            self._last_touch[video_id] = now
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            db.execute('UPDATE tracks SET last_access=? WHERE video_id=?', (now, video_id))
+
+    # --- Updates ---
+    def _upsert(self, db, video_id, filename, now):
+        size = os.path.getsize(self._path(filename))
+        db.execute('''INSERT INTO tracks (video_id, filename, size, last_access) VALUES (?, ?, ?, ?)
+                      ON CONFLICT(video_id) DO UPDATE SET filename=excluded.filename, size=excluded.size,
+                      last_access=excluded.last_access''', (video_id, filename, size, now))
+
+    def add(self, video_id, filename=None):
+        """Register a freshly downloaded file and evict down to the budget."""
+        filename = filename or f"{video_id}.mp3"
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            self._upsert(db, video_id, filename, time.time())
+        # The new file has no hits yet, so LFU would pick it first; it isn't queued yet either
+        self.evict(keep=video_id)
+
+    def add_derived(self, video_id, size):
+        """Charge `size` bytes of a file made from `video_id` to it, and evict down to the budget."""
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            db.execute('UPDATE tracks SET derived_size = derived_size + ? WHERE video_id=?', (size, video_id))
+        self.evict(keep=video_id)
+
+    def pin(self, video_ids, replace=True):
+        """Pin `video_ids` (the current queue). With replace=False, add to the pinned set."""
+        video_ids = list({v for v in video_ids if v})
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            if replace:
+                db.execute('UPDATE tracks SET pinned=0 WHERE pinned=1')
+            db.executemany('UPDATE tracks SET pinned=1 WHERE video_id=?', [(v,) for v in video_ids])
+
+    def scan(self):
+        """Reconcile the index with what is actually on disk. Call evict() afterwards."""
+        now = time.time()
+        on_disk = {}
+        for name in os.listdir(self.folder):
+            # Skip in-progress downloads (dot-prefixed) and the index itself
+            if name.endswith('.mp3') and not name.startswith('.'):
+                on_disk[name[:-4]] = name
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            indexed = {row[0] for row in db.execute('SELECT video_id FROM tracks')}
+            for video_id in indexed - on_disk.keys():
+                db.execute('DELETE FROM tracks WHERE video_id=?', (video_id,))
+            for video_id in on_disk.keys() - indexed:
+                self._upsert(db, video_id, on_disk[video_id], now)
+            if self.derived_sizes is not None:
+                derived = self.derived_sizes()
+                db.execute('UPDATE tracks SET derived_size=0')
+                db.executemany('UPDATE tracks SET derived_size=? WHERE video_id=?',
+                               [(size, video_id) for video_id, size in derived.items()])
+
+    def evict(self, keep=None):
+        """Delete unpinned files, least valuable first, until the folder fits the budget."""
+        if self.policy == 'lfu':
+            order = 'hits ASC, last_access ASC'
+        else:
+            order = 'last_access ASC'
+        evicted = []
+        with metrics.sqlite_write('mp3_cache'), self._connect() as db:
+            total = db.execute('SELECT COALESCE(SUM(size + derived_size), 0) FROM tracks').fetchone()[0]
+            if total <= self.max_bytes:
+                return evicted
+            candidates = db.execute(f'SELECT video_id, filename, size + derived_size FROM tracks WHERE pinned=0 '
+                                    f'ORDER BY {order}').fetchall()
+            for video_id, filename, size in candidates:
+                if total <= self.max_bytes:
+                    break
+                if video_id == keep:
+                    continue
+                try:
+                    os.remove(self._path(filename))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not evict {filename}: {e}")
+                    continue
+                db.execute('DELETE FROM tracks WHERE video_id=?', (video_id,))
+                total -= size
+                evicted.append(video_id)
+                if self.on_evict is not None:
+                    self.on_evict(video_id)
+            if evicted:
+                db.execute("UPDATE counters SET value = value + ? WHERE name='evictions'", (len(evicted),))
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} tracks from {self.folder}")
+        return evicted
+
+    # --- Reporting ---
+    def stats(self):
+        with self._connect() as db:
+            counters = dict(db.execute('SELECT name, value FROM counters'))
+            files, total, derived, pinned = db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size + derived_size), 0), COALESCE(SUM(derived_size), 0), '
+                'COALESCE(SUM(pinned), 0) FROM tracks').fetchone()
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'evictions': counters['evictions'],
+            'hit_ratio': counters['hits'] / lookups if lookups else 0.0,
+            'files': files,
+            'pinned': pinned,
+            'bytes': total,
+            'derived_bytes': derived,
+            'max_bytes': self.max_bytes,
+            'policy': self.policy,
+        }
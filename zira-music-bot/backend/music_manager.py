@@ -1 +1,326 @@
- 
\ No newline at end of file
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+
+import yt_dlp
+from yt_dlp.utils import DownloadCancelled as _YtdlpCancelled
+
+import fingerprint
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A lock file that hasn't been touched for this long belongs to a crashed process
+LOCK_STALE_SECONDS = 120
+LOCK_POLL_SECONDS = 0.5
+# Every download is transcoded to this; lighter renditions are made on demand (renditions.py)
+MP3_BITRATE = 192
+
+# search: one ytsearch; extract: resolving a video's formats; probe/fingerprint: re-upload
+# checks; download: fetching the audio (and transcoding it); transcode: the mp3 conversion alone
+YTDLP_SECONDS = metrics.histogram('ytdlp_phase_duration_seconds', 'yt-dlp work, by phase', ['phase'])
+YTDLP_ERRORS = metrics.counter('ytdlp_phase_errors_total', 'yt-dlp phases that raised (cancellations included)',
+                               ['phase'])
+
+
+class DownloadCancelled(_YtdlpCancelled):
+    """Raised when a caller's should_cancel() turns true mid-download."""
+    msg = 'The download was cancelled'
+
+
+def mp3_filename(video_id):
+    return f"{video_id}.mp3"
+
+
+def youtube_url(video_id):
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+# --- Search ---
+
+def search_youtube(query, limit=5):
+    """Flat YouTube search; returns the result shape shared by bot.py and api_server.py."""
+    ydl_opts = {
+        'quiet': True,
+        'skip_download': True,
+        'extract_flat': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, YTDLP_SECONDS.time('search', errors=YTDLP_ERRORS):
+        info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False) or {}
+    entries = info.get('entries', []) if isinstance(info, dict) else []
+    results = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('id'):
+            continue
+        thumbnails = entry.get('thumbnails') or []
+        results.append({
+            'title': entry.get('title', ''),
+            'artist': entry.get('uploader') or entry.get('channel') or '',
+            'video_id': entry['id'],
+            'thumbnail': entry.get('thumbnail') or (thumbnails[-1].get('url', '') if thumbnails else ''),
+            'duration': entry.get('duration') or 0,
+            'webpage_url': youtube_url(entry['id']),
+        })
+    return results
+
+
+# --- Single-flight downloads ---
+# Both bot.py and api_server.py download into the same <video_id>.mp3 names.
+# Within a process, concurrent callers for one video_id share a single _Flight.
+# Across processes, a <video_id>.lock file next to the mp3 elects one downloader
+# and everyone else waits for the final file to appear (or for an alias to an
+# existing file, when fingerprinting finds the track is a re-upload).
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0  # callers sharing this download besides the leader
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def download_mp3(video_id, mp3_folder, url=None, progress=None, timeout=900, cache=None, lookup=True,
+                 should_cancel=None, fingerprints=None):
+    """Download `video_id` as <mp3_folder>/<video_id>.mp3 and return the filename.
+
+    Only the first caller for a given video_id actually runs yt-dlp; later callers
+    block until that download finishes and get the same result (or exception).
+    `progress(state, percent=None)` is only called for the caller that downloads.
+    If an Mp3Cache is given, lookups count as hits/misses and new files are
+    registered with it (which may evict older ones). Pass lookup=False when the
+    caller has already checked the cache, so the miss isn't counted twice.
+    `should_cancel()` is polled while downloading or waiting; once it returns
+    true the call raises DownloadCancelled. A leader only abandons a download
+    nobody else is waiting for.
+    With a FingerprintIndex, a track whose audio matches one already on disk
+    (a re-upload) isn't kept twice: the other track's filename is returned
+    instead, so callers should take the video_id from the returned filename.
+    """
+    if cache is not None and lookup:
+        cached = cache.lookup(video_id)
+        if cached:
+            return cached
+    elif os.path.exists(os.path.join(mp3_folder, mp3_filename(video_id))):
+        return mp3_filename(video_id)
+    reused = _reuse(video_id, fingerprints, cache)
+    if reused:
+        return reused
+
+    with _flights_lock:
+        flight = _flights.get(video_id)
+        leader = flight is None
+        if leader:
+            flight = _flights[video_id] = _Flight()
+        else:
+            flight.waiters += 1
+
+    if not leader:
+        try:
+            deadline = time.time() + timeout
+            while not flight.done.wait(LOCK_POLL_SECONDS):
+                if should_cancel is not None and should_cancel():
+                    raise DownloadCancelled()
+                if time.time() > deadline:
+                    raise TimeoutError(f'Timed out waiting for download of {video_id}')
+        finally:
+            with _flights_lock:
+                flight.waiters -= 1
+        if isinstance(flight.error, DownloadCancelled):
+            # The leader gave up before it saw us waiting; download it ourselves
+            return download_mp3(video_id, mp3_folder, url, progress, timeout, cache, False, should_cancel,
+                                fingerprints)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def cancelled():
+        return should_cancel is not None and not flight.waiters and should_cancel()
+
+    try:
+        flight.result = _download_locked(video_id, mp3_folder, url or youtube_url(video_id), progress, timeout,
+                                         cancelled, fingerprints)
+        if cache is not None:
+            if flight.result == mp3_filename(video_id):
+                cache.add(video_id, flight.result)
+            else:
+                cache.touch(flight.result[:-4])
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(video_id, None)
+        flight.done.set()
+
+
+def _reuse(video_id, fingerprints, cache=None):
+    """Filename of the track `video_id` is a known re-upload of, if it's still on disk."""
+    if fingerprints is None:
+        return None
+    canonical = fingerprints.alias(video_id)
+    if canonical is None:
+        return None
+    if cache is not None:
+        cache.touch(canonical)
+    return mp3_filename(canonical)
+
+
+def _download_locked(video_id, mp3_folder, url, progress, timeout, cancelled, fingerprints=None):
+    os.makedirs(mp3_folder, exist_ok=True)
+    filename = mp3_filename(video_id)
+    final_path = os.path.join(mp3_folder, filename)
+    lock_path = os.path.join(mp3_folder, f"{video_id}.lock")
+    deadline = time.time() + timeout
+    while True:
+        if os.path.exists(final_path):
+            return filename
+        # The previous lock holder may have found it was a re-upload
+        reused = _reuse(video_id, fingerprints)
+        if reused:
+            return reused
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Another process is downloading this track
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                    logger.warning(f"Removing stale download lock {lock_path}")
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if cancelled():
+                raise DownloadCancelled()
+            if time.time() > deadline:
+                raise TimeoutError(f'Timed out waiting for download of {video_id}')
+            time.sleep(LOCK_POLL_SECONDS)
+            continue
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        try:
+            # Re-check: the previous owner may have finished between our exists() and open()
+            if os.path.exists(final_path):
+                return filename
+            return _run_ytdlp(video_id, mp3_folder, url, progress, lock_path, final_path, cancelled, fingerprints)
+        finally:
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+
+
+def _find_duplicate(video_id, fingerprints, compute):
+    """(video_id, score) of an indexed track matching `compute()`'s fingerprint, and the fingerprint.
+
+    Fingerprinting is best effort: any failure just means no match.
+    """
+    try:
+        hashes, times = compute()
+        return fingerprints.match(hashes, times, exclude=video_id), (hashes, times)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint {video_id}: {e}")
+        return None, None
+
+
+def _probe(video_id, info, fingerprints):
+    # Decode just the first seconds of the chosen audio stream, straight from its URL
+    stream_url = info.get('url')
+    if not stream_url or not fingerprints.probe_seconds:
+        return None
+    with YTDLP_SECONDS.time('probe'):
+        match, _ = _find_duplicate(video_id, fingerprints,
+                                   lambda: fingerprints.fingerprint_stream(stream_url, info.get('http_headers')))
+    return match
+
+
+def _run_ytdlp(video_id, mp3_folder, url, progress, lock_path, final_path, cancelled, fingerprints=None):
+    # Download under a private dot-prefixed name; the final name only ever appears via rename
+    tmp_stem = f".{video_id}.{uuid.uuid4().hex}"
+    last_touch = [time.time()]
+    transcode_started = {}  # postprocessor name -> perf_counter() when it started
+
+    def on_download(d):
+        if cancelled():
+            # yt-dlp lets DownloadCancelled out of a progress hook unwrapped
+            raise DownloadCancelled()
+        now = time.time()
+        if now - last_touch[0] > LOCK_STALE_SECONDS / 4:
+            # Keep the lock fresh during long downloads so waiters don't think we died
+            os.utime(lock_path, None)
+            last_touch[0] = now
+        if progress is None:
+            return
+        if d.get('status') == 'downloading':
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                progress('downloading', d.get('downloaded_bytes', 0) * 100.0 / total)
+        elif d.get('status') == 'finished':
+            progress('processing')
+
+    def on_postprocess(d):
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            transcode_started[name] = time.perf_counter()
+        elif d.get('status') == 'finished' and name == 'ExtractAudio' and name in transcode_started:
+            YTDLP_SECONDS.labels('transcode').observe(time.perf_counter() - transcode_started.pop(name))
+
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': os.path.join(mp3_folder, f'{tmp_stem}.%(ext)s'),
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': str(MP3_BITRATE),
+        }],
+        'progress_hooks': [on_download],
+        'postprocessor_hooks': [on_postprocess],
+        'quiet': True,
+    }
+    if fingerprints is not None and not fingerprint.available():
+        fingerprints = None
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # What ydl.download() does, in two steps so each is timed
+            with YTDLP_SECONDS.time('extract', errors=YTDLP_ERRORS):
+                info = ydl.extract_info(url, download=False)
+            if fingerprints is not None:
+                # The format is resolved: a re-upload can be recognised before downloading it all
+                match = _probe(video_id, info, fingerprints)
+                if match:
+                    fingerprints.add_alias(video_id, *match)
+                    return mp3_filename(match[0])
+                if cancelled():
+                    raise DownloadCancelled()
+            with YTDLP_SECONDS.time('download', errors=YTDLP_ERRORS):
+                ydl.process_ie_result(info, download=True)
+        tmp_path = os.path.join(mp3_folder, f'{tmp_stem}.mp3')
+        if not os.path.exists(tmp_path):
+            raise RuntimeError('Download failed. Check ffmpeg is installed.')
+        found = None
+        if fingerprints is not None:
+            with YTDLP_SECONDS.time('fingerprint'):
+                match, found = _find_duplicate(video_id, fingerprints, lambda: fingerprints.fingerprint_file(tmp_path))
+            if match:
+                fingerprints.add_alias(video_id, *match)
+                return mp3_filename(match[0])
+        os.replace(tmp_path, final_path)
+        if found is not None:
+            try:
+                fingerprints.add(video_id, *found)
+            except Exception as e:
+                logger.warning(f"Could not index the fingerprint of {video_id}: {e}")
+        return mp3_filename(video_id)
+    finally:
+        for leftover in glob.glob(os.path.join(glob.escape(mp3_folder), glob.escape(tmp_stem) + '.*')):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
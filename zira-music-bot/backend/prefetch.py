@@ -0,0 +1,138 @@
+"""Keeps the tracks each room is about to play downloaded, transcoded and in the page cache.
+
+Whenever a room's position or queue changes, the server hands the prefetcher
+the video_ids of its current song and the next few after it. Anything not on
+disk yet is downloaded (and its renditions transcoded) on low-priority worker
+threads, nearest first; the files are then read ahead into the page cache,
+so skipping to the next song is served from memory instead of waiting on
+YouTube. A track that drops out of every room's lookahead (skipped past,
+queue cleared, room unloaded) is cancelled, queued or mid-download.
+Fetched tracks are reported back to the server (drain_events), which points
+queue entries that had no file yet at the one that was downloaded.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _lower_priority(niceness):
+    # On Linux, setpriority on a thread id only affects that thread; ffmpeg/yt-dlp children inherit it
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError) as e:
+        logger.debug(f"Could not lower prefetch thread priority: {e}")
+
+
+def warm(path):
+    """Ask the kernel to read `path` into the page cache in the background. Returns False if it can't."""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+class Prefetcher:
+    """`fetch(video_id, should_cancel)` does the work and returns (result, paths to keep warm).
+
+    update() and forget() are cheap and never block on the workers, so the
+    server can call them on every queue change. Like DownloadJobManager,
+    workers never touch app state: each fetched result is queued, and
+    drain_events() hands it to `on_fetched(video_id, result)` on the caller's thread.
+    """
+
+    def __init__(self, fetch, workers=1, niceness=10, on_fetched=None):
+        self.fetch = fetch
+        self.on_fetched = on_fetched
+        self._events = queue.Queue()
+        self._wanted = {}  # room id -> upcoming video_ids, nearest first
+        self._queued = set()  # video_ids submitted and not finished yet
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch',
+                                        initializer=_lower_priority, initargs=(niceness,))
+        self.counters = {'fetched': 0, 'cancelled': 0, 'failed': 0, 'warmed': 0}
+
+    def update(self, room_id, video_ids):
+        """Set what `room_id` plays next; fetch what's new, let the rest be cancelled."""
+        video_ids = list(dict.fromkeys(v for v in video_ids if v))
+        with self._lock:
+            if video_ids:
+                self._wanted[room_id] = video_ids
+            else:
+                self._wanted.pop(room_id, None)
+            new = [v for v in video_ids if v not in self._queued]
+            self._queued.update(new)
+        for video_id in new:
+            self._pool.submit(self._run, video_id)
+
+    def forget(self, room_ids):
+        """Drop the lookahead of rooms that were unloaded."""
+        with self._lock:
+            for room_id in room_ids:
+                self._wanted.pop(room_id, None)
+
+    def wanted(self, video_id):
+        with self._lock:
+            return any(video_id in ids for ids in self._wanted.values())
+
+    def _run(self, video_id):
+        cancelled = False
+        try:
+            if not self.wanted(video_id):
+                cancelled = True
+                return
+            result, paths = self.fetch(video_id, lambda: not self.wanted(video_id))
+            self.counters['fetched'] += 1
+            if self.on_fetched is not None:
+                self._events.put((video_id, result))
+            self.counters['warmed'] += sum(warm(path) for path in paths)
+        except Exception as e:
+            cancelled = not self.wanted(video_id)
+            if not cancelled:
+                self.counters['failed'] += 1
+                logger.warning(f"Could not prefetch {video_id}: {e}")
+        finally:
+            if cancelled:
+                self.counters['cancelled'] += 1
+            with self._lock:
+                # Wanted again while we were giving up on it
+                again = cancelled and any(video_id in ids for ids in self._wanted.values())
+                if not again:
+                    self._queued.discard(video_id)
+            if again:
+                self._pool.submit(self._run, video_id)
+
+    def drain_events(self, limit=100):
+        handled = 0
+        while handled < limit:
+            try:
+                video_id, result = self._events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            try:
+                self.on_fetched(video_id, result)
+            except Exception:
+                logger.exception(f"Could not handle prefetched {video_id}")
+        return handled
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            upcoming = sum(len(ids) for ids in self._wanted.values())
+            queued = len(self._queued)
+        return dict(self.counters, upcoming=upcoming, queued=queued)
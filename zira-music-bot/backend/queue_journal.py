@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def apply_record(queue, record):
+    """Apply one journal record to a list of songs."""
+    op = record['op']
+    if op == 'add':
+        queue.append(record['song'])
+    elif op == 'clear':
+        queue.clear()
+    elif op == 'remove':
+        del queue[record['index']]
+    elif op == 'move':
+        queue.insert(record['to'], queue.pop(record['index']))
+    elif op == 'update':
+        queue[record['index']] = record['song']
+    else:
+        raise ValueError(f"Unknown queue journal op {op!r}")
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+class QueueJournal:
+    """Append-only persistence for the music queue.
+
+    Every mutation appends one compact JSON line to `<snapshot>.journal`.
+    Lines reach the OS immediately; a background flusher fsyncs them in
+    batches every `fsync_interval` seconds. After `compact_after` records
+    the journal is rotated and a fresh snapshot is written in the background,
+    via a temp file and an atomic rename.
+
+    Records carry a sequence number and the snapshot stores the last one it
+    includes, so replay after a crash at any point never applies a record twice.
+    """
+
+    def __init__(self, snapshot_path, state, fsync_interval=0.05, compact_after=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + '.journal'
+        self.rotated_path = snapshot_path + '.journal.1'
+        self._state = state  # state() -> current list of songs, read when compacting
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._since_compact = 0
+        self._dirty = False
+        self._compacting = None
+        self._file = None
+        self._stop = threading.Event()
+        self._flusher = None
+
+    # --- Startup ---
+    def load(self):
+        """Replay snapshot + journals and return the queue. Call once, before append()."""
+        queue, seq = [], 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                queue = data  # queue.json from before the journal existed
+            else:
+                queue, seq = data['queue'], data['seq']
+        replayed = 0
+        for path in (self.rotated_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-append; nothing after it was acknowledged
+                        logger.warning(f"Ignoring truncated record in {path}")
+                        break
+                    if record['seq'] <= seq:
+                        continue
+                    apply_record(queue, record)
+                    seq = record['seq']
+                    replayed += 1
+        self._seq = seq
+        self._since_compact = replayed
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        if os.path.exists(self.rotated_path):
+            # We crashed mid-compaction; finish it now that everything is replayed
+            self._write_snapshot(queue, seq)
+            os.remove(self.rotated_path)
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._flusher = threading.Thread(target=self._flush_loop, name='queue-journal-fsync', daemon=True)
+        self._flusher.start()
+        return queue
+
+    # --- Writes ---
+    def append(self, op, **fields):
+        # Call after the mutation has been applied to the in-memory queue, so a
+        # compaction triggered here snapshots a state that includes it.
+        with self._lock:
+            self._seq += 1
+            record = {'op': op, 'seq': self._seq, **fields}
+            self._file.write(_dumps(record) + '\n')
+            self._file.flush()
+            self._dirty = True
+            self._since_compact += 1
+            if self._since_compact >= self.compact_after and self._compacting is None:
+                self._start_compaction()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fd = self._file.fileno()
+        # fsync outside the lock so appends aren't blocked on the disk
+        try:
+            os.fsync(fd)
+        except (OSError, ValueError):
+            # The journal was rotated under us; the compaction fsyncs its own output
+            pass
+
+    # --- Compaction ---
+    def _start_compaction(self):
+        # Called with the lock held: take a consistent copy and rotate the journal
+        if os.path.exists(self.rotated_path):
+            # A previous snapshot write failed; its records are still needed
+            return
+        queue = list(self._state())
+        seq = self._seq
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.journal_path, self.rotated_path)
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._since_compact = 0
+        self._compacting = threading.Thread(target=self._compact, args=(queue, seq), name='queue-journal-compact', daemon=True)
+        self._compacting.start()
+
+    def _write_snapshot(self, queue, seq):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(_dumps({'seq': seq, 'queue': queue}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _compact(self, queue, seq):
+        try:
+            self._write_snapshot(queue, seq)
+            os.remove(self.rotated_path)
+        except OSError as e:
+            logger.error(f"Queue snapshot failed, keeping {self.rotated_path}: {e}")
+        finally:
+            with self._lock:
+                self._compacting = None
+
+    def close(self):
+        self._stop.set()
+        compacting = self._compacting
+        if compacting is not None:
+            compacting.join()
+        self.sync()
+        with self._lock:
+            self._file.close()
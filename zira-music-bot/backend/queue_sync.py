@@ -0,0 +1,67 @@
+"""Versioned queue deltas for Socket.IO clients.
+
+Every queue/playback mutation bumps `version` and produces one delta:
+
+    {"version": 12, "op": "add",     "index": 4,    "payload": {<song>}}
+    {"version": 13, "op": "current", "index": 4,    "payload": null}
+    {"version": 14, "op": "paused",  "index": null, "payload": true}
+    {"version": 15, "op": "clear",   "index": null, "payload": null}
+    {"version": 16, "op": "remove",  "index": 2,    "payload": null}
+    {"version": 17, "op": "move",    "index": 2,    "payload": 0}
+    {"version": 18, "op": "update",  "index": 3,    "payload": {<song>}}
+
+Clients apply deltas in version order on top of a `queue_update` snapshot
+(which carries the snapshot's version and the server's epoch). "clear" also
+resets current to 0 and unpauses. "update" replaces the song at index (its
+file became known after it was queued: new src/variants, maybe video_id). A client that sees a gap, or reconnects,
+sends `sync` with its epoch and the last version it applied, and gets the
+missed deltas, or a fresh snapshot if they have already fallen out of the
+replay buffer or the server has restarted since (new epoch).
+"""
+import threading
+import uuid
+from collections import deque
+
+OPS = ('add', 'current', 'paused', 'clear', 'remove', 'move', 'update')
+
+
+class QueueDeltaLog:
+    def __init__(self, replay_size=256):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self._log = deque(maxlen=replay_size)
+        self._lock = threading.Lock()
+
+    def record(self, op, index=None, payload=None):
+        if op not in OPS:
+            raise ValueError(f"Unknown queue delta op {op!r}")
+        with self._lock:
+            self.version += 1
+            delta = {'version': self.version, 'op': op, 'index': index, 'payload': payload}
+            self._log.append(delta)
+            return delta
+
+    def replay(self, delta):
+        """Add a delta another worker recorded (see shared_state.py), keeping its version."""
+        with self._lock:
+            self.version = delta['version']
+            self._log.append(delta)
+
+    def reset(self, epoch, version):
+        """Start over at someone else's epoch and version, with nothing to replay."""
+        with self._lock:
+            self.epoch = epoch
+            self.version = version
+            self._log.clear()
+
+    def since(self, epoch, version):
+        """Deltas after `version`, or None if the client needs a snapshot instead."""
+        with self._lock:
+            if epoch != self.epoch or version > self.version:
+                # Client is from before a server restart
+                return None
+            if version == self.version:
+                return []
+            if not self._log or self._log[0]['version'] > version + 1:
+                return None
+            return [delta for delta in self._log if delta['version'] > version]
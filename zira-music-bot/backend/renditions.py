@@ -0,0 +1,207 @@
+"""Lower-bitrate renditions of downloaded tracks, transcoded on first request.
+
+Downloads stay 192 kbps MP3s. The first request for another rung of the
+ladder queues an ffmpeg transcode into <MP3_FOLDER>/renditions/ and is
+answered from the original meanwhile; every later request gets the
+rendition. Each rendition has its own URL (?quality=<label>), so a given URL
+always serves the same bytes and stays immutable-cacheable. The bare URL
+depends on the client hints, so it is served with Vary and revalidated.
+"""
+import glob
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OPUS = 'opus'
+MIMETYPES = {'mp3': 'audio/mpeg', OPUS: 'audio/ogg'}
+# Effective connection types (Network Information API / ECT client hint) -> kbps budget
+ECT_BUDGET = {'slow-2g': 48, '2g': 64, '3g': 128}
+
+TRANSCODE_SECONDS = metrics.histogram('rendition_transcode_duration_seconds', 'ffmpeg rendition transcodes, by rung',
+                                      ['label'])
+TRANSCODE_ERRORS = metrics.counter('rendition_transcode_errors_total', 'Rendition transcodes that failed, by rung',
+                                   ['label'])
+
+
+class Renditions:
+    def __init__(self, folder, bitrates=(64, 128), original=192, opus_bitrate=0, ffmpeg='ffmpeg', workers=1,
+                 retry_after=600, on_transcoded=None):
+        self.folder = folder
+        self.dir = os.path.join(folder, 'renditions')
+        self.original = str(original)
+        self.bitrates = {str(b): int(b) for b in sorted(bitrates) if int(b) < original}
+        self.opus_bitrate = opus_bitrate
+        self.ffmpeg = ffmpeg
+        self.workers = workers
+        self._pool = None
+        self.retry_after = retry_after
+        self.on_transcoded = on_transcoded  # on_transcoded(video_id, bytes), e.g. Mp3Cache.add_derived
+        self._pending = set()
+        self._failed = {}  # (video_id, label) -> when its transcode failed; not retried for retry_after seconds
+        self._lock = threading.Lock()
+        self.counters = {'served': 0, 'fallbacks': 0, 'transcodes': 0, 'failures': 0}  # updated under _lock
+
+    # --- Ladder ---
+    def labels(self):
+        """Every quality a track can be served at, lowest first."""
+        labels = list(self.bitrates) + [self.original]
+        if self.opus_bitrate:
+            labels.append(OPUS)
+        return labels
+
+    @property
+    def adaptive(self):
+        """Whether choose() can pick anything but the original from client hints."""
+        return bool(self.bitrates)
+
+    def variants(self, filename):
+        """label -> src for a queue entry, in the same form as its `src` (None for anything not downloaded here)."""
+        if not filename.endswith('.mp3') or '/' in filename:
+            return None
+        return {label: filename if label == self.original else f'{filename}?quality={label}'
+                for label in self.labels()}
+
+    def choose(self, quality=None, save_data=False, ect=None, downlink=None):
+        """The label to serve: `quality` if it's on the ladder, else one picked from the client hints."""
+        if quality in self.labels():
+            return quality
+        budget = None
+        if save_data:
+            budget = 0
+        elif ect in ECT_BUDGET:
+            budget = ECT_BUDGET[ect]
+        elif downlink is not None:
+            # Downlink is in Mbps; leave headroom for everything else on the connection
+            budget = downlink * 1000 / 4
+        if budget is None or budget >= int(self.original):
+            return self.original
+        fitting = [label for label, kbps in self.bitrates.items() if kbps <= budget]
+        return fitting[-1] if fitting else (next(iter(self.bitrates), self.original))
+
+    def mimetype(self, label):
+        return MIMETYPES[OPUS if label == OPUS else 'mp3']
+
+    def path(self, video_id, label):
+        ext = 'opus' if label == OPUS else 'mp3'
+        return os.path.join(self.dir, f'{video_id}.{label}.{ext}')
+
+    # --- Transcoding ---
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _claim(self, key):
+        # Under self._lock: whether the caller may start this transcode (marked pending if so)
+        if key in self._pending:
+            return False
+        failed_at = self._failed.get(key)
+        if failed_at is not None:
+            if time.monotonic() - failed_at < self.retry_after:
+                return False
+            del self._failed[key]
+        self._pending.add(key)
+        return True
+
+    def get(self, video_id, label):
+        """Path of the rendition if it exists; otherwise start transcoding it and return None."""
+        path = self.path(video_id, label)
+        if os.path.exists(path):
+            self._count('served')
+            return path
+        source = os.path.join(self.folder, f'{video_id}.mp3')
+        source_exists = os.path.exists(source)
+        with self._lock:
+            if source_exists and self._claim((video_id, label)):
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rendition')
+                self._pool.submit(self._transcode, video_id, label, source, path)
+            self.counters['fallbacks'] += 1
+        return None
+
+    def prepare(self, video_id, label):
+        """Transcode the rendition on the calling thread unless it exists or is underway; returns its path or None."""
+        path = self.path(video_id, label)
+        source = os.path.join(self.folder, f'{video_id}.mp3')
+        if os.path.exists(path):
+            return path
+        if not os.path.exists(source):
+            return None
+        with self._lock:
+            if not self._claim((video_id, label)):
+                return None
+        self._transcode(video_id, label, source, path)
+        return path if os.path.exists(path) else None
+
+    def _transcode(self, video_id, label, source, path):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = os.path.join(self.dir, f'.{video_id}.{label}.{uuid.uuid4().hex}')
+        if label == OPUS:
+            codec = ['-codec:a', 'libopus', '-b:a', f'{self.opus_bitrate}k', '-f', 'ogg']
+        else:
+            codec = ['-codec:a', 'libmp3lame', '-b:a', f'{self.bitrates[label]}k', '-f', 'mp3']
+        try:
+            with TRANSCODE_SECONDS.time(label, errors=TRANSCODE_ERRORS):
+                # -vn: leave out the embedded cover art, the players show albumArt anyway
+                result = subprocess.run([self.ffmpeg, '-v', 'error', '-nostdin', '-y', '-i', source, '-vn', *codec,
+                                         tmp], capture_output=True, timeout=600)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.decode(errors='replace').strip() or f'exit {result.returncode}')
+            os.replace(tmp, path)
+            self._count('transcodes')
+            if self.on_transcoded is not None:
+                self.on_transcoded(video_id, os.path.getsize(path))
+        except Exception as e:
+            with self._lock:
+                self.counters['failures'] += 1
+                self._failed[(video_id, label)] = time.monotonic()
+            logger.warning(f"Could not transcode {video_id} to {label}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard((video_id, label))
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+
+    # --- Cleanup ---
+    def remove(self, video_id):
+        """Delete every rendition of `video_id` (its original was evicted)."""
+        for path in glob.glob(os.path.join(glob.escape(self.dir), glob.escape(video_id) + '.*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def sizes(self):
+        """video_id -> bytes of its renditions on disk."""
+        sizes = {}
+        if os.path.isdir(self.dir):
+            for entry in os.scandir(self.dir):
+                if not entry.name.startswith('.'):
+                    # <video_id>.<label>.<ext>
+                    video_id = entry.name.rsplit('.', 2)[0]
+                    sizes[video_id] = sizes.get(video_id, 0) + entry.stat().st_size
+        return sizes
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        files = size = 0
+        if os.path.isdir(self.dir):
+            for entry in os.scandir(self.dir):
+                if not entry.name.startswith('.'):
+                    files += 1
+                    size += entry.stat().st_size
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters, files=files, bytes=size, ladder=self.labels())
@@ -0,0 +1,225 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from queue_journal import QueueJournal
+from queue_sync import QueueDeltaLog
+from song_queue import SongQueue
+
+logger = logging.getLogger(__name__)
+
+# Rooms are keyed by Telegram chat id (negative for groups). "default" is the
+# room every client used before rooms existed, and keeps the old queue.json.
+DEFAULT_ROOM = 'default'
+ROOM_ID_RE = re.compile(r'^-?[A-Za-z0-9_]{1,64}$')
+
+
+def valid_room_id(room_id):
+    return isinstance(room_id, str) and bool(ROOM_ID_RE.match(room_id))
+
+
+class Room:
+    """Queue, playback state, chat history and persistence for one chat.
+
+    Without a store the room is persisted by its QueueJournal. With a shared
+    store (see shared_state.py) the store is authoritative and this object is
+    a cache of it: call refresh() before reading and make changes inside
+    mutate().
+    """
+
+    def __init__(self, room_id, queue_file, replay_size=256, fsync_interval=0.05, compact_after=1000,
+                 chat_history_size=50, store=None):
+        self.id = room_id
+        self.queue_file = queue_file
+        self.queue = SongQueue()
+        self.current = 0
+        self.is_paused = False
+        self.chat_history = deque(maxlen=chat_history_size)  # Recent chat messages, oldest dropped first
+        self.store = store
+        self.journal = None if store is not None else QueueJournal(queue_file, state=self.queue.to_list,
+                                                                   fsync_interval=fsync_interval,
+                                                                   compact_after=compact_after)
+        self.deltas = QueueDeltaLog(replay_size)
+        self.clients = set()  # connected Socket.IO sids
+        self.legacy_clients = set()  # sids that want full snapshots
+        self.last_active = time.time()
+
+    # Socket.IO room names: everything for this chat, and the two queue protocols
+    @property
+    def sio_room(self):
+        return f'room:{self.id}'
+
+    @property
+    def delta_room(self):
+        return f'room:{self.id}:delta'
+
+    @property
+    def snapshot_room(self):
+        return f'room:{self.id}:snapshot'
+
+    def load(self):
+        if self.store is None:
+            # Entries are deduplicated by video_id, the same rule add_song applies
+            self.queue.extend(self.journal.load())
+            return
+        with self.store.lock(self.id) as tx:
+            if tx.head() is None:
+                # First time any worker opens this room: start from its queue file
+                journal = QueueJournal(self.queue_file, state=list)
+                songs = SongQueue(journal.load()).to_list()
+                journal.close()
+                tx.create(self.deltas.epoch, songs)
+            self._catch_up(tx)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+    # --- Shared store ---
+    def refresh(self):
+        """Apply what other workers changed since we last looked (no-op without a store)."""
+        if self.store is not None:
+            with self.store.read(self.id) as tx:
+                self._catch_up(tx)
+
+    @contextmanager
+    def mutate(self):
+        """Make one change to the room. With a store, no other worker can change it meanwhile,
+        we start from its latest state, and the deltas recorded inside are stored on exit.
+        Keep the block to the change itself: tell clients about it after the block, once committed."""
+        if self.store is None:
+            yield
+            return
+        with self.store.lock(self.id) as tx:
+            self._catch_up(tx)
+            version = self.deltas.version
+            try:
+                yield
+            except BaseException:
+                # The store rolls back; drop whatever was half applied here at the next catch-up
+                self.deltas.reset(None, -1)
+                raise
+            tx.append(self.deltas.since(self.deltas.epoch, version), self._state)
+
+    def _state(self):
+        return {'queue': self.queue.to_list(), 'current': self.current, 'is_paused': self.is_paused}
+
+    def _catch_up(self, tx):
+        missed = tx.changes_since(self.deltas.epoch, self.deltas.version)
+        if missed is None:
+            state, missed = tx.snapshot()
+            self.queue.clear()
+            self.queue.extend(state['queue'])
+            self.current = state['current']
+            self.is_paused = state['is_paused']
+            self.deltas.reset(state['epoch'], state['version'])
+        for delta in missed:
+            self.apply(delta)
+            self.deltas.replay(delta)
+
+    def apply(self, delta):
+        """Apply a queue delta (see queue_sync.py) recorded by another worker."""
+        op, index, payload = delta['op'], delta['index'], delta['payload']
+        if op == 'add':
+            self.queue.append(payload)
+        elif op == 'current':
+            self.current = index
+        elif op == 'paused':
+            self.is_paused = payload
+        elif op == 'clear':
+            self.queue.clear()
+            self.current = 0
+            self.is_paused = False
+        elif op == 'remove':
+            self.queue.remove(index)
+        elif op == 'move':
+            self.queue.move(index, payload)
+        elif op == 'update':
+            self.queue.replace(index, payload)
+
+    # --- Chat ---
+    def add_chat(self, message):
+        if self.store is not None:
+            self.store.add_chat(self.id, message)
+        else:
+            self.chat_history.append(message)
+
+    def recent_chat(self):
+        if self.store is not None:
+            return self.store.chat_history(self.id)
+        return list(self.chat_history)
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def snapshot(self):
+        return {
+            "queue": self.queue.to_list(),
+            "current": self.current,
+            "is_paused": self.is_paused,
+            "version": self.deltas.version,
+            "epoch": self.deltas.epoch,
+        }
+
+
+class RoomRegistry:
+    """Loads rooms on first use and unloads them once idle.
+
+    Memory scales with the rooms that are in use, not every chat that ever
+    played a song; an unloaded room is replayed from its journal next time.
+    """
+
+    def __init__(self, rooms_dir, default_queue_file, idle_timeout=600, **room_options):
+        self.rooms_dir = rooms_dir
+        self.default_queue_file = default_queue_file
+        self.idle_timeout = idle_timeout
+        self._room_options = room_options
+        self._rooms = {}
+        self._lock = threading.RLock()
+
+    def queue_file(self, room_id):
+        if room_id == DEFAULT_ROOM:
+            return self.default_queue_file
+        return os.path.join(self.rooms_dir, f'{room_id}.json')
+
+    def get(self, room_id):
+        if not valid_room_id(room_id):
+            raise ValueError(f"Invalid room id {room_id!r}")
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                os.makedirs(self.rooms_dir, exist_ok=True)
+                room = Room(room_id, self.queue_file(room_id), **self._room_options)
+                room.load()
+                self._rooms[room_id] = room
+                logger.info(f"Loaded room {room_id} ({len(room.queue)} songs)")
+            room.touch()
+            return room
+
+    def loaded(self):
+        with self._lock:
+            return list(self._rooms.values())
+
+    def unload_idle(self, now=None):
+        now = now or time.time()
+        unloaded = []
+        with self._lock:
+            for room_id, room in list(self._rooms.items()):
+                if room.clients or now - room.last_active < self.idle_timeout:
+                    continue
+                room.close()
+                del self._rooms[room_id]
+                unloaded.append(room_id)
+        if unloaded:
+            logger.info(f"Unloaded idle rooms: {', '.join(unloaded)}")
+        return unloaded
+
+    def close(self):
+        with self._lock:
+            for room in self._rooms.values():
+                room.close()
+            self._rooms.clear()
@@ -0,0 +1,168 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOKUPS = metrics.counter('search_cache_lookups_total', 'Search cache lookups by result (hit, stale, miss)',
+                          ['result'])
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class SearchCache:
+    """TTL + LRU cache for search results with stale-while-revalidate.
+
+    Fresh entries (younger than `ttl`) are served as-is. Stale entries (younger
+    than `stale_ttl`) are served immediately while one background refresh runs.
+    Anything older is fetched synchronously. Concurrent misses for the same query
+    share a single fetch.
+
+    If `store_path` is given, entries are also written to a SQLite file so other
+    processes (bot.py and api_server.py) reuse each other's results; the
+    in-memory LRU sits in front of it.
+    """
+
+    def __init__(self, fetch, ttl=600, stale_ttl=6 * 3600, max_entries=1000, store_path=None, spawn=None):
+        self._fetch = fetch  # fetch(query) -> list of result dicts
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.store_path = store_path
+        self._spawn = spawn or (lambda fn: threading.Thread(target=fn, daemon=True).start())
+        self._entries = OrderedDict()  # key -> (results, fetched_at)
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> threading.Event
+        self._refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        if store_path:
+            with self._store() as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('''CREATE TABLE IF NOT EXISTS search_cache (
+                    query TEXT PRIMARY KEY,
+                    results TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )''')
+
+    @contextmanager
+    def _store(self):
+        db = sqlite3.connect(self.store_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    # --- Storage ---
+    def _get_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.store_path:
+            return None
+        with self._store() as db:
+            row = db.execute('SELECT results, fetched_at FROM search_cache WHERE query=?', (key,)).fetchone()
+        if row is None:
+            return None
+        entry = (json.loads(row[0]), row[1])
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put(self, key, results):
+        entry = (results, time.time())
+        self._remember(key, entry)
+        if self.store_path:
+            with metrics.sqlite_write('search_cache'), self._store() as db:
+                db.execute('INSERT OR REPLACE INTO search_cache (query, results, fetched_at) VALUES (?, ?, ?)',
+                           (key, json.dumps(results), entry[1]))
+                db.execute('DELETE FROM search_cache WHERE fetched_at < ?', (entry[1] - self.stale_ttl,))
+        return entry
+
+    # --- Fetching ---
+    def _load(self, key, query):
+        # Single-flight: the first caller fetches, the rest wait for its result
+        with self._lock:
+            done = self._inflight.get(key)
+            leader = done is None
+            if leader:
+                done = self._inflight[key] = threading.Event()
+        if not leader:
+            done.wait()
+            entry = self._get_entry(key)
+            if entry is not None:
+                return entry[0]
+            # The leader failed; try ourselves
+            return self._put(key, self._fetch(query))[0]
+        try:
+            return self._put(key, self._fetch(query))[0]
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def _revalidate(self, key, query):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._put(key, self._fetch(query))
+            except Exception as e:
+                # Keep serving the stale copy
+                logger.warning(f"Background refresh of search {key!r} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._spawn(refresh)
+
+    def get(self, query):
+        key = normalize_query(query)
+        entry = self._get_entry(key)
+        if entry is not None:
+            results, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                LOOKUPS.labels('hit').inc()
+                return results
+            if age < self.stale_ttl:
+                self.stale_hits += 1
+                LOOKUPS.labels('stale').inc()
+                self._revalidate(key, query)
+                return results
+        self.misses += 1
+        LOOKUPS.labels('miss').inc()
+        return self._load(key, query)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+        }
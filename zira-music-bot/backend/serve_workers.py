@@ -0,0 +1,64 @@
+"""Run several api_server.py workers on one host.
+
+Worker i listens on API_PORT + i. They share room state through STATE_STORE
+and reach each other's Socket.IO clients through SOCKETIO_MESSAGE_QUEUE;
+unless those are set, both default to SQLite files next to this script, so
+no other service is needed. Put a proxy with sticky sessions in front (e.g.
+nginx `ip_hash` over the worker ports): Engine.IO long-polling has to keep
+hitting the worker that holds the session.
+
+    python serve_workers.py 4
+
+A worker that exits is restarted; Ctrl+C / SIGTERM stops them all.
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import config
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1
+    env = dict(os.environ)
+    env.setdefault('STATE_STORE', 'sqlite:///' + os.path.join(BACKEND_DIR, 'rooms.sqlite3'))
+    env.setdefault('SOCKETIO_MESSAGE_QUEUE', 'sqlite:///' + os.path.join(BACKEND_DIR, 'socketio.sqlite3'))
+    # The debug reloader would fork a second copy of every worker
+    env['API_DEBUG'] = '0'
+
+    def start(i):
+        port = config.API_PORT + i
+        print(f"[WORKERS] Starting worker {i} on port {port}")
+        return subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'api_server.py')],
+                                env=dict(env, API_PORT=str(port)), cwd=BACKEND_DIR)
+
+    procs = [start(i) for i in range(workers)]
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while not stopping:
+        time.sleep(1)
+        for i, proc in enumerate(procs):
+            if proc.poll() is not None and not stopping:
+                print(f"[WORKERS] Worker {i} exited with {proc.returncode}, restarting")
+                procs[i] = start(i)
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Room state shared by several API server workers.
+
+With STATE_STORE set, the queue, playback position and chat history of every
+room live in a store that all workers open, instead of each worker's memory
+and queue journal. Workers keep their in-memory Room as a cache and bring it
+up to date from the store's delta log (the same versioned deltas Socket.IO
+clients get, see queue_sync.py) before serving a request.
+
+Every mutation runs inside a store lock (Room.mutate): catch up, change,
+append the new deltas, release. Mutations of a room are therefore applied
+one at a time in a single global order, whichever worker handles them, and
+current_song_index can't diverge between workers.
+
+SqliteRoomStore is the single-host implementation: one SQLite file in WAL
+mode, the lock being a BEGIN IMMEDIATE transaction (database-wide, held for
+a few milliseconds). Waiting for it never blocks in SQLite's busy handler:
+BEGIN is retried with the `sleep` the store was given (socketio.sleep in
+the API server), so other greenlets keep running meanwhile. Another store only has to provide lock(), read(),
+queued_video_ids(), add_chat() and chat_history() with the same semantics.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PREFIX = 'sqlite:///'
+
+
+def open_store(url, **options):
+    """The store for a STATE_STORE url, or None for in-process state ('')."""
+    if not url:
+        return None
+    if url.startswith(SQLITE_PREFIX):
+        return SqliteRoomStore(url[len(SQLITE_PREFIX):], **options)
+    raise ValueError(f"Unsupported STATE_STORE {url!r} (expected {SQLITE_PREFIX}<path>)")
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+class RoomTransaction:
+    """One room's rows, read and written inside a store transaction."""
+
+    def __init__(self, store, db, room_id):
+        self.store = store
+        self.db = db
+        self.room_id = room_id
+
+    def head(self):
+        """(epoch, version) of the room, or None if no worker has created it yet."""
+        return self.db.execute('SELECT epoch, version FROM rooms WHERE room_id=?', (self.room_id,)).fetchone()
+
+    def _deltas(self, after):
+        rows = self.db.execute('SELECT version, op, idx, payload FROM deltas WHERE room_id=? AND version>? '
+                               'ORDER BY version', (self.room_id, after)).fetchall()
+        return [{'version': v, 'op': op, 'index': idx, 'payload': json.loads(payload)}
+                for v, op, idx, payload in rows]
+
+    def changes_since(self, epoch, version):
+        """Deltas after `version`, or None if the caller has to start over from snapshot()."""
+        head = self.head()
+        if head is None or head[0] != epoch or version > head[1]:
+            return None
+        if version == head[1]:
+            return []
+        first = self.db.execute('SELECT MIN(version) FROM deltas WHERE room_id=?', (self.room_id,)).fetchone()[0]
+        if first is None or first > version + 1:
+            return None
+        return self._deltas(version)
+
+    def snapshot(self):
+        """(state, deltas): the last compacted state and every delta after it."""
+        epoch, version, queue, current, is_paused = self.db.execute(
+            'SELECT epoch, snapshot_version, queue, current, is_paused FROM rooms WHERE room_id=?',
+            (self.room_id,)).fetchone()
+        state = {'epoch': epoch, 'version': version, 'queue': json.loads(queue),
+                 'current': current, 'is_paused': bool(is_paused)}
+        return state, self._deltas(version)
+
+    def create(self, epoch, queue):
+        self.db.execute('INSERT INTO rooms (room_id, epoch, version, snapshot_version, queue, current, is_paused) '
+                        'VALUES (?, ?, 0, 0, ?, 0, 0)', (self.room_id, epoch, _dumps(queue)))
+        self._set_queued(song['video_id'] for song in queue)
+
+    def _set_queued(self, video_ids):
+        self.db.execute('DELETE FROM queued WHERE room_id=?', (self.room_id,))
+        self.db.executemany('INSERT OR IGNORE INTO queued (room_id, video_id) VALUES (?, ?)',
+                            [(self.room_id, v) for v in video_ids if v])
+
+    def append(self, deltas, state):
+        """Store the deltas of one mutation; state() is the room after them, read when compacting."""
+        if not deltas:
+            return
+        self.db.executemany('INSERT INTO deltas (room_id, version, op, idx, payload) VALUES (?, ?, ?, ?, ?)',
+                            [(self.room_id, d['version'], d['op'], d['index'], _dumps(d['payload'])) for d in deltas])
+        ops = {d['op'] for d in deltas}
+        if ops & {'clear', 'remove', 'update'}:
+            self._set_queued(song['video_id'] for song in state()['queue'])
+        elif 'add' in ops:
+            self.db.executemany('INSERT OR IGNORE INTO queued (room_id, video_id) VALUES (?, ?)',
+                                [(self.room_id, d['payload']['video_id']) for d in deltas
+                                 if d['op'] == 'add' and d['payload'].get('video_id')])
+        version = deltas[-1]['version']
+        snapshot_version = self.db.execute('SELECT snapshot_version FROM rooms WHERE room_id=?',
+                                           (self.room_id,)).fetchone()[0]
+        if version - snapshot_version < self.store.compact_after:
+            self.db.execute('UPDATE rooms SET version=? WHERE room_id=?', (version, self.room_id))
+            return
+        # Fold the log into a new snapshot, keeping the last replay_size deltas for catching up
+        current = state()
+        self.db.execute('UPDATE rooms SET version=?, snapshot_version=?, queue=?, current=?, is_paused=? '
+                        'WHERE room_id=?', (version, version, _dumps(current['queue']), current['current'],
+                                            int(current['is_paused']), self.room_id))
+        self.db.execute('DELETE FROM deltas WHERE room_id=? AND version<=?',
+                        (self.room_id, version - self.store.replay_size))
+
+
+class SqliteRoomStore:
+    """Like Mp3Cache, every call opens a short-lived connection, so any number of processes can share the file."""
+
+    def __init__(self, path, replay_size=256, compact_after=1000, chat_history_size=50, lock_timeout=30,
+                 sleep=time.sleep):
+        self.path = path
+        self.lock_timeout = lock_timeout
+        self.sleep = sleep  # how to wait for another worker's lock: cooperative under eventlet
+        self.replay_size = replay_size
+        self.compact_after = max(compact_after, 1)
+        self.chat_history_size = chat_history_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS rooms (
+                room_id TEXT PRIMARY KEY,
+                epoch TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                snapshot_version INTEGER NOT NULL,
+                queue TEXT NOT NULL,
+                current INTEGER NOT NULL,
+                is_paused INTEGER NOT NULL
+            )''')
+            db.execute('''CREATE TABLE IF NOT EXISTS deltas (
+                room_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                idx INTEGER,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (room_id, version)
+            ) WITHOUT ROWID''')
+            # What every room has queued, so each worker can pin all of it in the MP3 cache
+            db.execute('''CREATE TABLE IF NOT EXISTS queued (
+                room_id TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                PRIMARY KEY (room_id, video_id)
+            ) WITHOUT ROWID''')
+            db.execute('''CREATE TABLE IF NOT EXISTS chat (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                room_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                sent_at REAL NOT NULL
+            )''')
+            db.execute('CREATE INDEX IF NOT EXISTS chat_by_room ON chat (room_id, id)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _begin(self, db, mode):
+        # No busy timeout on the connection (it would sleep inside SQLite, stalling the eventlet hub):
+        # poll for the lock instead, backing off from 1 ms to 50 ms
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.001
+        while True:
+            try:
+                db.execute(f'BEGIN {mode}')
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                if time.monotonic() >= deadline:
+                    raise
+            self.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    @contextmanager
+    def _transaction(self, room_id, mode):
+        db = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        try:
+            # WAL commits without an fsync each; a power cut can lose the last few, like the queue journal's batching
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._begin(db, mode)
+            try:
+                yield RoomTransaction(self, db, room_id)
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    @contextmanager
+    def lock(self, room_id):
+        """Exclusive transaction on the room: other workers' lock() waits until it commits."""
+        # Timed as a write from BEGIN to COMMIT: waiting for the lock and the mutation included
+        with metrics.sqlite_write('room_store'), self._transaction(room_id, 'IMMEDIATE') as txn:
+            yield txn
+
+    def read(self, room_id):
+        """Consistent read-only view of the room."""
+        return self._transaction(room_id, 'DEFERRED')
+
+    def queued_video_ids(self):
+        """video_ids queued in any room."""
+        with self._connect() as db:
+            return {row[0] for row in db.execute('SELECT DISTINCT video_id FROM queued')}
+
+    # --- Chat ---
+    def add_chat(self, room_id, message):
+        # Through _transaction, so it waits for the lock the same cooperative way
+        with metrics.sqlite_write('room_store'), self._transaction(room_id, 'IMMEDIATE') as txn:
+            db = txn.db
+            db.execute('INSERT INTO chat (room_id, message, sent_at) VALUES (?, ?, ?)',
+                       (room_id, _dumps(message), time.time()))
+            db.execute('DELETE FROM chat WHERE room_id=? AND id NOT IN '
+                       '(SELECT id FROM chat WHERE room_id=? ORDER BY id DESC LIMIT ?)',
+                       (room_id, room_id, self.chat_history_size))
+
+    def chat_history(self, room_id):
+        with self._connect() as db:
+            rows = db.execute('SELECT message FROM chat WHERE room_id=? ORDER BY id DESC LIMIT ?',
+                              (room_id, self.chat_history_size)).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
@@ -0,0 +1,96 @@
+"""Socket.IO message queue backends, so any worker can emit to every client.
+
+SOCKETIO_MESSAGE_QUEUE picks one:
+
+    ''                     single process, emits go straight to local sockets
+    sqlite:///<path>       SqliteManager below: one SQLite file, no other service
+    redis://, amqp://, ... handed to Flask-SocketIO's own message_queue support
+
+With a queue, every emit is published to all workers (the emitting one
+included) and each delivers it to the sockets it holds.
+"""
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from socketio import PubSubManager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PREFIX = 'sqlite:///'
+
+
+def socketio_options(url):
+    """Keyword arguments for SocketIO() for a SOCKETIO_MESSAGE_QUEUE url."""
+    if not url:
+        return {}
+    if url.startswith(SQLITE_PREFIX):
+        return {'client_manager': SqliteManager(url)}
+    return {'message_queue': url}
+
+
+class SqliteManager(PubSubManager):
+    """Pub/sub over a table in a shared SQLite file.
+
+    Publishing inserts a row; every worker's listener polls for rows newer
+    than the last one it saw. Rows are deleted after `retention` seconds,
+    long after every live worker has read them.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, url=SQLITE_PREFIX + 'socketio.sqlite3', channel='flask-socketio', write_only=False,
+                 logger=None, json=None, poll_interval=0.02, retention=60):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = url[len(SQLITE_PREFIX):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created REAL NOT NULL
+            )''')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _publish(self, data):
+        with metrics.sqlite_write('socketio_queue'), self._connect() as db:
+            # Messages are only useful for a few seconds: not worth an fsync each
+            db.execute('PRAGMA synchronous=OFF')
+            db.execute('INSERT INTO messages (channel, data, created) VALUES (?, ?, ?)',
+                       (self.channel, self.json.dumps(data), time.time()))
+
+    def _listen(self):
+        with self._connect() as db:
+            last = db.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+        next_cleanup = time.time() + self.retention
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            while True:
+                rows = db.execute('SELECT id, data FROM messages WHERE id>? AND channel=? ORDER BY id',
+                                  (last, self.channel)).fetchall()
+                for row_id, data in rows:
+                    last = row_id
+                    yield data
+                if time.time() > next_cleanup:
+                    db.execute('DELETE FROM messages WHERE created<?', (time.time() - self.retention,))
+                    next_cleanup = time.time() + self.retention
+                # Yield to the other greenlets even while messages keep coming
+                self.server.sleep(0 if rows else self.poll_interval)
+        finally:
+            db.close()
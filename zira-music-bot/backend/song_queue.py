@@ -0,0 +1,129 @@
+class Song:
+    """One queue entry. Slotted, so a long queue doesn't pay for a dict per song."""
+
+    __slots__ = ('title', 'artist', 'video_id', 'albumArt', 'src', 'duration', 'requested_by', 'variants')
+
+    def __init__(self, title='Unknown', artist='Unknown', video_id='', albumArt='', src='', duration=None, requested_by=None,
+                 variants=None):
+        self.title = title
+        self.artist = artist
+        self.video_id = video_id
+        self.albumArt = albumArt
+        self.src = src
+        self.duration = duration
+        self.requested_by = requested_by
+        self.variants = variants  # quality label -> src, see renditions.py
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{key: data[key] for key in cls.__slots__ if key in data})
+
+    def to_dict(self):
+        # Same JSON shape the frontends have always received; optional fields are
+        # left out when unset, like songs added through /api/queue used to be.
+        data = {
+            'title': self.title,
+            'artist': self.artist,
+            'video_id': self.video_id,
+            'albumArt': self.albumArt,
+            'src': self.src,
+        }
+        if self.duration is not None:
+            data['duration'] = self.duration
+        if self.requested_by is not None:
+            data['requested_by'] = self.requested_by
+        if self.variants is not None:
+            data['variants'] = self.variants
+        return data
+
+    def get(self, key, default=None):
+        # dict-style access for code that still treats songs as dicts
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+
+class SongQueue:
+    """Ordered list of Songs with a video_id -> position index kept in sync.
+
+    Membership and position lookups are O(1). append and clear are O(1);
+    remove and move only reindex the positions that actually shift.
+    Songs without a video_id aren't indexed: they can't be looked up or
+    deduplicated, and any number of them can be queued.
+    """
+
+    def __init__(self, songs=()):
+        self._songs = []
+        self._positions = {}
+        for song in songs:
+            self.append(song)
+
+    def __len__(self):
+        return len(self._songs)
+
+    def __iter__(self):
+        return iter(self._songs)
+
+    def __getitem__(self, index):
+        return self._songs[index]
+
+    def __contains__(self, video_id):
+        return video_id in self._positions
+
+    def position(self, video_id):
+        """Index of `video_id` in the queue, or None."""
+        return self._positions.get(video_id)
+
+    def video_ids(self):
+        return self._positions.keys()
+
+    def append(self, song):
+        """Add a Song (or song dict) at the end. Returns the Song, or None if it's already queued."""
+        if not isinstance(song, Song):
+            song = Song.from_dict(song)
+        if song.video_id:
+            if song.video_id in self._positions:
+                return None
+            self._positions[song.video_id] = len(self._songs)
+        self._songs.append(song)
+        return song
+
+    def extend(self, songs):
+        for song in songs:
+            self.append(song)
+
+    def remove(self, index):
+        song = self._songs.pop(index)
+        self._positions.pop(song.video_id, None)
+        self._reindex(index, len(self._songs))
+        return song
+
+    def replace(self, index, song):
+        """Put a Song (or song dict) in place of the one at `index`; returns it.
+
+        Its video_id may differ, as long as no other entry has that one.
+        """
+        if not isinstance(song, Song):
+            song = Song.from_dict(song)
+        self._positions.pop(self._songs[index].video_id, None)
+        self._songs[index] = song
+        if song.video_id:
+            self._positions[song.video_id] = index
+        return song
+
+    def move(self, index, to):
+        song = self._songs.pop(index)
+        self._songs.insert(to, song)
+        self._reindex(min(index, to), max(index, to) + 1)
+
+    def clear(self):
+        self._songs.clear()
+        self._positions.clear()
+
+    def _reindex(self, start, stop):
+        songs = self._songs
+        positions = self._positions
+        for i in range(start, min(stop, len(songs))):
+            if songs[i].video_id:
+                positions[songs[i].video_id] = i
+
+    def to_list(self):
+        return [song.to_dict() for song in self._songs]
@@ -0,0 +1,328 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        phone TEXT,
+        song_count INTEGER DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS groups (
+        group_id INTEGER PRIMARY KEY,
+        title TEXT,
+        member_count INTEGER,
+        last_joined TIMESTAMP
+    )''',
+    # Every song request, for history; /stats reads the aggregates below instead
+    '''CREATE TABLE IF NOT EXISTS plays (
+        play_id INTEGER PRIMARY KEY,
+        played_at REAL NOT NULL,
+        user_id INTEGER,
+        chat_id INTEGER,
+        video_id TEXT NOT NULL,
+        title TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS plays_by_time ON plays (played_at)',
+    'CREATE INDEX IF NOT EXISTS plays_by_user ON plays (user_id, played_at)',
+    'CREATE INDEX IF NOT EXISTS plays_by_video ON plays (video_id, played_at)',
+    # Aggregates, updated in the same transaction as the plays they count
+    '''CREATE TABLE IF NOT EXISTS track_plays (
+        video_id TEXT PRIMARY KEY,
+        title TEXT,
+        plays INTEGER NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS track_plays_top ON track_plays (plays DESC)',
+    '''CREATE TABLE IF NOT EXISTS chat_track_plays (
+        chat_id INTEGER NOT NULL,
+        video_id TEXT NOT NULL,
+        title TEXT,
+        plays INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, video_id)
+    )''',
+    'CREATE INDEX IF NOT EXISTS chat_track_plays_top ON chat_track_plays (chat_id, plays DESC)',
+    # Plays per hour (chat_id 0 = all chats), kept for WINDOW_HOURS so a rolling window sums at most that many rows
+    '''CREATE TABLE IF NOT EXISTS play_buckets (
+        chat_id INTEGER NOT NULL,
+        hour INTEGER NOT NULL,
+        plays INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, hour)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS users_counter AFTER INSERT ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name='users';
+    END''',
+)
+# Longest rolling window /stats reports (7 days)
+WINDOW_HOURS = 7 * 24
+ALL_CHATS = 0
+
+UPSERT_USER = '''INSERT INTO users (user_id, first_name, last_name, username, song_count) VALUES (?, ?, ?, ?, 0)
+    ON CONFLICT(user_id) DO UPDATE SET
+        first_name=excluded.first_name, last_name=excluded.last_name, username=excluded.username'''
+ADD_SONGS = 'UPDATE users SET song_count = song_count + ? WHERE user_id=?'
+UPSERT_GROUP = '''INSERT INTO groups (group_id, title, member_count, last_joined) VALUES (?, ?, ?, ?)
+    ON CONFLICT(group_id) DO UPDATE SET
+        title=excluded.title, member_count=excluded.member_count, last_joined=excluded.last_joined'''
+INSERT_PLAY = 'INSERT INTO plays (played_at, user_id, chat_id, video_id, title) VALUES (?, ?, ?, ?, ?)'
+ADD_TRACK_PLAYS = '''INSERT INTO track_plays (video_id, title, plays) VALUES (?, ?, ?)
+    ON CONFLICT(video_id) DO UPDATE SET plays = plays + excluded.plays, title = excluded.title'''
+ADD_CHAT_TRACK_PLAYS = '''INSERT INTO chat_track_plays (chat_id, video_id, title, plays) VALUES (?, ?, ?, ?)
+    ON CONFLICT(chat_id, video_id) DO UPDATE SET plays = plays + excluded.plays, title = excluded.title'''
+ADD_BUCKET_PLAYS = '''INSERT INTO play_buckets (chat_id, hour, plays) VALUES (?, ?, ?)
+    ON CONFLICT(chat_id, hour) DO UPDATE SET plays = plays + excluded.plays'''
+
+
+class UserStore:
+    """Users and groups seen by the bot, with write-behind batching.
+
+    Handlers only record changes in memory (safe from any thread, never blocks
+    on disk). A writer thread folds everything pending into one transaction
+    every `flush_interval` seconds, or sooner once `max_pending` changes are
+    waiting: repeated updates to one user collapse into a single UPSERT and
+    song counts are summed. Plays are appended to the `plays` history and
+    folded into per-track, per-chat and hourly aggregates in the same
+    transaction, so stats() never scans the history. Reads flush first, so
+    they see every write made before them. Anything still pending when the
+    process dies is lost, at most `flush_interval` worth.
+
+    `on_commit(changes)` is called from the writer thread after each batch
+    commits, with the users and groups seen for the first time, the song
+    counts added and the profiles written.
+    """
+
+    def __init__(self, path, flush_interval=0.5, max_pending=1000, on_commit=None):
+        self.path = path
+        self.on_commit = on_commit
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._users = {}  # user_id -> (first_name, last_name, username)
+        self._songs = defaultdict(int)  # user_id -> songs to add
+        self._groups = {}  # group_id -> (title, member_count, last_joined)
+        self._plays = []  # (played_at, user_id, chat_id, video_id, title)
+        self._pending = 0
+        self._flushed = 0  # generation numbers, so flush() can wait for its own data
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            if not db.execute("SELECT 1 FROM counters WHERE name='users'").fetchone():
+                # New counters table on an existing database: count what's there once
+                db.execute("INSERT INTO counters (name, value) SELECT 'users', COUNT(*) FROM users")
+            db.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('plays', 0)")
+        self._writer = threading.Thread(target=self._write_loop, name='user-store-writer', daemon=True)
+        self._writer.start()
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    # --- Writes (buffered) ---
+    def _changed(self):
+        self._pending += 1
+        if self._pending >= self.max_pending:
+            self._cond.notify()
+
+    def log_user(self, user_id, first_name, last_name, username):
+        with self._cond:
+            self._users[user_id] = (first_name, last_name, username)
+            self._changed()
+
+    def add_songs(self, user_id, count=1):
+        with self._cond:
+            self._songs[user_id] += count
+            self._changed()
+
+    def record_play(self, user_id, chat_id, video_id, title=None, played_at=None):
+        """Record one song request; also bumps the user's song_count."""
+        with self._cond:
+            self._plays.append((played_at or time.time(), user_id, chat_id, video_id, title))
+            if user_id is not None:
+                self._songs[user_id] += 1
+            self._changed()
+
+    def log_group(self, group_id, title, member_count=0, joined=None):
+        joined = (joined or datetime.utcnow()).isoformat(sep=' ')
+        with self._cond:
+            self._groups[group_id] = (title, member_count, joined)
+            self._changed()
+
+    @property
+    def pending(self):
+        """Updates not handed to the writer yet."""
+        return self._pending
+
+    def flush(self, timeout=10):
+        """Block until everything recorded so far is committed."""
+        with self._cond:
+            # Pending changes become the next generation; otherwise wait out the one being written
+            target = self._generation + (1 if self._pending else 0)
+            if self._flushed >= target:
+                return
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._flushed >= target or self._closed, timeout)
+
+    def _take(self):
+        batch = (self._users, self._songs, self._groups, self._plays)
+        self._users, self._songs, self._groups, self._plays = {}, defaultdict(int), {}, []
+        self._pending = 0
+        self._generation += 1
+        return self._generation, batch
+
+    def _write_loop(self):
+        # One long-lived connection: sqlite3 keeps the batch statements prepared
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute('PRAGMA synchronous=NORMAL')
+        try:
+            while True:
+                with self._cond:
+                    if not self._closed and self._pending < self.max_pending:
+                        self._cond.wait(self.flush_interval)
+                    closed = self._closed
+                    if not self._pending:
+                        if closed:
+                            return
+                        continue
+                    generation, batch = self._take()
+                changes = None
+                try:
+                    with metrics.sqlite_write('user_store'), db:
+                        changes = self._write_batch(db, *batch)
+                except sqlite3.Error as e:
+                    logger.error(f"Dropped {sum(len(part) for part in batch)} user/group/play updates: {e}")
+                if changes is not None and self.on_commit is not None:
+                    try:
+                        self.on_commit(changes)
+                    except Exception:
+                        logger.exception("on_commit listener failed")
+                with self._cond:
+                    self._flushed = generation
+                    self._cond.notify_all()
+        finally:
+            db.close()
+
+    def _write_batch(self, db, users, songs, groups, plays):
+        changes = None
+        if self.on_commit is not None:
+            changes = {
+                'new_users': {uid: users[uid] for uid in self._unknown(db, 'users', 'user_id', users)},
+                'new_groups': {gid: groups[gid] for gid in self._unknown(db, 'groups', 'group_id', groups)},
+                'songs': dict(songs),
+                'profiles': users,
+            }
+        # Profiles first, so songs for a user first seen in this batch still count
+        db.executemany(UPSERT_USER, [(uid, *profile) for uid, profile in users.items()])
+        db.executemany(ADD_SONGS, [(count, uid) for uid, count in songs.items()])
+        db.executemany(UPSERT_GROUP, [(gid, *group) for gid, group in groups.items()])
+        if plays:
+            self._write_plays(db, plays)
+        return changes
+
+    @staticmethod
+    def _unknown(db, table, key, ids):
+        """The subset of `ids` with no row in `table` yet."""
+        ids = list(ids)
+        known = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ', '.join('?' * len(chunk))
+            known.update(row[0] for row in db.execute(f'SELECT {key} FROM {table} WHERE {key} IN ({marks})', chunk))
+        return [i for i in ids if i not in known]
+
+    def _write_plays(self, db, plays):
+        db.executemany(INSERT_PLAY, plays)
+        tracks, chat_tracks, buckets, titles = Counter(), Counter(), Counter(), {}
+        for played_at, _, chat_id, video_id, title in plays:
+            hour = int(played_at // 3600)
+            titles[video_id] = title
+            tracks[video_id] += 1
+            buckets[ALL_CHATS, hour] += 1
+            if chat_id is not None:
+                chat_tracks[chat_id, video_id] += 1
+                buckets[chat_id, hour] += 1
+        db.executemany(ADD_TRACK_PLAYS, [(vid, titles[vid], n) for vid, n in tracks.items()])
+        db.executemany(ADD_CHAT_TRACK_PLAYS, [(cid, vid, titles[vid], n) for (cid, vid), n in chat_tracks.items()])
+        db.executemany(ADD_BUCKET_PLAYS, [(cid, hour, n) for (cid, hour), n in buckets.items()])
+        db.execute("UPDATE counters SET value = value + ? WHERE name='plays'", (len(plays),))
+        db.execute('DELETE FROM play_buckets WHERE hour <= ?', (int(time.time() // 3600) - WINDOW_HOURS,))
+
+    # --- Reads ---
+    def users(self, limit=-1, offset=0):
+        self.flush()
+        with self._connect() as db:
+            return db.execute('SELECT user_id, first_name, last_name, username, song_count FROM users '
+                              'ORDER BY user_id LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+
+    def groups(self, limit=-1, offset=0):
+        self.flush()
+        with self._connect() as db:
+            return db.execute('SELECT group_id, title, member_count, last_joined FROM groups '
+                              'ORDER BY group_id LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+
+    def counts(self):
+        """(users, groups)"""
+        self.flush()
+        with self._connect() as db:
+            users = db.execute("SELECT value FROM counters WHERE name='users'").fetchone()[0]
+            return users, db.execute('SELECT COUNT(*) FROM groups').fetchone()[0]
+
+    def stats(self, chat_id=None, top=5):
+        """Totals, rolling 24h/7d play counts and top tracks, overall and for `chat_id`.
+
+        Every query reads a counter, at most WINDOW_HOURS bucket rows or `top`
+        index entries, however long the play history gets.
+        """
+        self.flush()
+        hour = int(time.time() // 3600)
+        chat_ids = [ALL_CHATS] + ([chat_id] if chat_id is not None else [])
+        with self._connect() as db:
+            counters = dict(db.execute('SELECT name, value FROM counters'))
+            windows = {}
+            for cid in chat_ids:
+                windows[cid] = [
+                    db.execute('SELECT COALESCE(SUM(plays), 0) FROM play_buckets WHERE chat_id=? AND hour > ?',
+                               (cid, hour - hours)).fetchone()[0]
+                    for hours in (24, WINDOW_HOURS)
+                ]
+            result = {
+                'users': counters.get('users', 0),
+                'plays': counters.get('plays', 0),
+                'plays_24h': windows[ALL_CHATS][0],
+                'plays_7d': windows[ALL_CHATS][1],
+                'top_tracks': db.execute(
+                    'SELECT title, plays FROM track_plays ORDER BY plays DESC LIMIT ?', (top,)).fetchall(),
+            }
+            if chat_id is not None:
+                result['chat_plays_24h'], result['chat_plays_7d'] = windows[chat_id]
+                result['chat_top_tracks'] = db.execute(
+                    'SELECT title, plays FROM chat_track_plays WHERE chat_id=? ORDER BY plays DESC LIMIT ?',
+                    (chat_id, top)).fetchall()
+        return result
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SEARCHING = 'searching'
+DOWNLOADING = 'downloading'
+PROCESSING = 'processing'
+
+_job_ids = itertools.count(1)
+
+# How long calls wait for a free worker; the work itself is timed in music_manager
+QUEUE_WAIT_SECONDS = metrics.histogram('ytdlp_queue_wait_seconds', 'Time yt-dlp calls wait for a free bot worker')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class YtdlpJob:
+    """Progress and cancellation state for one /play request.
+
+    Worker threads write `state`/`percent` (plain attribute stores, so no lock)
+    and poll `should_cancel`; the bot's event loop reads them to edit the
+    progress message and calls `cancel()`.
+    """
+
+    def __init__(self, chat_id=None):
+        self.id = str(next(_job_ids))
+        self.chat_id = chat_id
+        self.state = QUEUED
+        self.percent = None
+        self._cancelled = threading.Event()
+        self._cancel_waiter = None  # asyncio.Event, created on the loop by run()
+
+    def progress(self, state, percent=None):
+        self.state = state
+        self.percent = percent
+
+    def should_cancel(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel from the event loop thread (Cancel button, deleted message, timeout)."""
+        self._cancelled.set()
+        if self._cancel_waiter is not None:
+            self._cancel_waiter.set()
+
+
+class YtdlpExecutor:
+    """Runs blocking yt-dlp work (search, download, transcode) off the event loop.
+
+    At most `max_workers` calls run at once, the rest wait their turn in the
+    pool's queue. A call that outlives its timeout, or whose job is cancelled,
+    returns to the handler straight away; the worker thread stops at yt-dlp's
+    next progress hook. Threads rather than processes, so concurrent requests
+    for one track still share music_manager's single-flight download.
+    """
+
+    def __init__(self, max_workers=2, timeout=300):
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ytdlp')
+        self._jobs = {}
+
+    def new_job(self, chat_id=None):
+        job = YtdlpJob(chat_id)
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    async def run(self, fn, *args, job=None, state=None, timeout=None, **kwargs):
+        """Await fn(*args, **kwargs) on a worker thread.
+
+        `job.state` is set to `state` once a worker picks the call up. Raises
+        JobCancelled if `job` is cancelled first, TimeoutError after `timeout`
+        seconds (default: the executor's), and whatever fn raises.
+        """
+        loop = asyncio.get_running_loop()
+        if job is not None and job._cancel_waiter is None:
+            job._cancel_waiter = asyncio.Event()
+            if job.should_cancel():
+                job._cancel_waiter.set()
+
+        submitted = time.perf_counter()
+
+        def call():
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - submitted)
+            if job is not None and job.should_cancel():
+                raise JobCancelled()
+            if job is not None and state is not None:
+                job.progress(state)
+            return fn(*args, **kwargs)
+
+        future = loop.run_in_executor(self._pool, call)
+        waiters = {future}
+        cancel_waiter = None
+        if job is not None:
+            cancel_waiter = loop.create_task(job._cancel_waiter.wait())
+            waiters.add(cancel_waiter)
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=timeout or self.timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if cancel_waiter is not None:
+                cancel_waiter.cancel()
+        if future in done:
+            return future.result()
+        cancelled = cancel_waiter is not None and cancel_waiter in done
+        # Not picked up yet: drop it from the pool queue. Already running: let the
+        # cancel flag stop it, and swallow whatever it ends with.
+        future.cancel()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if job is not None:
+            job.cancel()
+        if cancelled:
+            raise JobCancelled()
+        raise TimeoutError(f'{getattr(fn, "__name__", "job")} took longer than {timeout or self.timeout}s')
+
+    def finish(self, job):
+        self._jobs.pop(job.id, None)
+
+    def shutdown(self, *args):
+        for job in list(self._jobs.values()):
+            job.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -201,6 +201,21 @@ const songs = [
   { title: 'Track 3', artist: 'Artist 3', src: '/static/mp3/a0goLSCAcBw.mp3', albumArt: 'assets/images/default_album_art.png' }
 ];
 let currentSongIndex = 0;
+
+// Ask for a lighter rendition on slow or data-saving connections (transcoded on demand by the server)
+function audioSrc(song) {
+  const connection = navigator.connection || {};
+  let quality = null;
+  if (connection.saveData || ['slow-2g', '2g'].includes(connection.effectiveType)) {
+    quality = '64';
+  } else if (connection.effectiveType === '3g') {
+    quality = '128';
+  }
+  if (!quality || !song.src || !song.src.includes('/static/mp3/') || song.src.includes('?')) {
+    return song.src;
+  }
+  return `${song.src}?quality=${quality}`;
+}
 let isUserSeeking = false;
 
 function renderPlaylist() {
@@ -217,7 +232,7 @@ function renderPlaylist() {
 function playSong(idx) {
   currentSongIndex = idx;
   const song = songs[idx];
-  audioPlayer.src = song.src;
+  audioPlayer.src = audioSrc(song);
   trackTitle.textContent = song.title;
   trackArtist.textContent = song.artist;
   albumArt.src = song.albumArt;
@@ -419,7 +434,7 @@ function renderMultipleResults(results) {
     `;
     // Launch Room button
     li.querySelector('.launch-btn').onclick = () => {
-      audioPlayer.src = song.src;
+      audioPlayer.src = audioSrc(song);
       audioPlayer.style.display = 'block';
       audioPlayer.play();
       showToast(`Now playing: ${song.title} - ${song.artist}`);
@@ -506,7 +521,7 @@ async function personalRecommend() {
   const data = await response.json();
   if (data.recommendations && data.recommendations.length > 0) {
     const song = data.recommendations[0];
-    audioPlayer.src = song.src;
+    audioPlayer.src = audioSrc(song);
     audioPlayer.style.display = 'block';
     audioPlayer.play();
     showToast(`Recommended: ${song.title} - ${song.artist}`);
@@ -530,7 +545,7 @@ async function aiPlayRequestWithQuery(query) {
   });
   const data = await response.json();
   if (data.song) {
-    audioPlayer.src = data.song.src;
+    audioPlayer.src = audioSrc(data.song);
     audioPlayer.style.display = 'block';
     audioPlayer.play();
     showToast(`Now playing: ${data.song.title} - ${data.song.artist}`);